@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # The receivers in signals.py only run because of this import; the
+        # original module was never imported. Connecting it switched on the
+        # booking, payment and review notifications and emails. The original
+        # create_driver_profile receiver was dropped instead (see signals.py).
+        from . import signals  # noqa: F401
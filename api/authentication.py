@@ -0,0 +1,73 @@
+# authentication.py
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from .lookups import get_password_digest, get_user
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that reads the token's user through the lookup cache
+
+    The cached user has no password hash; with CHECK_REVOKE_TOKEN the
+    token is checked against the separately cached digest of it.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = get_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_password_digest(user.id):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Channels middleware authenticating WebSockets with the REST API's JWTs
+
+    The access token is read from an `Authorization: Bearer <token>`
+    header or, for browsers, which cannot set headers on a WebSocket, a
+    ?token=<token> query parameter. A valid token sets scope['user']; an
+    invalid one leaves an AnonymousUser, so the consumer refuses the
+    socket. Without a token the session user set by AuthMiddlewareStack
+    is kept.
+    """
+
+    async def __call__(self, scope, receive, send):
+        raw_token = self.get_raw_token(scope)
+        if raw_token is not None:
+            scope = dict(scope, user=await self.authenticate(raw_token))
+        return await super().__call__(scope, receive, send)
+
+    def get_raw_token(self, scope):
+        for name, value in scope.get('headers', []):
+            if name == b'authorization':
+                parts = value.split()
+                if len(parts) == 2 and parts[0].decode() in api_settings.AUTH_HEADER_TYPES:
+                    return parts[1]
+                return None
+        tokens = parse_qs(scope.get('query_string', b'').decode()).get('token')
+        return tokens[0].encode() if tokens else None
+
+    @database_sync_to_async
+    def authenticate(self, raw_token):
+        authentication = CachedJWTAuthentication()
+        try:
+            return authentication.get_user(authentication.get_validated_token(raw_token))
+        except (TokenError, InvalidToken, AuthenticationFailed):
+            return AnonymousUser()
@@ -0,0 +1,36 @@
+# booking_state.py
+from .models import Booking
+
+# action -> (statuses it may start from, status it moves to)
+TRANSITIONS = {
+    'accept': (('pending',), 'accepted'),
+    'start_trip': (('accepted',), 'in_progress'),
+    'complete_trip': (('in_progress',), 'completed'),
+    'cancel': (('pending', 'accepted'), 'cancelled'),
+}
+
+class InvalidTransition(Exception):
+    """The booking is not in a state the action can start from"""
+
+    def __init__(self, action, status):
+        self.action = action
+        self.status = status
+        super().__init__(f"Cannot {action.replace('_', ' ')} a booking that is {status}")
+
+def transition_booking(booking, action):
+    """
+    Move a booking along the state machine with one conditional UPDATE
+
+    The status column is only written if it still holds one of the
+    action's source states, so of several concurrent requests exactly one
+    wins and no row lock is held beyond the statement itself.
+
+    Raises:
+        InvalidTransition: the booking was (or concurrently became) in a
+            state the action cannot start from
+    """
+    sources, target = TRANSITIONS[action]
+    if not Booking.objects.filter(pk=booking.pk, status__in=sources).update(status=target):
+        current = Booking.objects.filter(pk=booking.pk).values_list('status', flat=True).first()
+        raise InvalidTransition(action, current)
+    booking.status = target
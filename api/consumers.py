@@ -1,12 +1,62 @@
 import json
+import time
+from urllib.parse import parse_qs
+import msgpack
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import User, DriverProfile
+from django.conf import settings
+from .models import User, DriverProfile, Notification
+from .serializers import NotificationSerializer
+from .ingest import location_buffer
+from .location_store import is_valid_position
+from .utils import haversine_distance
+
+# Clients offering this subprotocol exchange msgpack [latitude, longitude,
+# timestamp_ms] binary frames instead of JSON objects
+MSGPACK_SUBPROTOCOL = 'location.msgpack'
+
+class LocationThrottle:
+    """
+    Deadband for location fan-out
+
+    A fix is broadcast when the driver has moved at least min_distance_m
+    since the last broadcast, or heartbeat_s has passed, but never more
+    often than every min_interval_s.
+    """
+
+    def __init__(self, min_distance_m=10, min_interval_s=1.0, heartbeat_s=10.0):
+        self.min_distance_m = min_distance_m
+        self.min_interval_s = min_interval_s
+        self.heartbeat_s = heartbeat_s
+        self.last = None
+
+    def allow(self, latitude, longitude, now=None):
+        now = time.monotonic() if now is None else now
+        if self.last is not None:
+            last_lat, last_lng, last_time = self.last
+            elapsed = now - last_time
+            if elapsed < self.min_interval_s:
+                return False
+            if elapsed < self.heartbeat_s:
+                moved_m = haversine_distance(last_lng, last_lat, longitude, latitude) * 1000
+                if moved_m < self.min_distance_m:
+                    return False
+        self.last = (latitude, longitude, now)
+        return True
 
 class LocationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.user_id = self.scope['url_route']['kwargs']['user_id']
         self.room_group_name = f'location_{self.user_id}'
+        self.driver_id = await self.get_driver_id(self.user_id)
+        self.compact = MSGPACK_SUBPROTOCOL in self.scope.get('subprotocols', [])
+        
+        broadcast = getattr(settings, 'LOCATION_BROADCAST', {})
+        self.throttle = LocationThrottle(
+            min_distance_m=broadcast.get('MIN_DISTANCE_METERS', 10),
+            min_interval_s=broadcast.get('MIN_INTERVAL_SECONDS', 1.0),
+            heartbeat_s=broadcast.get('HEARTBEAT_SECONDS', 10.0),
+        )
         
         # Join room group
         await self.channel_layer.group_add(
@@ -14,7 +64,7 @@ class LocationConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         
-        await self.accept()
+        await self.accept(subprotocol=MSGPACK_SUBPROTOCOL if self.compact else None)
     
     async def disconnect(self, close_code):
         # Leave room group
@@ -22,26 +72,32 @@ class LocationConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
+        
+        # Don't leave this driver's last fixes waiting for the timer
+        await location_buffer.flush()
     
     # Receive message from WebSocket
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        fix = self.decode_fix(text_data, bytes_data)
+        if fix is None:
+            return
+        latitude, longitude, timestamp = fix
+        
+        # Buffer the driver location; it is written to the database in batches
+        self.update_driver_location(latitude, longitude)
         
-        # Update driver location in database
-        if 'latitude' in data and 'longitude' in data:
-            await self.update_driver_location(
-                self.user_id, 
-                data['latitude'], 
-                data['longitude']
-            )
+        # Skip the fan-out for pings that barely moved
+        if not self.throttle.allow(latitude, longitude):
+            return
         
         # Send location to room group
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'location_update',
-                'latitude': data['latitude'],
-                'longitude': data['longitude']
+                'latitude': latitude,
+                'longitude': longitude,
+                'timestamp': timestamp
             }
         )
     
@@ -50,18 +106,115 @@ class LocationConsumer(AsyncWebsocketConsumer):
         latitude = event['latitude']
         longitude = event['longitude']
         
-        # Send message to WebSocket
+        # Send message to WebSocket in the format the client negotiated
+        if self.compact:
+            await self.send(bytes_data=msgpack.packb([latitude, longitude, event.get('timestamp')]))
+        else:
+            await self.send(text_data=json.dumps({
+                'latitude': latitude,
+                'longitude': longitude
+            }))
+    
+    def decode_fix(self, text_data, bytes_data):
+        """
+        Parse an inbound frame into (latitude, longitude, timestamp_ms)
+
+        JSON frames are {"latitude": .., "longitude": ..}; compact frames are
+        msgpack [latitude, longitude] or [latitude, longitude, timestamp_ms].
+        Returns None for frames without a valid position: non-finite or
+        off the globe, or beyond the latitudes the location store indexes.
+        """
+        try:
+            if bytes_data is not None:
+                data = msgpack.unpackb(bytes_data)
+                latitude, longitude = data[0], data[1]
+                timestamp = data[2] if len(data) > 2 else None
+            else:
+                data = json.loads(text_data)
+                latitude, longitude = data['latitude'], data['longitude']
+                timestamp = None
+            latitude, longitude = float(latitude), float(longitude)
+            timestamp = int(timestamp if timestamp is not None else time.time() * 1000)
+        except (ValueError, TypeError, KeyError, IndexError, msgpack.UnpackException):
+            return None
+        if not is_valid_position(latitude, longitude):
+            return None
+        return latitude, longitude, timestamp
+    
+    def update_driver_location(self, latitude, longitude):
+        if self.driver_id is not None:
+            location_buffer.add(self.driver_id, latitude, longitude)
+    
+    @database_sync_to_async
+    def get_driver_id(self, user_id):
+        return DriverProfile.objects.filter(user_id=user_id).values_list('id', flat=True).first()
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """
+    Pushes a user's notifications as they are created
+
+    A reconnecting client passes the last notification id it saw as
+    ?last_id=N and first gets a replay frame with everything newer (oldest
+    first) before live pushes resume. Replays are capped at MAX_REPLAY of
+    the newest missed notifications; truncated=true tells the client to
+    page through GET /notifications/ for the rest.
+    """
+
+    async def connect(self):
+        self.user_id = int(self.scope['url_route']['kwargs']['user_id'])
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated or user.id != self.user_id:
+            await self.close(code=4403)
+            return
+        
+        self.group_name = f'notifications_{self.user_id}'
+        self.last_sent_id = 0
+        
+        # Join before reading the backlog so nothing created in between is lost;
+        # pushes already covered by the replay are skipped by id
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        
+        last_id = self.get_last_id()
+        if last_id is not None:
+            notifications, truncated = await self.get_missed(last_id)
+            if notifications:
+                self.last_sent_id = notifications[-1]['id']
+            await self.send(text_data=json.dumps({
+                'type': 'replay',
+                'notifications': notifications,
+                'truncated': truncated
+            }))
+    
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+    
+    # Receive message from room group
+    async def notification_created(self, event):
+        notification = event['notification']
+        if notification['id'] <= self.last_sent_id:
+            return
+        self.last_sent_id = notification['id']
         await self.send(text_data=json.dumps({
-            'latitude': latitude,
-            'longitude': longitude
+            'type': 'notification',
+            'notification': notification
         }))
     
-    @database_sync_to_async
-    def update_driver_location(self, user_id, latitude, longitude):
+    def get_last_id(self):
+        values = parse_qs(self.scope.get('query_string', b'').decode()).get('last_id')
         try:
-            driver_profile = DriverProfile.objects.get(user_id=user_id)
-            driver_profile.current_latitude = float(latitude)
-            driver_profile.current_longitude = float(longitude)
-            driver_profile.save()
-        except DriverProfile.DoesNotExist:
-            pass
\ No newline at end of file
+            return int(values[0]) if values else None
+        except ValueError:
+            return None
+    
+    @database_sync_to_async
+    def get_missed(self, last_id):
+        max_replay = getattr(settings, 'NOTIFICATION_STREAM', {}).get('MAX_REPLAY', 100)
+        missed = list(
+            Notification.objects.filter(user_id=self.user_id, id__gt=last_id).order_by('-id')[:max_replay + 1]
+        )
+        truncated = len(missed) > max_replay
+        missed = missed[:max_replay]
+        missed.reverse()
+        return NotificationSerializer(missed, many=True).data, truncated
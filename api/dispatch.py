@@ -0,0 +1,283 @@
+# dispatch.py
+import time
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from .utils import haversine_distances, bounding_box
+from .location_store import get_location_store, forget_driver, sync_driver_profile
+from .notifications import notify
+
+# Bookings in these states keep their driver busy
+ACTIVE_STATUSES = ('pending', 'accepted', 'in_progress')
+
+def greedy_assignment(cost):
+    """
+    Repeatedly take the cheapest remaining (row, col) pair
+
+    Args:
+        cost: (rows, cols) array; np.inf marks pairs that must not match
+
+    Returns:
+        List of (row, col) pairs
+    """
+    rows, cols = np.nonzero(np.isfinite(cost))
+    order = np.argsort(cost[rows, cols], kind='stable')
+    used_rows, used_cols, pairs = set(), set(), []
+    for row, col in zip(rows[order].tolist(), cols[order].tolist()):
+        if row not in used_rows and col not in used_cols:
+            used_rows.add(row)
+            used_cols.add(col)
+            pairs.append((row, col))
+    return pairs
+
+def optimal_assignment(cost):
+    """
+    Minimum-cost assignment (Hungarian method, shortest augmenting paths)
+
+    O(n^2 m) for n = min(rows, cols); each augmenting step updates all
+    column potentials in one vectorized pass. Matches as many rows as
+    possible, then minimises the total cost of those matches.
+
+    Args:
+        cost: (rows, cols) array; np.inf marks pairs that must not match
+
+    Returns:
+        List of (row, col) pairs
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    if cost.size == 0:
+        return []
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+
+    # Forbidden pairs get a cost larger than any full feasible assignment,
+    # so they are only used when a row cannot be matched otherwise
+    finite = np.isfinite(cost)
+    forbidden = (np.abs(cost[finite]).sum() + 1) * (cost.shape[0] + 1) if finite.any() else 1.0
+    cost = np.where(finite, cost, forbidden)
+
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    owner = np.zeros(m + 1, dtype=np.int64)  # column -> 1-based row, 0 = free
+    way = np.zeros(m + 1, dtype=np.int64)
+    for row in range(1, n + 1):
+        owner[0] = row
+        col = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while owner[col] != 0:
+            used[col] = True
+            current = owner[col]
+            free = ~used
+            reduced = cost[current - 1] - u[current] - v[1:]
+            better = free[1:] & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = col
+            candidates = np.where(free, minv, np.inf)
+            candidates[0] = np.inf
+            next_col = int(np.argmin(candidates))
+            delta = candidates[next_col]
+            u[owner[used]] += delta
+            v[used] -= delta
+            minv[free] -= delta
+            col = next_col
+        while col:
+            previous = way[col]
+            owner[col] = owner[previous]
+            col = previous
+
+    pairs = []
+    for col in range(1, m + 1):
+        row = owner[col] - 1
+        if row >= 0 and finite[row, col - 1]:
+            pairs.append((col - 1, row) if transposed else (row, col - 1))
+    return sorted(pairs)
+
+SOLVERS = {
+    'greedy': greedy_assignment,
+    'optimal': optimal_assignment,
+}
+
+class DispatchEngine:
+    """
+    Batch matcher for unassigned bookings
+
+    Each dispatch() round takes the pending bookings without a driver,
+    finds available drivers within radius_km of any pickup, and solves the
+    assignment with pickup distance (haversine, km) as the cost: 'greedy'
+    takes the closest pairs first, 'optimal' minimises the total pickup
+    distance of the batch. Matches are written under select_for_update,
+    so a booking or driver claimed concurrently is skipped rather than
+    double-booked.
+    """
+
+    def __init__(self, radius_km=5.0, mode='optimal', max_batch=200):
+        if mode not in SOLVERS:
+            raise ValueError(f"Unknown dispatch mode {mode!r}; expected one of {sorted(SOLVERS)}")
+        self.radius_km = radius_km
+        self.mode = mode
+        self.max_batch = max_batch
+
+    def pending_bookings(self):
+        from .models import Booking
+
+        return list(
+            Booking.objects.filter(status='pending', driver__isnull=True).order_by('booking_time', 'id')[:self.max_batch]
+        )
+
+    def candidate_drivers(self, bookings):
+        """Available, idle drivers within radius_km of at least one pickup"""
+        from .models import Booking, DriverProfile
+
+        store = get_location_store()
+        if store is not None:
+            positions = {}
+            for booking in bookings:
+                for driver_id, _, (lat, lng, _) in store.search(
+                    booking.pickup_latitude, booking.pickup_longitude, self.radius_km
+                ):
+                    positions[driver_id] = (lat, lng)
+            drivers = list(DriverProfile.objects.filter(is_available=True).in_bulk(list(positions)).values())
+            for driver in drivers:
+                driver.current_latitude, driver.current_longitude = positions[driver.id]
+        else:
+            boxes = np.array([
+                bounding_box(booking.pickup_latitude, booking.pickup_longitude, self.radius_km)
+                for booking in bookings
+            ])
+            queryset = DriverProfile.objects.available().filter(
+                current_latitude__range=(boxes[:, 0].min(), boxes[:, 1].max())
+            )
+            min_lng, max_lng = boxes[:, 2].min(), boxes[:, 3].max()
+            if min_lng >= -180 and max_lng <= 180:
+                queryset = queryset.filter(current_longitude__range=(min_lng, max_lng))
+            drivers = list(queryset)
+
+        busy = set(
+            Booking.objects.filter(driver_id__in=[driver.user_id for driver in drivers], status__in=ACTIVE_STATUSES)
+            .values_list('driver_id', flat=True)
+        )
+        return [driver for driver in drivers if driver.user_id not in busy]
+
+    def match(self, bookings, drivers):
+        """
+        Solve the assignment for one batch
+
+        Returns:
+            List of (booking, driver, pickup_distance_km) tuples
+        """
+        if not bookings or not drivers:
+            return []
+        lats = np.array([driver.current_latitude for driver in drivers], dtype=np.float64)
+        lngs = np.array([driver.current_longitude for driver in drivers], dtype=np.float64)
+        cost = np.vstack([
+            haversine_distances(booking.pickup_longitude, booking.pickup_latitude, lngs, lats)
+            for booking in bookings
+        ])
+        cost[cost > self.radius_km] = np.inf
+        return [
+            (bookings[row], drivers[col], float(cost[row, col]))
+            for row, col in SOLVERS[self.mode](cost)
+        ]
+
+    def assign(self, matches):
+        """
+        Write matches, skipping any booking or driver claimed since they were read
+
+        Returns:
+            The subset of matches that was applied
+        """
+        from .models import Booking, DriverProfile
+
+        if not matches:
+            return []
+        with transaction.atomic():
+            # Lock in a fixed order (bookings, then drivers, each by id)
+            open_bookings = set(
+                Booking.objects.select_for_update()
+                .filter(id__in=[booking.id for booking, _, _ in matches], status='pending', driver__isnull=True)
+                .order_by('id').values_list('id', flat=True)
+            )
+            free_drivers = set(
+                DriverProfile.objects.select_for_update()
+                .filter(id__in=[driver.id for _, driver, _ in matches], is_available=True)
+                .order_by('id').values_list('id', flat=True)
+            )
+            busy = set(
+                Booking.objects.filter(driver_id__in=[driver.user_id for _, driver, _ in matches], status__in=ACTIVE_STATUSES)
+                .values_list('driver_id', flat=True)
+            )
+            applied = [
+                (booking, driver, distance) for booking, driver, distance in matches
+                if booking.id in open_bookings and driver.id in free_drivers and driver.user_id not in busy
+            ]
+            for booking, driver, _ in applied:
+                booking.driver_id = driver.user_id
+                booking.dispatched = True
+            Booking.objects.bulk_update([booking for booking, _, _ in applied], ['driver', 'dispatched'])
+            DriverProfile.objects.filter(id__in=[driver.id for _, driver, _ in applied]).update(is_available=False)
+
+            for booking, driver, distance in applied:
+                notify(driver.user_id, "New Booking Request",
+                       f"New pickup {distance:.1f} km away at {booking.pickup_address}", booking.id)
+                notify(booking.user_id, "Driver Assigned",
+                       f"A driver is {distance:.1f} km from your pickup", booking.id)
+                # Off the market until the trip is over
+                transaction.on_commit(lambda driver_id=driver.id: forget_driver(driver_id))
+        return applied
+
+    def dispatch(self):
+        """
+        Run one matching round over the pending bookings
+
+        Returns:
+            Dict with the assignments and the round's counters: requests,
+            drivers considered, assigned, total_pickup_km, solve_ms, elapsed_ms
+        """
+        start = time.perf_counter()
+        bookings = self.pending_bookings()
+        drivers = self.candidate_drivers(bookings) if bookings else []
+
+        solve_start = time.perf_counter()
+        matches = self.match(bookings, drivers)
+        solve_ms = (time.perf_counter() - solve_start) * 1000
+
+        applied = self.assign(matches)
+        return {
+            'assignments': [(booking.id, driver.id, round(distance, 3)) for booking, driver, distance in applied],
+            'requests': len(bookings),
+            'drivers': len(drivers),
+            'assigned': len(applied),
+            'total_pickup_km': round(sum(distance for _, _, distance in applied), 3),
+            'solve_ms': round(solve_ms, 3),
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 3),
+        }
+
+
+def release_driver(booking):
+    """
+    Put a booking's driver back on the market once it is completed or
+    cancelled, undoing assign()
+
+    Only a dispatched booking took its driver off the market, so only
+    then is the profile marked available again, unless another
+    dispatched booking still holds them. A driver on a booking they
+    picked themselves keeps whatever availability they set. The
+    profile returns to the live location store when the transaction
+    commits.
+    """
+    from .models import Booking, DriverProfile
+
+    if not booking.dispatched or booking.driver_id is None:
+        return
+    driver_user_id = booking.driver_id
+    # One UPDATE, skipped while another dispatched booking is active
+    released = DriverProfile.objects.filter(user_id=driver_user_id, is_available=False).filter(
+        ~Exists(Booking.objects.filter(driver_id=OuterRef('user_id'), dispatched=True,
+                                       status__in=ACTIVE_STATUSES).exclude(id=booking.id))
+    ).update(is_available=True)
+    if released:
+        transaction.on_commit(lambda: sync_driver_profile(DriverProfile.objects.get(user_id=driver_user_id)))
@@ -0,0 +1,152 @@
+# fares.py
+from datetime import date
+from decimal import Decimal
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from .utils import haversine_distances
+
+HOURS_PER_WEEK = 7 * 24
+
+def to_cents(amount):
+    """Exact number of cents in a money amount given as a string or Decimal"""
+    cents = Decimal(str(amount)) * 100
+    if cents != cents.to_integral_value():
+        raise ValueError(f"{amount} is not a whole number of cents")
+    return int(cents)
+
+def week_slot(when):
+    """Hour of the week (0 = Monday 00:00) in the current time zone"""
+    when = timezone.localtime(when)
+    return when.weekday() * 24 + when.hour
+
+class FareEngine:
+    """
+    Prices trips from one tariff, exactly and many at a time
+
+    fare = (base_fare + per_km * km + per_minute * minutes)
+           * surge(hour of week) * (1 - plan discount)
+
+    rounded half up to the cent, and never below minimum_fare. Distances
+    are taken to the metre and durations to the second, so with rates
+    held as integer cents the whole formula runs on int64 arrays without
+    any float rounding. The combined surge and discount multiplier for
+    each (plan, hour of week) is compiled once into lookup tables.
+
+    Args:
+        surge: List of {'days': [...], 'hours': (start, end), 'multiplier': ...}
+            rules; days are 0 = Monday, hours a [start, end) range. Where
+            rules overlap the highest multiplier applies.
+        plan_discounts: Subscription plan -> fraction off, e.g. '0.10'
+        route_factor: Road distance per km of straight-line distance, for estimates
+        average_speed_kmh: Assumed speed when estimating duration
+    """
+
+    def __init__(self, base_fare='5.00', per_km='1.50', per_minute='0.25', minimum_fare='5.00',
+                 surge=(), plan_discounts=None, route_factor=1.3, average_speed_kmh=30):
+        self.base_cents = to_cents(base_fare)
+        self.per_km_cents = to_cents(per_km)
+        self.per_minute_cents = to_cents(per_minute)
+        self.minimum_cents = to_cents(minimum_fare)
+        self.route_factor = route_factor
+        self.average_speed_kmh = average_speed_kmh
+
+        self.surge = [Decimal(1)] * HOURS_PER_WEEK
+        for rule in surge:
+            multiplier = Decimal(str(rule['multiplier']))
+            start, end = rule['hours']
+            for day in rule['days']:
+                for hour in range(start, end):
+                    slot = day * 24 + hour
+                    self.surge[slot] = max(self.surge[slot], multiplier)
+
+        self.discounts = {plan: Decimal(str(discount)) for plan, discount in (plan_discounts or {}).items()}
+        # plan -> (numerators, denominators) of the multiplier per hour of week
+        self._tables = {
+            plan: self._compile(Decimal(1) - self.discounts.get(plan, Decimal(0)))
+            for plan in [None, *self.discounts]
+        }
+
+    def _compile(self, discount_factor):
+        ratios = [(surge * discount_factor).as_integer_ratio() for surge in self.surge]
+        return np.array([n for n, _ in ratios], dtype=np.int64), np.array([d for _, d in ratios], dtype=np.int64)
+
+    def multiplier(self, when=None, plan=None):
+        """Combined surge and plan discount in effect at when (default now)"""
+        numerators, denominators = self._tables.get(plan, self._tables[None])
+        slot = week_slot(when or timezone.now())
+        return Decimal(int(numerators[slot])) / Decimal(int(denominators[slot]))
+
+    def price(self, distances_km, durations_minutes, when=None, plan=None):
+        """
+        Fares for many trips starting at the same time
+
+        Args:
+            distances_km, durations_minutes: Equal-length array-likes
+            when: Start time; defaults to now
+            plan: Subscription plan of the rider, if any
+
+        Returns:
+            List of Decimal fares, one per trip
+        """
+        metres = np.rint(np.asarray(distances_km, dtype=np.float64) * 1000).astype(np.int64)
+        seconds = np.rint(np.asarray(durations_minutes, dtype=np.float64) * 60).astype(np.int64)
+        numerators, denominators = self._tables.get(plan, self._tables[None])
+        slot = week_slot(when or timezone.now())
+
+        # Cents scaled by 60000 (1000 m per km, 60 s per minute)
+        scaled = (self.base_cents * 60000
+                  + self.per_km_cents * metres * 60
+                  + self.per_minute_cents * seconds * 1000)
+        scaled *= numerators[slot]
+        divisor = 60000 * denominators[slot]
+        # Round half up with integer division
+        cents = np.maximum((2 * scaled + divisor) // (2 * divisor), self.minimum_cents)
+        return [Decimal(int(value)).scaleb(-2) for value in cents]
+
+    def trip_fare(self, distance_km, duration_minutes, when=None, plan=None):
+        """Fare of a single trip"""
+        return self.price([distance_km], [duration_minutes], when, plan)[0]
+
+    def estimate(self, pickups, destinations, when=None, plan=None):
+        """
+        Quote trips between pickup and destination pairs in one pass
+
+        Args:
+            pickups, destinations: (n, 2) array-likes of (lat, lng)
+
+        Returns:
+            Dict of distances_km and durations_minutes (numpy arrays) and fares
+        """
+        pickups = np.asarray(pickups, dtype=np.float64).reshape(-1, 2)
+        destinations = np.asarray(destinations, dtype=np.float64).reshape(-1, 2)
+        distances = haversine_distances(
+            pickups[:, 1], pickups[:, 0], destinations[:, 1], destinations[:, 0]
+        ) * self.route_factor
+        durations = distances / self.average_speed_kmh * 60
+        return {
+            'distances_km': distances,
+            'durations_minutes': durations,
+            'fares': self.price(distances, durations, when, plan),
+        }
+
+    def plan_for(self, user_id, today=None):
+        """The rider's active subscription plan with the largest discount, or None"""
+        from .lookups import get_active_subscriptions
+
+        today = today or date.today()
+        plans = [plan for plan, start, end in get_active_subscriptions(user_id) if start <= today <= end]
+        return max(plans, key=lambda plan: self.discounts.get(plan, Decimal(0)), default=None)
+
+
+_fare_config = getattr(settings, 'FARES', {})
+fare_engine = FareEngine(
+    base_fare=_fare_config.get('BASE_FARE', '5.00'),
+    per_km=_fare_config.get('PER_KM', '1.50'),
+    per_minute=_fare_config.get('PER_MINUTE', '0.25'),
+    minimum_fare=_fare_config.get('MINIMUM_FARE', '5.00'),
+    surge=_fare_config.get('SURGE', ()),
+    plan_discounts=_fare_config.get('PLAN_DISCOUNTS', {}),
+    route_factor=_fare_config.get('ROUTE_FACTOR', 1.3),
+    average_speed_kmh=_fare_config.get('AVERAGE_SPEED_KMH', 30),
+)
@@ -0,0 +1,237 @@
+# geocoding.py
+import asyncio
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+import requests
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+NOT_FOUND = (None, None)
+
+def normalize_address(address):
+    """Cache key for an address: case-folded, with runs of spaces and commas collapsed"""
+    return re.sub(r'[\s,]+', ' ', address).strip(' .').casefold()[:255]
+
+class GeocodingError(Exception):
+    """A lookup failed for a reason worth retrying later (network, quota); never cached"""
+
+class Geocoder:
+    """
+    Google geocoding behind a two-tier cache
+
+    Lookups check an in-process LRU of cache_size entries, then the
+    GeocodedAddress table, and only then call the API. Results are kept
+    for ttl seconds; addresses Google has no match for are remembered as
+    (None, None) for negative_ttl seconds. Failed requests are not cached.
+
+    Requests share one pooled Session, time out after timeout seconds and
+    are retried on 5xx responses. geocode_many() resolves a batch with at
+    most concurrency requests in flight.
+    """
+
+    def __init__(self, api_key, url=GOOGLE_GEOCODE_URL, timeout=5.0, cache_size=10000,
+                 ttl=30 * 24 * 3600, negative_ttl=24 * 3600, concurrency=8, retries=2):
+        self.api_key = api_key
+        self.url = url
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.concurrency = concurrency
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_maxsize=concurrency,
+            max_retries=Retry(total=retries, backoff_factor=0.2, status_forcelist=(500, 502, 503, 504)),
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.memory_hits = 0
+        self.database_hits = 0
+        self.requests = 0
+        self.errors = 0
+        self._lru = OrderedDict()  # key -> (location, expires_at)
+        self._lock = threading.Lock()
+
+    def lifetime(self, location):
+        return self.negative_ttl if location == NOT_FOUND else self.ttl
+
+    def _remember(self, key, location, age=0.0):
+        with self._lock:
+            self._lru[key] = (location, time.monotonic() + self.lifetime(location) - age)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.cache_size:
+                self._lru.popitem(last=False)
+
+    def _recall(self, keys):
+        """Split keys into LRU hits and misses"""
+        found, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._lru.get(key)
+                if entry is not None and entry[1] > now:
+                    self._lru.move_to_end(key)
+                    found[key] = entry[0]
+                else:
+                    self._lru.pop(key, None)
+                    missing.append(key)
+            self.memory_hits += len(found)
+        return found, missing
+
+    def _load(self, keys):
+        """Fresh rows of the database cache, copied into the LRU"""
+        from .models import GeocodedAddress
+
+        now = timezone.now()
+        rows = GeocodedAddress.objects.filter(
+            address__in=keys, updated_at__gte=now - timedelta(seconds=max(self.ttl, self.negative_ttl))
+        ).values_list('address', 'latitude', 'longitude', 'updated_at')
+        found = {}
+        for key, lat, lng, updated_at in rows:
+            location = (lat, lng)
+            age = (now - updated_at).total_seconds()
+            if age < self.lifetime(location):
+                found[key] = location
+                self._remember(key, location, age)
+        with self._lock:
+            self.database_hits += len(found)
+        return found
+
+    def _store(self, locations):
+        from .models import GeocodedAddress
+
+        GeocodedAddress.objects.bulk_create(
+            [GeocodedAddress(address=key, latitude=lat, longitude=lng) for key, (lat, lng) in locations.items()],
+            update_conflicts=True, unique_fields=['address'], update_fields=['latitude', 'longitude', 'updated_at'],
+        )
+        for key, location in locations.items():
+            self._remember(key, location)
+
+    def _request(self, address):
+        """
+        Call the geocoding API with the address as written; the normalized
+        form is only a cache key and loses what Google uses to match
+
+        Raises:
+            GeocodingError: on network errors, timeouts and any status but OK/ZERO_RESULTS
+        """
+        with self._lock:
+            self.requests += 1
+        try:
+            response = self.session.get(
+                self.url, params={'address': address, 'key': self.api_key}, timeout=self.timeout
+            )
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise GeocodingError(str(e)) from e
+
+        if data.get('status') == 'OK':
+            location = data['results'][0]['geometry']['location']
+            return location['lat'], location['lng']
+        if data.get('status') == 'ZERO_RESULTS':
+            return NOT_FOUND
+        raise GeocodingError(data.get('status'))
+
+    def _failed(self, address, error):
+        with self._lock:
+            self.errors += 1
+        logger.error("Geocoding %r failed: %s", address, error)
+
+    def geocode(self, address):
+        """
+        Returns:
+            (lat, lng), or (None, None) if the address cannot be geocoded
+        """
+        key = normalize_address(address)
+        found, missing = self._recall([key])
+        if missing:
+            found = self._load(missing)
+        if key in found:
+            return found[key]
+        if not self.api_key:
+            logger.warning("Google Maps API key not configured")
+            return NOT_FOUND
+
+        try:
+            location = self._request(address)
+        except GeocodingError as e:
+            self._failed(address, e)
+            return NOT_FOUND
+        self._store({key: location})
+        return location
+
+    async def geocode_many(self, addresses):
+        """
+        Geocode a batch, de-duplicated, with bounded parallel API calls
+
+        Returns:
+            Dict of address -> (lat, lng) or (None, None)
+        """
+        keys = {address: normalize_address(address) for address in addresses}
+        # One spelling per key is sent to the API
+        spellings = {}
+        for address, key in keys.items():
+            spellings.setdefault(key, address)
+        found, missing = self._recall(set(keys.values()))
+        if missing:
+            loaded = await sync_to_async(self._load)(missing)
+            found.update(loaded)
+            missing = [key for key in missing if key not in loaded]
+
+        if missing and not self.api_key:
+            logger.warning("Google Maps API key not configured")
+        elif missing:
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def fetch(key):
+                async with semaphore:
+                    try:
+                        return key, await asyncio.to_thread(self._request, spellings[key])
+                    except GeocodingError as e:
+                        self._failed(spellings[key], e)
+                        return key, None
+
+            fetched = {key: location for key, location in await asyncio.gather(*map(fetch, missing))
+                       if location is not None}
+            if fetched:
+                await sync_to_async(self._store)(fetched)
+                found.update(fetched)
+
+        return {address: found.get(key, NOT_FOUND) for address, key in keys.items()}
+
+    def geocode_batch(self, addresses):
+        """Blocking geocode_many() for synchronous callers"""
+        return async_to_sync(self.geocode_many)(addresses)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cached': len(self._lru),
+                'memory_hits': self.memory_hits,
+                'database_hits': self.database_hits,
+                'requests': self.requests,
+                'errors': self.errors,
+            }
+
+
+_geocoding_config = getattr(settings, 'GEOCODING', {})
+geocoder = Geocoder(
+    api_key=getattr(settings, 'GOOGLE_MAPS_API_KEY', ''),
+    url=_geocoding_config.get('URL', GOOGLE_GEOCODE_URL),
+    timeout=_geocoding_config.get('TIMEOUT', 5.0),
+    cache_size=_geocoding_config.get('CACHE_SIZE', 10000),
+    ttl=_geocoding_config.get('TTL', 30 * 24 * 3600),
+    negative_ttl=_geocoding_config.get('NEGATIVE_TTL', 24 * 3600),
+    concurrency=_geocoding_config.get('CONCURRENCY', 8),
+    retries=_geocoding_config.get('RETRIES', 2),
+)
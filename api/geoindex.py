@@ -0,0 +1,153 @@
+# geoindex.py
+import threading
+import time
+from math import floor
+import numpy as np
+from .utils import haversine_distances, nearest_indices, bounding_box
+
+KM_PER_DEGREE = 111.195  # length of one degree of latitude on a 6371 km sphere
+
+class DriverLocationIndex:
+    """
+    Fixed-size grid index of available driver positions
+
+    Positions are bucketed into square cells of cell_size_km (measured along
+    a meridian). A radius query only visits the cells overlapping the
+    bounding box of the search circle, so its cost tracks the number of
+    nearby drivers rather than the size of the whole fleet.
+    """
+
+    def __init__(self, cell_size_km=1.0):
+        self.cell_size_km = cell_size_km
+        self.cell_size_deg = cell_size_km / KM_PER_DEGREE
+        self.loaded_at = None
+        self._cells = {}  # (row, col) -> {driver_id: (lat, lng)}
+        self._positions = {}  # driver_id -> (row, col)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _cell(self, lat, lng):
+        return floor(lat / self.cell_size_deg), floor(lng / self.cell_size_deg)
+
+    def update(self, driver_id, lat, lng):
+        """
+        Insert or move a driver
+
+        Returns:
+            True if the driver is new or changed cell
+        """
+        cell = self._cell(lat, lng)
+        with self._lock:
+            old_cell = self._positions.get(driver_id)
+            if old_cell is not None and old_cell != cell:
+                self._discard(driver_id, old_cell)
+            self._cells.setdefault(cell, {})[driver_id] = (lat, lng)
+            self._positions[driver_id] = cell
+        return old_cell != cell
+
+    def remove(self, driver_id):
+        """Drop a driver from the index (no-op if absent)"""
+        with self._lock:
+            cell = self._positions.pop(driver_id, None)
+            if cell is not None:
+                self._discard(driver_id, cell)
+
+    def _discard(self, driver_id, cell):
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.pop(driver_id, None)
+            if not bucket:
+                del self._cells[cell]
+
+    def __contains__(self, driver_id):
+        return driver_id in self._positions
+
+    def cell_counts(self, bounds=None):
+        """
+        Driver count per occupied cell
+
+        Args:
+            bounds: Optional (min_lat, max_lat, min_lng, max_lng) filter on
+                cell centres
+
+        Returns:
+            List of (centre_lat, centre_lng, count) tuples
+        """
+        with self._lock:
+            counts = [(cell, len(bucket)) for cell, bucket in self._cells.items()]
+
+        half = self.cell_size_deg / 2
+        points = []
+        for (row, col), count in counts:
+            lat = row * self.cell_size_deg + half
+            lng = col * self.cell_size_deg + half
+            if bounds is None or (bounds[0] <= lat <= bounds[1] and bounds[2] <= lng <= bounds[3]):
+                points.append((lat, lng, count))
+        return points
+
+    def get(self, driver_id):
+        """Return the indexed (lat, lng) of a driver, or None"""
+        with self._lock:
+            cell = self._positions.get(driver_id)
+            return None if cell is None else self._cells[cell][driver_id]
+
+    def rebuild(self, rows):
+        """Replace the index contents with (driver_id, lat, lng) rows"""
+        cells = {}
+        positions = {}
+        for driver_id, lat, lng in rows:
+            cell = self._cell(lat, lng)
+            cells.setdefault(cell, {})[driver_id] = (lat, lng)
+            positions[driver_id] = cell
+
+        with self._lock:
+            self._cells = cells
+            self._positions = positions
+            self.loaded_at = time.monotonic()
+
+    def clear(self):
+        """Empty the index and mark it as needing a reload"""
+        with self._lock:
+            self._cells = {}
+            self._positions = {}
+            self.loaded_at = None
+
+    def query(self, lat, lng, radius_km, limit=None):
+        """
+        Find indexed drivers within radius_km of (lat, lng)
+
+        Distances for every driver in the covered cells are computed in one
+        vectorized pass; limit keeps only the closest matches.
+
+        Returns:
+            List of (driver_id, distance_km) tuples sorted by distance
+        """
+        min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+        row_min, col_min = self._cell(min_lat, min_lng)
+        row_max, col_max = self._cell(max_lat, max_lng)
+
+        with self._lock:
+            # A wide search box can cover more cells than there are drivers;
+            # in that case walking the occupied cells is cheaper.
+            n_cells = (row_max - row_min + 1) * (col_max - col_min + 1)
+            if n_cells > len(self._cells) or min_lng < -180 or max_lng > 180:
+                buckets = list(self._cells.values())
+            else:
+                buckets = [
+                    self._cells[(row, col)]
+                    for row in range(row_min, row_max + 1)
+                    for col in range(col_min, col_max + 1)
+                    if (row, col) in self._cells
+                ]
+            ids = [driver_id for bucket in buckets for driver_id in bucket]
+            coords = [position for bucket in buckets for position in bucket.values()]
+
+        if not ids:
+            return []
+
+        coords = np.array(coords, dtype=np.float64)
+        distances = haversine_distances(lng, lat, coords[:, 1], coords[:, 0])
+        return [(ids[i], float(distances[i])) for i in nearest_indices(distances, radius_km, limit)]
+
@@ -0,0 +1,121 @@
+# heatmap.py
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.dispatch import receiver
+from .geoindex import DriverLocationIndex
+from .location_store import driver_location_changed, driver_went_offline
+
+VERSION_KEY = 'driver_heatmap:version'
+
+class DriverHeatmap:
+    """
+    Pre-aggregated driver density (grid cell -> number of available drivers)
+
+    Counts are updated incrementally from location changes and rebuilt from
+    the database every rebuild_seconds. Rendered maps are cached for
+    cache_ttl seconds under a version that is bumped once enough drivers
+    have changed cell (invalidate_fraction of the fleet, at least
+    min_changes), so a busy map is refreshed early and a quiet one is not
+    re-rendered at all.
+    """
+
+    def __init__(self, cell_size_km=0.5, cache_ttl=60, rebuild_seconds=60,
+                 invalidate_fraction=0.05, min_changes=5):
+        self.index = DriverLocationIndex(cell_size_km=cell_size_km)
+        self.cache_ttl = cache_ttl
+        self.rebuild_seconds = rebuild_seconds
+        self.invalidate_fraction = invalidate_fraction
+        self.min_changes = min_changes
+        self._changes = 0
+        self._lock = threading.Lock()
+
+    def move(self, driver_id, latitude, longitude, available=None):
+        """
+        Apply a location change
+
+        Plain pings (available=None) only move drivers that are already
+        counted; drivers are added when known to be online or on rebuild.
+        """
+        if available or driver_id in self.index:
+            if self.index.update(driver_id, latitude, longitude):
+                self._record_change()
+
+    def remove(self, driver_id):
+        if driver_id in self.index:
+            self.index.remove(driver_id)
+            self._record_change()
+
+    def _record_change(self):
+        with self._lock:
+            self._changes += 1
+            threshold = max(self.min_changes, self.invalidate_fraction * len(self.index))
+            if self._changes < threshold:
+                return
+            self._changes = 0
+        self.invalidate()
+
+    def invalidate(self):
+        """Make cached renders stale"""
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.add(VERSION_KEY, 1, timeout=None)
+
+    def refresh_if_stale(self):
+        from .models import DriverProfile
+
+        loaded_at = self.index.loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at <= self.rebuild_seconds:
+            return
+        self.index.rebuild(
+            DriverProfile.objects.available().values_list(
+                'id', 'current_latitude', 'current_longitude'
+            )
+        )
+        with self._lock:
+            self._changes = 0
+
+    def points(self, bounds=None):
+        """
+        Aggregated heatmap points
+
+        Returns:
+            List of [lat, lng, driver_count] for each occupied cell
+        """
+        self.refresh_if_stale()
+        return [
+            [round(lat, 6), round(lng, 6), count]
+            for lat, lng, count in self.index.cell_counts(bounds)
+        ]
+
+    def render(self, center_lat, center_lng, zoom=12):
+        """Folium HTML for the current density, cached until TTL or invalidation"""
+        from .utils import generate_driver_heatmap
+
+        version = cache.get(VERSION_KEY, 0)
+        key = f'driver_heatmap:{version}:{center_lat}:{center_lng}:{zoom}'
+        html = cache.get(key)
+        if html is None:
+            html = generate_driver_heatmap(center_lat, center_lng, zoom, heat_data=self.points())
+            cache.set(key, html, self.cache_ttl)
+        return html
+
+
+_config = getattr(settings, 'DRIVER_HEATMAP', {})
+driver_heatmap = DriverHeatmap(
+    cell_size_km=_config.get('CELL_SIZE_KM', 0.5),
+    cache_ttl=_config.get('CACHE_TTL', 60),
+    rebuild_seconds=_config.get('REBUILD_SECONDS', 60),
+    invalidate_fraction=_config.get('INVALIDATE_FRACTION', 0.05),
+    min_changes=_config.get('MIN_CHANGES', 5),
+)
+
+@receiver(driver_location_changed)
+def heatmap_driver_moved(sender, driver_id, latitude, longitude, available=None, **kwargs):
+    driver_heatmap.move(driver_id, latitude, longitude, available)
+
+@receiver(driver_went_offline)
+def heatmap_driver_offline(sender, driver_id, **kwargs):
+    driver_heatmap.remove(driver_id)
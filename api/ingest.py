@@ -0,0 +1,180 @@
+# ingest.py
+import asyncio
+import logging
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from .location_store import is_valid_position, persist_driver_locations
+from .traces import record_trip_traces
+
+logger = logging.getLogger(__name__)
+
+class LocationIngestBuffer:
+    """
+    Coalesces WebSocket location pings per driver
+
+    Only the latest fix per driver is kept for the live position, while
+    every fix is kept for the trip traces (see traces.py). The buffer is
+    flushed with one persist_driver_locations call (a single bulk_update)
+    and one record_trip_traces call once flush_interval
+    seconds have passed since the first buffered ping, as soon as max_batch
+    distinct drivers are waiting, or explicitly via flush(). A flush_interval
+    of 0 turns batching off.
+
+    A failed flush is requeued and retried after retry_delay seconds. A
+    driver whose fixes failed max_attempts flushes in a row is saved on
+    its own, and dropped if that fails too, so one bad fix cannot stall
+    every later flush.
+
+    One buffer is shared by all consumers of a process; it is only touched
+    from the event loop, so it needs no locking.
+    """
+
+    def __init__(self, flush_interval=1.0, max_batch=500, max_attempts=3, retry_delay=1.0):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.received = 0
+        self.flushed = 0
+        self.flushes = 0
+        self._pending = {}
+        self._trace = {}  # driver_id -> [(lat, lng, time_ms), ...]
+        self._attempts = {}  # driver_id -> flushes failed in a row
+        self._timer = None
+        self._timer_loop = None
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, driver_id, latitude, longitude, timestamp=None):
+        """Buffer a ping, replacing any older unflushed fix for the same driver"""
+        fix = (float(latitude), float(longitude), timestamp or timezone.now())
+        if not is_valid_position(fix[0], fix[1]):
+            logger.warning("Dropping invalid location fix %r for driver %s", fix[:2], driver_id)
+            return
+        point = (fix[0], fix[1], int(fix[2].timestamp() * 1000))
+        self.received += 1
+
+        if self.flush_interval <= 0:
+            # Batching disabled: every ping is persisted on its own
+            self._spawn(self._persist({driver_id: fix}, {driver_id: [point]}))
+            return
+
+        self._pending[driver_id] = fix
+        self._trace.setdefault(driver_id, []).append(point)
+        loop = asyncio.get_running_loop()
+        if len(self._pending) >= self.max_batch:
+            self._spawn(self.flush())
+        elif self._timer is None or self._timer_loop is not loop:
+            self._schedule(self.flush_interval)
+
+    def _schedule(self, delay):
+        loop = asyncio.get_running_loop()
+        self._timer_loop = loop
+        self._timer = loop.call_later(delay, self._spawn_flush)
+
+    def _spawn_flush(self):
+        self._spawn(self.flush())
+
+    def _spawn(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def drain(self):
+        """Wait for in-flight flushes, then flush whatever is left"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        return await self.flush()
+
+    async def flush(self):
+        """
+        Persist everything buffered so far
+
+        Returns:
+            Number of drivers written
+        """
+        self._cancel_timer()
+        if not self._pending:
+            return 0
+
+        batch, self._pending = self._pending, {}
+        trace, self._trace = self._trace, {}
+        return await self._persist(batch, trace)
+
+    async def _persist(self, batch, trace):
+        try:
+            await database_sync_to_async(persist_driver_locations)(batch)
+        except Exception:
+            logger.exception("Location ingest flush of %d drivers failed", len(batch))
+            batch = await self._retry(batch, trace)
+            if not batch:
+                return 0
+            trace = {driver_id: trace[driver_id] for driver_id in batch if driver_id in trace}
+        for driver_id in batch:
+            self._attempts.pop(driver_id, None)
+
+        try:
+            await database_sync_to_async(record_trip_traces)(trace)
+        except Exception:
+            # Positions are saved; the trace loses this batch rather than
+            # replaying positions that are already written
+            logger.exception("Trip trace flush failed; dropping %d drivers' fixes", len(trace))
+
+        self.flushes += 1
+        self.flushed += len(batch)
+        return len(batch)
+
+    async def _retry(self, batch, trace):
+        """
+        Requeue a failed batch and re-arm the timer; drivers out of
+        attempts are saved one at a time instead
+
+        Returns:
+            The fixes saved one at a time
+        """
+        exhausted = {}
+        for driver_id, fix in batch.items():
+            attempts = self._attempts.get(driver_id, 0) + 1
+            if attempts >= self.max_attempts:
+                self._attempts.pop(driver_id, None)
+                exhausted[driver_id] = fix
+                continue
+            self._attempts[driver_id] = attempts
+            # A newer fix buffered during the flush wins
+            self._pending.setdefault(driver_id, fix)
+            self._trace[driver_id] = trace.get(driver_id, []) + self._trace.get(driver_id, [])
+
+        if self._pending:
+            self._cancel_timer()
+            self._schedule(self.retry_delay)
+        if not exhausted:
+            return {}
+        return await database_sync_to_async(self._persist_each)(exhausted)
+
+    def _persist_each(self, fixes):
+        saved = {}
+        for driver_id, fix in fixes.items():
+            try:
+                persist_driver_locations({driver_id: fix})
+            except Exception:
+                logger.exception("Dropping the location fix of driver %s after %d failed flushes",
+                                 driver_id, self.max_attempts)
+            else:
+                saved[driver_id] = fix
+        return saved
+
+_ingest_config = getattr(settings, 'LOCATION_INGEST', {})
+location_buffer = LocationIngestBuffer(
+    flush_interval=_ingest_config.get('FLUSH_INTERVAL', 1.0),
+    max_batch=_ingest_config.get('MAX_BATCH', 500),
+    max_attempts=_ingest_config.get('MAX_ATTEMPTS', 3),
+    retry_delay=_ingest_config.get('RETRY_DELAY', 1.0),
+)
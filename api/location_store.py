@@ -0,0 +1,496 @@
+# location_store.py
+import logging
+import math
+import threading
+import time
+from datetime import datetime
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.dispatch import receiver, Signal
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .geoindex import DriverLocationIndex
+
+logger = logging.getLogger(__name__)
+
+# Sent with driver_id, latitude, longitude and available (True when the
+# driver is known to be online, None for plain location pings)
+driver_location_changed = Signal()
+# Sent with driver_id when a driver stops being searchable
+driver_went_offline = Signal()
+
+class BaseLocationStore:
+    """
+    Live driver positions, kept outside the database
+
+    Location pings only touch the store; changed positions are queued and
+    written back to DriverProfile in one bulk_update per flush, at most
+    every write_behind_seconds (0 persists on every update).
+    """
+
+    # Largest |latitude| the backend can index
+    max_latitude = 90.0
+
+    def __init__(self, write_behind_seconds=5):
+        self.write_behind_seconds = write_behind_seconds
+        self._last_flush = time.monotonic()
+
+    # Backend interface
+
+    def set_position(self, driver_id, lat, lng, timestamp):
+        """Make a position visible to searches"""
+        raise NotImplementedError
+
+    def remove(self, driver_id):
+        """Stop returning a driver from searches"""
+        raise NotImplementedError
+
+    def has_position(self, driver_id):
+        raise NotImplementedError
+
+    def search(self, lat, lng, radius_km, limit=None):
+        """
+        Find drivers within radius_km of (lat, lng)
+
+        Returns:
+            List of (driver_id, distance_km, (lat, lng, timestamp)) tuples
+            sorted by distance
+        """
+        raise NotImplementedError
+
+    def mark_dirty(self, driver_id, lat, lng, timestamp, replace=True):
+        """Queue a position for the next flush; replace=False keeps a newer queued one"""
+        raise NotImplementedError
+
+    def pop_dirty(self):
+        """Atomically take all unflushed positions as {driver_id: (lat, lng, timestamp)}"""
+        raise NotImplementedError
+
+    def claim_flush(self):
+        """Return True if this caller should run the periodic flush now"""
+        now = time.monotonic()
+        if now - self._last_flush < self.write_behind_seconds:
+            return False
+        self._last_flush = now
+        return True
+
+    def schedule_flush(self):
+        """
+        Make sure queued positions are written even if no more pings come
+
+        The base store relies on the next ping, or on a separate process
+        running flush_driver_locations.
+        """
+
+    def clear(self):
+        """Drop all positions and queued writes"""
+        raise NotImplementedError
+
+    # Shared behaviour
+
+    def update(self, driver_id, lat, lng, timestamp=None):
+        """Record a location ping and schedule it for write-behind"""
+        timestamp = timestamp or timezone.now()
+        lat, lng = float(lat), float(lng)
+        self.set_position(driver_id, lat, lng, timestamp)
+        self.mark_dirty(driver_id, lat, lng, timestamp)
+        driver_location_changed.send(
+            sender=self.__class__, driver_id=driver_id, latitude=lat, longitude=lng, available=None
+        )
+        if not self.claim_flush():
+            self.schedule_flush()
+            return
+        try:
+            self.flush()
+        except Exception:
+            # Requeued by flush; the ping itself succeeded
+            logger.exception("Write-behind flush after driver %s's ping failed", driver_id)
+            self.schedule_flush()
+
+    def ingest(self, fixes):
+        """
+        Record a batch of already coalesced pings and persist them at once
+
+        If the write fails these fixes are not requeued; the caller (the
+        ingest buffer) retries them.
+
+        Args:
+            fixes: {driver_id: (lat, lng, timestamp)}
+        """
+        for driver_id, (lat, lng, timestamp) in fixes.items():
+            self.set_position(driver_id, lat, lng, timestamp)
+            self.mark_dirty(driver_id, lat, lng, timestamp)
+        self.notify_moved(fixes)
+        return self.flush(exclude=fixes)
+
+    def notify_moved(self, fixes):
+        for driver_id, (lat, lng, _) in fixes.items():
+            driver_location_changed.send(
+                sender=self.__class__, driver_id=driver_id, latitude=lat, longitude=lng, available=None
+            )
+
+    def sync_profile(self, driver_profile, moved=False):
+        """
+        Mirror a freshly saved DriverProfile without scheduling a write
+
+        The saved coordinates may be older than the live ones, so they only
+        replace a known position when moved says the save set them.
+        """
+        if (driver_profile.is_available
+                and driver_profile.current_latitude is not None
+                and driver_profile.current_longitude is not None):
+            if not moved and self.has_position(driver_profile.id):
+                return
+            self.set_position(
+                driver_profile.id,
+                driver_profile.current_latitude,
+                driver_profile.current_longitude,
+                driver_profile.last_location_update or timezone.now()
+            )
+            driver_location_changed.send(
+                sender=self.__class__,
+                driver_id=driver_profile.id,
+                latitude=driver_profile.current_latitude,
+                longitude=driver_profile.current_longitude,
+                available=True
+            )
+        else:
+            self.remove(driver_profile.id)
+            driver_went_offline.send(sender=self.__class__, driver_id=driver_profile.id)
+
+    def load(self, rows):
+        """Seed the store from (driver_id, lat, lng, timestamp) rows"""
+        for driver_id, lat, lng, timestamp in rows:
+            self.set_position(driver_id, lat, lng, timestamp or timezone.now())
+
+    def flush(self, exclude=()):
+        """
+        Persist queued positions with a single bulk_update
+
+        Args:
+            exclude: drivers not to requeue if the write fails, because
+                the caller retries them itself
+
+        Returns:
+            Number of driver rows written
+        """
+        pending = self.pop_dirty()
+        if not pending:
+            return 0
+
+        try:
+            return save_driver_locations(pending)
+        except Exception:
+            # Put the batch back unless a newer ping has replaced it meanwhile
+            logger.exception("Driver location flush failed; requeueing %d positions", len(pending))
+            self.requeue({driver_id: fix for driver_id, fix in pending.items() if driver_id not in exclude})
+            raise
+
+    def requeue(self, pending):
+        for driver_id, (lat, lng, timestamp) in pending.items():
+            self.mark_dirty(driver_id, lat, lng, timestamp, replace=False)
+
+
+class InMemoryLocationStore(BaseLocationStore):
+    """
+    Per-process store backed by the grid DriverLocationIndex
+
+    Suitable for tests and single-process deployments. Every refresh_seconds
+    it flushes its own queue and reloads from the database, which picks up
+    positions written by other processes. Queued positions are also
+    flushed by a timer write_behind_seconds after they were queued, so a
+    driver who goes quiet still has their last position saved.
+    """
+
+    def __init__(self, cell_size_km=1.0, refresh_seconds=60, **kwargs):
+        super().__init__(**kwargs)
+        self.refresh_seconds = refresh_seconds
+        self.index = DriverLocationIndex(cell_size_km=cell_size_km)
+        self._timestamps = {}
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def set_position(self, driver_id, lat, lng, timestamp):
+        self.index.update(driver_id, lat, lng)
+        self._timestamps[driver_id] = timestamp
+
+    def remove(self, driver_id):
+        self.index.remove(driver_id)
+        self._timestamps.pop(driver_id, None)
+
+    def has_position(self, driver_id):
+        return self.index.get(driver_id) is not None
+
+    def mark_dirty(self, driver_id, lat, lng, timestamp, replace=True):
+        with self._lock:
+            if replace or driver_id not in self._dirty:
+                self._dirty[driver_id] = (lat, lng, timestamp)
+
+    def pop_dirty(self):
+        with self._lock:
+            pending, self._dirty = self._dirty, {}
+        return pending
+
+    def schedule_flush(self):
+        with self._lock:
+            if self._timer is not None or not self._dirty:
+                return
+            self._timer = threading.Timer(self.write_behind_seconds, self._timed_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_flush(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+            self._last_flush = time.monotonic()
+        except Exception:
+            logger.exception("Timed driver location flush failed")
+        finally:
+            # The timer thread's own connection
+            connection.close()
+        # Retry whatever was requeued, or queued meanwhile
+        self.schedule_flush()
+
+    def search(self, lat, lng, radius_km, limit=None):
+        self.refresh_if_stale()
+        results = []
+        for driver_id, distance in self.index.query(lat, lng, radius_km, limit):
+            position = self.index.get(driver_id)
+            if position is not None:
+                results.append(
+                    (driver_id, distance, position + (self._timestamps.get(driver_id),))
+                )
+        return results
+
+    def refresh_if_stale(self):
+        from .models import DriverProfile
+
+        loaded_at = self.index.loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at <= self.refresh_seconds:
+            return
+
+        # Flush first so the reload cannot roll back this process's newer pings
+        self.flush()
+        rows = list(DriverProfile.objects.available().values_list(
+            'id', 'current_latitude', 'current_longitude', 'last_location_update'
+        ))
+        self.index.rebuild((driver_id, lat, lng) for driver_id, lat, lng, _ in rows)
+        self._timestamps = {driver_id: timestamp for driver_id, _, _, timestamp in rows}
+
+    def clear(self):
+        with self._lock:
+            self._dirty = {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self.index.clear()
+        self._timestamps = {}
+
+
+class RedisLocationStore(BaseLocationStore):
+    """
+    Shared store backed by a Redis GEO set (requires Redis >= 6.2)
+
+    All processes see the same positions. The write-behind queue is a Redis
+    hash, and a short-lived lock key ensures only one process flushes per
+    interval.
+    """
+
+    # Redis GEO sets use Web Mercator and reject the polar regions
+    max_latitude = 85.05112878
+
+    def __init__(self, url='redis://127.0.0.1:6379/0', key_prefix='driver_locations', **kwargs):
+        import redis
+
+        super().__init__(**kwargs)
+        self.client = redis.Redis.from_url(url)
+        self.geo_key = f'{key_prefix}:geo'
+        self.timestamp_key = f'{key_prefix}:updated'
+        self.dirty_key = f'{key_prefix}:dirty'
+        self.flush_lock_key = f'{key_prefix}:flush_lock'
+
+    def set_position(self, driver_id, lat, lng, timestamp):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.geoadd(self.geo_key, (lng, lat, driver_id))
+        pipe.hset(self.timestamp_key, driver_id, timestamp.isoformat())
+        pipe.execute()
+
+    def remove(self, driver_id):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zrem(self.geo_key, driver_id)
+        pipe.hdel(self.timestamp_key, driver_id)
+        pipe.execute()
+
+    def has_position(self, driver_id):
+        return self.client.zscore(self.geo_key, driver_id) is not None
+
+    def mark_dirty(self, driver_id, lat, lng, timestamp, replace=True):
+        value = f'{lat!r},{lng!r},{timestamp.isoformat()}'
+        if replace:
+            self.client.hset(self.dirty_key, driver_id, value)
+        else:
+            self.client.hsetnx(self.dirty_key, driver_id, value)
+
+    def ingest(self, fixes):
+        # One round trip for the whole batch instead of three per driver
+        if fixes:
+            geo_values = []
+            for driver_id, (lat, lng, _) in fixes.items():
+                geo_values.extend((lng, lat, driver_id))
+            pipe = self.client.pipeline(transaction=False)
+            pipe.geoadd(self.geo_key, geo_values)
+            pipe.hset(self.timestamp_key, mapping={
+                driver_id: timestamp.isoformat() for driver_id, (_, _, timestamp) in fixes.items()
+            })
+            pipe.hset(self.dirty_key, mapping={
+                driver_id: f'{lat!r},{lng!r},{timestamp.isoformat()}'
+                for driver_id, (lat, lng, timestamp) in fixes.items()
+            })
+            pipe.execute()
+        self.notify_moved(fixes)
+        return self.flush(exclude=fixes)
+
+    def pop_dirty(self):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hgetall(self.dirty_key)
+        pipe.delete(self.dirty_key)
+        raw, _ = pipe.execute()
+
+        pending = {}
+        for driver_id, value in raw.items():
+            lat, lng, timestamp = value.decode().split(',', 2)
+            pending[int(driver_id)] = (float(lat), float(lng), datetime.fromisoformat(timestamp))
+        return pending
+
+    def claim_flush(self):
+        if self.write_behind_seconds <= 0:
+            return True
+        return bool(self.client.set(
+            self.flush_lock_key, 1, nx=True, ex=max(1, int(self.write_behind_seconds))
+        ))
+
+    def search(self, lat, lng, radius_km, limit=None):
+        matches = self.client.geosearch(
+            self.geo_key, longitude=lng, latitude=lat, radius=radius_km, unit='km',
+            sort='ASC', count=limit, withdist=True, withcoord=True
+        )
+        if not matches:
+            return []
+
+        timestamps = self.client.hmget(self.timestamp_key, [member for member, _, _ in matches])
+        results = []
+        for (member, distance, (match_lng, match_lat)), timestamp in zip(matches, timestamps):
+            if timestamp is not None:
+                timestamp = datetime.fromisoformat(timestamp.decode())
+            results.append((int(member), distance, (match_lat, match_lng, timestamp)))
+        return results
+
+    def clear(self):
+        self.client.delete(self.geo_key, self.timestamp_key, self.dirty_key, self.flush_lock_key)
+
+
+_location_store = None
+_location_store_lock = threading.Lock()
+
+def get_location_store():
+    """
+    Return the configured live location store, or None when
+    DRIVER_LOCATION_STORE is unset and lookups should go to the database
+    """
+    global _location_store
+
+    config = getattr(settings, 'DRIVER_LOCATION_STORE', None)
+    if not config:
+        return None
+
+    if _location_store is None:
+        with _location_store_lock:
+            if _location_store is None:
+                backend = import_string(config['BACKEND'])
+                _location_store = backend(
+                    write_behind_seconds=config.get('WRITE_BEHIND_SECONDS', 5),
+                    **config.get('OPTIONS', {})
+                )
+    return _location_store
+
+@receiver(setting_changed)
+def reset_location_store(setting, **kwargs):
+    global _location_store
+    if setting == 'DRIVER_LOCATION_STORE':
+        _location_store = None
+
+def is_valid_position(latitude, longitude):
+    """True for finite coordinates on the globe that the live store, if any, can hold"""
+    store = get_location_store()
+    max_latitude = store.max_latitude if store is not None else BaseLocationStore.max_latitude
+    return (math.isfinite(latitude) and math.isfinite(longitude)
+            and abs(latitude) <= max_latitude and abs(longitude) <= 180)
+
+def save_driver_locations(fixes):
+    """
+    Write {driver_id: (lat, lng, timestamp)} to DriverProfile in one bulk_update
+
+    Returns:
+        Number of driver rows written
+    """
+    from .models import DriverProfile
+
+    # bulk_update only needs the primary key, so nothing is read first
+    profiles = [
+        DriverProfile(
+            id=driver_id,
+            current_latitude=lat,
+            current_longitude=lng,
+            last_location_update=timestamp
+        )
+        for driver_id, (lat, lng, timestamp) in fixes.items()
+    ]
+    DriverProfile.objects.bulk_update(
+        profiles, ['current_latitude', 'current_longitude', 'last_location_update']
+    )
+    return len(profiles)
+
+def persist_driver_locations(fixes):
+    """Apply a batch of coalesced pings through the live store, if any, and save them"""
+    store = get_location_store()
+    if store is not None:
+        return store.ingest(fixes)
+    return save_driver_locations(fixes)
+
+def record_driver_location(driver_id, latitude, longitude):
+    """
+    Apply a location ping: through the live store when one is configured,
+    otherwise as a direct column update
+    """
+    from .models import DriverProfile
+
+    store = get_location_store()
+    if store is not None:
+        store.update(driver_id, latitude, longitude)
+    else:
+        DriverProfile.objects.filter(id=driver_id).update(
+            current_latitude=float(latitude),
+            current_longitude=float(longitude),
+            last_location_update=timezone.now()
+        )
+        driver_location_changed.send(
+            sender=None, driver_id=driver_id,
+            latitude=float(latitude), longitude=float(longitude), available=None
+        )
+
+def sync_driver_profile(driver_profile, moved=False):
+    """Mirror a saved DriverProfile into the live store, if any"""
+    store = get_location_store()
+    if store is not None:
+        store.sync_profile(driver_profile, moved=moved)
+
+def forget_driver(driver_id):
+    """Drop a deleted or offline driver from the live store and its listeners"""
+    store = get_location_store()
+    if store is not None:
+        store.remove(driver_id)
+    driver_went_offline.send(sender=None, driver_id=driver_id)
@@ -0,0 +1,190 @@
+# lookups.py
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# Cached in place of None, so "no such row" is a hit too
+MISSING = '__missing__'
+
+class _Flight:
+    """One in-process load of a key that other threads can wait on"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.loaded = False
+
+class ReadThroughCache:
+    """
+    Read-through cache for small, hot lookups
+
+    get() returns the cached value for (namespace, ident) or calls loader()
+    on a miss and caches what it returns, None included, for ttl seconds.
+    A miss is loaded once however many requests hit it together: threads
+    of one process wait on the thread already loading it, and processes
+    sharing the cache back off while another holds the key's lock (taken
+    with cache.add(), held at most lock_timeout seconds) and read its
+    result.
+
+    Models invalidate their entries from post_save/post_delete (see
+    api/signals.py), immediately and again once the transaction commits.
+    bulk_create() and update() send no signals; callers using them call
+    invalidate() themselves.
+    """
+
+    def __init__(self, alias='default', prefix='lookup', ttl=300, lock_timeout=5.0, poll_interval=0.02,
+                 enabled=True):
+        self.alias = alias
+        self.prefix = prefix
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self.enabled = enabled
+        self.hits = Counter()
+        self.misses = Counter()
+        self.coalesced = Counter()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, namespace, ident):
+        return f'{self.prefix}:{namespace}:{ident}'
+
+    def get(self, namespace, ident, loader):
+        if not self.enabled:
+            return loader()
+        key = self.key(namespace, ident)
+        value = self.cache.get(key)
+        with self._lock:
+            (self.misses if value is None else self.hits)[namespace] += 1
+        if value is None:
+            value = self._load(namespace, key, loader)
+        return None if value == MISSING else value
+
+    def _load(self, namespace, key, loader):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced[namespace] += 1
+
+        if not leader:
+            flight.event.wait(self.lock_timeout)
+            if flight.loaded:
+                return flight.value
+            # The leader failed or stalled; load independently
+            return self._load_shared(key, loader)
+
+        try:
+            flight.value = self._load_shared(key, loader)
+            flight.loaded = True
+            return flight.value
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+
+    def _load_shared(self, key, loader):
+        """Load with the cross-process lock, or wait for the process holding it"""
+        lock = f'{key}:lock'
+        if not self.cache.add(lock, 1, self.lock_timeout):
+            deadline = time.monotonic() + self.lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                value = self.cache.get(key)
+                if value is not None:
+                    return value
+            # The lock expired without a result; load it ourselves
+            return self._store(key, loader())
+
+        try:
+            return self._store(key, loader())
+        finally:
+            self.cache.delete(lock)
+
+    def _store(self, key, value):
+        value = MISSING if value is None else value
+        self.cache.set(key, value, self.ttl)
+        return value
+
+    def invalidate(self, namespace, *idents):
+        """Drop entries now and again on commit, so a load racing the write is not kept"""
+        keys = [self.key(namespace, ident) for ident in idents]
+        self.cache.delete_many(keys)
+        transaction.on_commit(lambda: self.cache.delete_many(keys))
+
+    def stats(self):
+        with self._lock:
+            namespaces = sorted(set(self.hits) | set(self.misses))
+            return {
+                namespace: {
+                    'hits': self.hits[namespace],
+                    'misses': self.misses[namespace],
+                    'coalesced': self.coalesced[namespace],
+                    'hit_rate': round(self.hits[namespace] / (self.hits[namespace] + self.misses[namespace]), 3),
+                }
+                for namespace in namespaces
+            }
+
+
+_lookup_config = getattr(settings, 'LOOKUP_CACHE', {})
+lookup_cache = ReadThroughCache(
+    alias=_lookup_config.get('ALIAS', 'default'),
+    ttl=_lookup_config.get('TTL', 300),
+    lock_timeout=_lookup_config.get('LOCK_TIMEOUT', 5.0),
+    enabled=_lookup_config.get('ENABLED', True),
+)
+
+def get_user(user_id):
+    """
+    The User with this id, or None
+
+    The password hash is deferred so it never reaches the cache; reading
+    user.password loads it from the database.
+    """
+    from .models import User
+
+    return lookup_cache.get('user', user_id, lambda: User.objects.defer('password').filter(pk=user_id).first())
+
+def get_password_digest(user_id):
+    """MD5 of the user's password hash, as simplejwt's revoke claim holds it, or None"""
+    from rest_framework_simplejwt.utils import get_md5_hash_password
+    from .models import User
+
+    def load():
+        password = User.objects.filter(pk=user_id).values_list('password', flat=True).first()
+        return None if password is None else get_md5_hash_password(password)
+
+    return lookup_cache.get('password_digest', user_id, load)
+
+def get_driver_profile_id(user_id):
+    """Id of the user's DriverProfile, or None if they have none"""
+    from .models import DriverProfile
+
+    return lookup_cache.get(
+        'driver_profile', user_id,
+        lambda: DriverProfile.objects.filter(user_id=user_id).values_list('id', flat=True).first()
+    )
+
+def get_active_subscriptions(user_id):
+    """(plan, start_date, end_date) of the user's active subscriptions"""
+    from .models import Subscription
+
+    return lookup_cache.get(
+        'subscriptions', user_id,
+        lambda: list(Subscription.objects.filter(user_id=user_id, is_active=True)
+                     .values_list('plan', 'start_date', 'end_date'))
+    )
+
+def invalidate_user(*user_ids):
+    """Forget every cached lookup of these users"""
+    for namespace in ('user', 'password_digest', 'driver_profile', 'subscriptions'):
+        lookup_cache.invalidate(namespace, *user_ids)
@@ -0,0 +1,126 @@
+import importlib.util
+import os
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from designated_driver_API.database import postgres_config, sqlite_config
+
+ALIAS = 'bench_db_writes'
+
+PRIMARY_KEY = {'sqlite': 'INTEGER PRIMARY KEY', 'postgresql': 'BIGSERIAL PRIMARY KEY'}
+
+
+class Command(BaseCommand):
+    help = ("Concurrent write throughput of each database mode: SQLite with the rollback journal and with "
+            "WAL, and given a Postgres URL, new, persistent and pooled connections. Every thread runs "
+            "requests that read a driver, move it and insert a booking in one transaction, in scratch "
+            "tables that are dropped afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16])
+        parser.add_argument('--requests', type=int, default=200, help="Requests per thread")
+        parser.add_argument('--drivers', type=int, default=100)
+        parser.add_argument('--postgres', default=os.environ.get('DATABASE_URL', ''),
+                            help="postgres:// URL to also benchmark; defaults to DATABASE_URL")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'mode':>20} {'threads':>7} {'requests/s':>10} {'errors':>6} {'p50 ms':>7} {'p99 ms':>7}")
+        with tempfile.TemporaryDirectory() as directory:
+            for mode, config in self.modes(Path(directory), options['postgres']):
+                for threads in options['threads']:
+                    self.run(mode, config, threads, options['requests'], options['drivers'])
+
+    def modes(self, directory, postgres_url):
+        # The previous settings, then the current SQLite defaults
+        yield 'sqlite', sqlite_config(directory / 'journal.sqlite3', conn_max_age=0, wal=False)
+        yield 'sqlite-wal', sqlite_config(directory / 'wal.sqlite3')
+        if not postgres_url.startswith(('postgres://', 'postgresql://')):
+            return
+        if importlib.util.find_spec('psycopg') is None and importlib.util.find_spec('psycopg2') is None:
+            raise CommandError("Postgres needs psycopg installed")
+        yield 'postgres', postgres_config(postgres_url, conn_max_age=0)
+        yield 'postgres-persistent', postgres_config(postgres_url)
+        if importlib.util.find_spec('psycopg_pool') is None:
+            self.stderr.write("Skipping postgres-pool: psycopg[pool] is not installed")
+            return
+        yield 'postgres-pool', postgres_config(postgres_url, pool={'min_size': 4, 'max_size': 16, 'timeout': 30})
+
+    def run(self, mode, config, threads, requests, drivers):
+        databases = connections.configure_settings({DEFAULT_DB_ALIAS: {}, ALIAS: dict(config)})
+        connections.settings[ALIAS] = databases[ALIAS]
+        try:
+            self.create_tables(drivers)
+            barrier = threading.Barrier(threads + 1)
+            latencies, errors = [], []
+            workers = [
+                threading.Thread(target=self.worker, args=(barrier, requests, drivers, seed, latencies, errors))
+                for seed in range(threads)
+            ]
+            for worker in workers:
+                worker.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000 if latencies else (0, 0)
+            self.stdout.write(
+                f"{mode:>20} {threads:>7} {len(latencies) / elapsed:>10.0f} {len(errors):>6} {p50:>7.2f} {p99:>7.2f}"
+            )
+            if errors:
+                self.stdout.write(f"{'':>20} first error: {errors[0]}")
+        finally:
+            self.drop_tables()
+            connections[ALIAS].close()
+            if getattr(connections[ALIAS], 'pool', None):
+                connections[ALIAS].close_pool()
+            del connections[ALIAS]
+            del connections.settings[ALIAS]
+
+    def create_tables(self, drivers):
+        connection = connections[ALIAS]
+        self.drop_tables()
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE bench_driver (id {PRIMARY_KEY[connection.vendor]}, "
+                           "latitude double precision, longitude double precision, updated double precision)")
+            cursor.execute(f"CREATE TABLE bench_booking (id {PRIMARY_KEY[connection.vendor]}, "
+                           "driver_id integer, latitude double precision, longitude double precision)")
+            cursor.executemany("INSERT INTO bench_driver (id, latitude, longitude, updated) VALUES (%s, %s, %s, %s)",
+                               [(i, 37.77, -122.42, 0.0) for i in range(1, drivers + 1)])
+        connection.close()
+
+    def drop_tables(self):
+        with connections[ALIAS].cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS bench_driver")
+            cursor.execute("DROP TABLE IF EXISTS bench_booking")
+
+    def worker(self, barrier, requests, drivers, seed, latencies, errors):
+        rng = random.Random(seed)
+        connection = connections[ALIAS]
+        barrier.wait()
+        try:
+            for _ in range(requests):
+                driver_id = rng.randint(1, drivers)
+                start = time.perf_counter()
+                try:
+                    with transaction.atomic(using=ALIAS), connection.cursor() as cursor:
+                        cursor.execute("SELECT latitude, longitude FROM bench_driver WHERE id = %s", [driver_id])
+                        latitude, longitude = cursor.fetchone()
+                        cursor.execute("UPDATE bench_driver SET latitude = %s, longitude = %s, updated = %s "
+                                       "WHERE id = %s", [latitude + 1e-5, longitude, time.time(), driver_id])
+                        cursor.execute("INSERT INTO bench_booking (driver_id, latitude, longitude) "
+                                       "VALUES (%s, %s, %s)", [driver_id, latitude, longitude])
+                except OperationalError as exc:
+                    errors.append(exc)
+                else:
+                    latencies.append(time.perf_counter() - start)
+                # What request_finished does: close the connection unless it is persistent
+                connection.close_if_unusable_or_obsolete()
+        finally:
+            connection.close()
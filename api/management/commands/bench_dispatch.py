@@ -0,0 +1,54 @@
+import random
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from api.dispatch import SOLVERS
+from api.utils import haversine_distances
+
+
+class Command(BaseCommand):
+    help = "Simulate dispatch rounds: greedy vs optimal match latency and total pickup distance"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[25, 100, 250],
+                            help="Ride requests per round")
+        parser.add_argument('--drivers-per-request', type=float, default=1.5)
+        parser.add_argument('--rounds', type=int, default=5, help="Rounds per size")
+        parser.add_argument('--radius', type=float, default=5.0, help="Maximum pickup distance in km")
+        parser.add_argument('--spread', type=float, default=0.08,
+                            help="Half-width in degrees of the area requests and drivers are scattered over")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        center_lat, center_lng = 37.7749, -122.4194
+        spread = options['spread']
+
+        self.stdout.write(
+            f"{'requests':>8} {'drivers':>8} {'mode':>8} {'solve ms':>9} {'matched':>8} "
+            f"{'pickup km':>10} {'km/match':>9}"
+        )
+        for size in options['sizes']:
+            n_drivers = int(size * options['drivers_per_request'])
+            totals = {mode: [0.0, 0, 0.0] for mode in SOLVERS}  # solve seconds, matches, km
+            for _ in range(options['rounds']):
+                requests = [(center_lat + rng.uniform(-spread, spread), center_lng + rng.uniform(-spread, spread))
+                            for _ in range(size)]
+                lats = np.array([center_lat + rng.uniform(-spread, spread) for _ in range(n_drivers)])
+                lngs = np.array([center_lng + rng.uniform(-spread, spread) for _ in range(n_drivers)])
+                cost = np.vstack([haversine_distances(lng, lat, lngs, lats) for lat, lng in requests])
+                cost[cost > options['radius']] = np.inf
+
+                for mode, solve in SOLVERS.items():
+                    start = time.perf_counter()
+                    pairs = solve(cost)
+                    totals[mode][0] += time.perf_counter() - start
+                    totals[mode][1] += len(pairs)
+                    totals[mode][2] += sum(cost[row, col] for row, col in pairs)
+
+            for mode, (seconds, matched, km) in totals.items():
+                rounds = options['rounds']
+                self.stdout.write(
+                    f"{size:>8} {n_drivers:>8} {mode:>8} {seconds * 1000 / rounds:>9.2f} "
+                    f"{matched / rounds:>8.1f} {km / rounds:>10.2f} {km / max(matched, 1):>9.3f}"
+                )
@@ -0,0 +1,67 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from api.geoindex import DriverLocationIndex
+from api.utils import haversine_distance
+
+
+class Command(BaseCommand):
+    help = "Benchmark radius lookups: driver location index vs. full fleet scan"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help="Simulated fleet sizes")
+        parser.add_argument('--queries', type=int, default=200, help="Lookups per fleet size")
+        parser.add_argument('--radius', type=float, default=5.0, help="Search radius in km")
+        parser.add_argument('--spread', type=float, default=0.5,
+                            help="Half-width in degrees of the area drivers are scattered over")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        center_lat, center_lng = 37.7749, -122.4194
+        spread = options['spread']
+        radius = options['radius']
+
+        self.stdout.write(f"{'drivers':>8} {'scan ms/q':>10} {'index ms/q':>11} {'speedup':>8} {'avg hits':>9}")
+        for size in options['sizes']:
+            drivers = [
+                (driver_id,
+                 center_lat + rng.uniform(-spread, spread),
+                 center_lng + rng.uniform(-spread, spread))
+                for driver_id in range(size)
+            ]
+            queries = [
+                (center_lat + rng.uniform(-spread, spread), center_lng + rng.uniform(-spread, spread))
+                for _ in range(options['queries'])
+            ]
+
+            index = DriverLocationIndex()
+            index.rebuild(drivers)
+
+            start = time.perf_counter()
+            for lat, lng in queries:
+                self.full_scan(drivers, lat, lng, radius)
+            scan_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+            hits = 0
+            start = time.perf_counter()
+            for lat, lng in queries:
+                hits += len(index.query(lat, lng, radius))
+            index_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+            self.stdout.write(
+                f"{size:>8} {scan_ms:>10.3f} {index_ms:>11.3f} "
+                f"{scan_ms / index_ms:>7.1f}x {hits / len(queries):>9.1f}"
+            )
+
+    @staticmethod
+    def full_scan(drivers, lat, lng, radius):
+        """The pre-index lookup: haversine against every available driver"""
+        results = []
+        for driver_id, driver_lat, driver_lng in drivers:
+            distance = haversine_distance(lng, lat, driver_lng, driver_lat)
+            if distance <= radius:
+                results.append((driver_id, distance))
+        results.sort(key=lambda item: item[1])
+        return results
@@ -0,0 +1,53 @@
+import random
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from api.utils import haversine_distance, haversine_distances, nearest_indices
+
+
+class Command(BaseCommand):
+    help = "Microbenchmark the scalar haversine loop against the vectorized kernel"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help="Number of driver coordinates per batch")
+        parser.add_argument('--repeat', type=int, default=20, help="Timed runs per size")
+        parser.add_argument('--radius', type=float, default=10.0)
+        parser.add_argument('--limit', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        lat, lng = 37.7749, -122.4194
+        radius, limit, repeat = options['radius'], options['limit'], options['repeat']
+
+        self.stdout.write(f"{'points':>8} {'scalar ms':>10} {'vector ms':>10} {'top-k ms':>9} {'speedup':>8}")
+        for size in options['sizes']:
+            lats = [lat + rng.uniform(-0.5, 0.5) for _ in range(size)]
+            lngs = [lng + rng.uniform(-0.5, 0.5) for _ in range(size)]
+            lat_array, lng_array = np.array(lats), np.array(lngs)
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                matches = sorted(
+                    d for d in (haversine_distance(lng, lat, x, y) for x, y in zip(lngs, lats))
+                    if d <= radius
+                )[:limit]
+            scalar_ms = (time.perf_counter() - start) * 1000 / repeat
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                distances = haversine_distances(lng, lat, lng_array, lat_array)
+            vector_ms = (time.perf_counter() - start) * 1000 / repeat
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                distances = haversine_distances(lng, lat, lng_array, lat_array)
+                nearest = distances[nearest_indices(distances, radius, limit)]
+            topk_ms = (time.perf_counter() - start) * 1000 / repeat
+
+            assert np.allclose(nearest, matches)
+            self.stdout.write(
+                f"{size:>8} {scalar_ms:>10.3f} {vector_ms:>10.3f} {topk_ms:>9.3f} "
+                f"{scalar_ms / topk_ms:>7.1f}x"
+            )
@@ -0,0 +1,62 @@
+import time
+from datetime import date, timedelta
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from api.lookups import lookup_cache
+from api.models import User, Subscription
+
+
+class Command(BaseCommand):
+    help = ("Requests per second and queries per request on hot authenticated endpoints "
+            "with the lookup cache on and off. Temporary bench-lookup-* users are deleted afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help="Requests per endpoint and mode")
+
+    def handle(self, *args, **options):
+        today = date.today()
+        rider = User.objects.create_user(username='bench-lookup-rider')
+        driver = User.objects.create_user(username='bench-lookup-driver', is_driver=True)
+        Subscription.objects.create(user=rider, plan='premium', start_date=today - timedelta(days=1),
+                                    end_date=today + timedelta(days=30))
+        route = {'pickup_latitude': 37.77, 'pickup_longitude': -122.42,
+                 'destination_latitude': 37.80, 'destination_longitude': -122.41}
+        endpoints = [
+            ('users/me', rider, 'get', reverse('user-me'), None),
+            ('update-location', driver, 'post', reverse('driverprofile-update-location'),
+             {'latitude': 37.77, 'longitude': -122.42}),
+            ('fares/estimate', rider, 'post', reverse('fare_estimate'), {'routes': [route]}),
+        ]
+
+        enabled = lookup_cache.enabled
+        try:
+            self.stdout.write(f"{'endpoint':>16} {'cache':>6} {'req/s':>8} {'queries/req':>12}")
+            for label, user, method, url, data in endpoints:
+                client = APIClient()
+                client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+                for mode in (False, True):
+                    lookup_cache.enabled = mode
+                    cache.clear()
+                    rate, queries = self.run(client, method, url, data, options['requests'])
+                    self.stdout.write(f"{label:>16} {'on' if mode else 'off':>6} {rate:>8.0f} {queries:>12.2f}")
+        finally:
+            lookup_cache.enabled = enabled
+            User.objects.filter(id__in=[rider.id, driver.id]).delete()
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def run(self, client, method, url, data, requests):
+        send = getattr(client, method)
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(requests):
+                response = send(url, data, format='json')
+                if response.status_code != 200:
+                    raise CommandError(f"{url} returned {response.status_code}")
+            elapsed = time.perf_counter() - start
+        return requests / elapsed, len(queries) / requests
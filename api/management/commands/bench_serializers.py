@@ -0,0 +1,81 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from api.models import User, DriverProfile, Booking, Notification
+from api.serializers import (BookingSerializer, DriverProfileSerializer, NotificationSerializer, booking_rows,
+                             driver_profile_rows, notification_rows)
+
+
+class Command(BaseCommand):
+    help = ("Rows per second serialized and rendered to JSON by the DRF serializers and by the "
+            "RowSerializer read paths. Rows are created in a transaction that is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+        parser.add_argument('--repeat', type=int, default=3, help="Best of N runs")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(options['sizes'], options['repeat'])
+            transaction.set_rollback(True)
+
+    def run(self, sizes, repeat):
+        rows = max(sizes)
+        rider = User.objects.create_user(username='bench-serializers-rider')
+        drivers = User.objects.bulk_create(
+            User(username=f'bench-serializers-driver-{i}', is_driver=True) for i in range(rows)
+        )
+        DriverProfile.objects.bulk_create(
+            DriverProfile(user=user, license_number='L', vehicle_make='Toyota', vehicle_model='Corolla',
+                          vehicle_year=2020, vehicle_color='Blue', license_plate='P', is_available=True,
+                          current_latitude=37.77 + i * 1e-5, current_longitude=-122.42,
+                          last_location_update=timezone.now())
+            for i, user in enumerate(drivers)
+        )
+        now = timezone.now()
+        Booking.objects.bulk_create(
+            Booking(user=rider, driver=drivers[i], pickup_latitude=37.77, pickup_longitude=-122.42,
+                    pickup_address='Pickup', destination_latitude=37.80, destination_longitude=-122.41,
+                    destination_address='Destination', scheduled_time=now)
+            for i in range(rows)
+        )
+        Notification.objects.bulk_create(
+            Notification(user=rider, title='Booking Accepted', message='Your booking has been accepted')
+            for _ in range(rows)
+        )
+
+        renderer = JSONRenderer()
+        cases = [
+            ('bookings', Booking.objects.filter(user=rider), BookingSerializer, booking_rows),
+            ('notifications', Notification.objects.filter(user=rider), NotificationSerializer, notification_rows),
+        ]
+        self.stdout.write(f"{'endpoint':>14} {'rows':>6} {'DRF rows/s':>11} {'fast rows/s':>12} {'speedup':>8}")
+        for size in sizes:
+            for label, queryset, serializer_class, row_serializer in cases:
+                queryset = queryset.order_by('-id')[:size]
+                drf = lambda: renderer.render(serializer_class(queryset, many=True).data)
+                fast = lambda: renderer.render(row_serializer.rows(queryset.values(*row_serializer.columns)))
+                self.compare(label, size, drf, fast, repeat)
+
+            # nearby/radius_search serialize model instances one at a time
+            profiles = list(DriverProfile.objects.order_by('id')[:size])
+            drf = lambda: renderer.render([DriverProfileSerializer(profile).data for profile in profiles])
+            fast = lambda: renderer.render([driver_profile_rows.instance(profile) for profile in profiles])
+            self.compare('nearby', size, drf, fast, repeat)
+
+    def compare(self, label, size, drf, fast, repeat):
+        if drf() != fast():
+            raise CommandError(f"{label}: the fast path output differs")
+        drf_seconds = min(self.time(drf) for _ in range(repeat))
+        fast_seconds = min(self.time(fast) for _ in range(repeat))
+        self.stdout.write(
+            f"{label:>14} {size:>6} {size / drf_seconds:>11.0f} {size / fast_seconds:>12.0f} "
+            f"{drf_seconds / fast_seconds:>7.1f}x"
+        )
+
+    def time(self, func):
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
@@ -0,0 +1,102 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from api.traces import filter_fixes, simplify_path, path_length_km
+
+METRES_PER_DEGREE = 6371000 * np.pi / 180
+
+
+def synthetic_drive(rng, minutes, noise_m, outlier_rate, stop_fraction=0.15):
+    """
+    A 1 Hz city drive: straight legs joined by turns, with red-light stops,
+    Gaussian GPS noise and occasional outlier fixes
+
+    Returns:
+        (true_lats, true_lngs, fixes) where fixes are noisy (lat, lng, time_ms)
+    """
+    seconds = minutes * 60
+    heading = rng.uniform(0, 2 * np.pi)
+    speed = np.full(seconds, 0.0)
+    headings = np.empty(seconds)
+    t = 0
+    while t < seconds:
+        leg = int(rng.integers(20, 120))
+        if rng.random() < stop_fraction:
+            speed[t:t + leg // 2] = 0.0
+        else:
+            speed[t:t + leg] = rng.uniform(6, 15)  # m/s
+        headings[t:t + leg] = heading
+        heading += rng.choice([-np.pi / 2, np.pi / 2, rng.uniform(-0.4, 0.4)])
+        t += leg
+
+    north = np.cumsum(speed * np.cos(headings))
+    east = np.cumsum(speed * np.sin(headings))
+    true_lats = 37.7749 + north / METRES_PER_DEGREE
+    true_lngs = -122.4194 + east / (METRES_PER_DEGREE * np.cos(np.radians(37.7749)))
+
+    noisy_lats = true_lats + rng.normal(0, noise_m, seconds) / METRES_PER_DEGREE
+    noisy_lngs = true_lngs + rng.normal(0, noise_m, seconds) / (METRES_PER_DEGREE * np.cos(np.radians(37.7749)))
+    outliers = rng.random(seconds) < outlier_rate
+    noisy_lats[outliers] += rng.normal(0, 500, outliers.sum()) / METRES_PER_DEGREE
+    times = 1_700_000_000_000 + np.arange(seconds) * 1000
+    return true_lats, true_lngs, list(zip(noisy_lats.tolist(), noisy_lngs.tolist(), times.tolist()))
+
+
+class Command(BaseCommand):
+    help = "Trace filtering and simplification on synthetic 1 Hz drives: point reduction and distance error"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tolerances', type=float, nargs='+', default=[2.0, 5.0, 10.0, 20.0],
+                            help="Simplification tolerances in metres")
+        parser.add_argument('--traces', type=int, default=20)
+        parser.add_argument('--minutes', type=int, default=20, help="Length of each drive")
+        parser.add_argument('--noise', type=float, default=3.0, help="GPS noise (standard deviation, metres)")
+        parser.add_argument('--outliers', type=float, default=0.01, help="Fraction of fixes that are outliers")
+        parser.add_argument('--min-step', type=float, default=10.0)
+        parser.add_argument('--max-speed', type=float, default=200.0)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        drives = [
+            synthetic_drive(rng, options['minutes'], options['noise'], options['outliers'])
+            for _ in range(options['traces'])
+        ]
+
+        raw_points = filtered_points = 0
+        raw_error = filtered_error = filter_seconds = 0.0
+        filtered = []
+        for true_lats, true_lngs, fixes in drives:
+            truth = path_length_km(true_lats, true_lngs)
+            start = time.perf_counter()
+            kept = filter_fixes(fixes, min_step_m=options['min_step'], max_speed_kmh=options['max_speed'])
+            filter_seconds += time.perf_counter() - start
+            lats, lngs, _ = (np.array(column) for column in zip(*kept))
+            raw_lats, raw_lngs, _ = zip(*fixes)
+            raw_error += abs(path_length_km(raw_lats, raw_lngs) - truth) / truth
+            filtered_error += abs(path_length_km(lats, lngs) - truth) / truth
+            raw_points += len(fixes)
+            filtered_points += len(kept)
+            filtered.append((truth, lats, lngs))
+
+        n = len(drives)
+        self.stdout.write(
+            f"{n} drives, {raw_points // n} fixes each; raw distance error {raw_error / n:.2%}; "
+            f"filtered to {filtered_points // n} fixes, distance error {filtered_error / n:.2%}, "
+            f"{filter_seconds * 1e6 / raw_points:.1f} us/fix"
+        )
+        self.stdout.write(
+            f"{'tolerance m':>11} {'points':>7} {'reduction':>9} {'dist err':>9} {'max dist err':>12} {'ms/trace':>9}"
+        )
+        for tolerance in options['tolerances']:
+            points, errors, seconds = 0, [], 0.0
+            for truth, lats, lngs in filtered:
+                start = time.perf_counter()
+                kept = simplify_path(lats, lngs, tolerance)
+                seconds += time.perf_counter() - start
+                points += len(kept)
+                errors.append(abs(path_length_km(lats[kept], lngs[kept]) - truth) / truth)
+            self.stdout.write(
+                f"{tolerance:>11.1f} {points // n:>7} {raw_points / points:>8.1f}x {np.mean(errors):>9.2%} "
+                f"{np.max(errors):>12.2%} {seconds * 1000 / n:>9.2f}"
+            )
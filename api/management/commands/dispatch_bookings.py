@@ -0,0 +1,34 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.dispatch import DispatchEngine, SOLVERS
+
+
+class Command(BaseCommand):
+    help = "Match pending bookings to nearby available drivers"
+
+    def add_arguments(self, parser):
+        config = getattr(settings, 'DISPATCH', {})
+        parser.add_argument('--mode', choices=sorted(SOLVERS), default=config.get('MODE', 'optimal'))
+        parser.add_argument('--radius', type=float, default=config.get('RADIUS_KM', 5.0),
+                            help="Maximum pickup distance in km")
+        parser.add_argument('--max-batch', type=int, default=config.get('MAX_BATCH', 200))
+        parser.add_argument('--window', type=float, default=None,
+                            help="Keep running, collecting requests for N seconds per round "
+                                 f"(DISPATCH['WINDOW_SECONDS'] is {config.get('WINDOW_SECONDS', 2.0)})")
+
+    def handle(self, *args, **options):
+        engine = DispatchEngine(radius_km=options['radius'], mode=options['mode'], max_batch=options['max_batch'])
+
+        while True:
+            started = time.monotonic()
+            result = engine.dispatch()
+            if result['requests'] or options['verbosity'] > 1:
+                self.stdout.write(
+                    f"{result['assigned']}/{result['requests']} bookings assigned from {result['drivers']} drivers, "
+                    f"{result['total_pickup_km']} km total pickup, solve {result['solve_ms']} ms, "
+                    f"round {result['elapsed_ms']} ms"
+                )
+            if options['window'] is None:
+                break
+            time.sleep(max(0.0, options['window'] - (time.monotonic() - started)))
@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from api.location_store import get_location_store
+from api.models import DriverProfile
+
+
+class Command(BaseCommand):
+    help = ("Write queued live driver positions back to the database. Only a shared store (Redis) can be "
+            "flushed from here: an in-memory store lives inside each web process, which flushes it on a "
+            "timer itself, and this command only sees its own empty copy.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Keep running and flush every N seconds")
+        parser.add_argument('--reload', action='store_true',
+                            help="First seed the store with available drivers from the database")
+
+    def handle(self, *args, **options):
+        store = get_location_store()
+        if store is None:
+            raise CommandError("DRIVER_LOCATION_STORE is not configured")
+
+        if options['reload']:
+            rows = DriverProfile.objects.available().values_list(
+                'id', 'current_latitude', 'current_longitude', 'last_location_update'
+            )
+            store.load(rows.iterator())
+            self.stdout.write(f"Loaded {rows.count()} driver positions")
+
+        while True:
+            written = store.flush()
+            if written or options['verbosity'] > 1:
+                self.stdout.write(f"Flushed {written} driver positions")
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import random
+import time
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.routing import URLRouter
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from api.ingest import location_buffer
+from api.models import User, DriverProfile
+from api.routing import websocket_urlpatterns
+
+
+class Command(BaseCommand):
+    help = ("Simulate concurrent driver WebSockets and report database writes per "
+            "second with per-message writes vs. the batched ingest buffer. "
+            "Temporary loadtest-driver-* users are deleted afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, default=300)
+        parser.add_argument('--messages', type=int, default=10, help="Pings per socket")
+        parser.add_argument('--rate', type=float, default=4.0, help="Pings per second per socket")
+        parser.add_argument('--flush-interval', type=float, default=1.0)
+        parser.add_argument('--max-batch', type=int, default=500)
+
+    def handle(self, *args, **options):
+        self.writes = 0
+        in_memory_layer = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+        # database_sync_to_async closes connections inside atomic blocks, so
+        # the simulated drivers are real rows that get cleaned up at the end
+        user_ids = self.create_drivers(options['sockets'])
+        try:
+            with override_settings(CHANNEL_LAYERS=in_memory_layer), \
+                    connection.execute_wrapper(self.count_writes):
+                modes = [
+                    ('per-message', 0, 1),
+                    ('batched', options['flush_interval'], options['max_batch']),
+                ]
+                self.stdout.write(f"{'mode':>12} {'pings':>7} {'db writes':>10} {'seconds':>8} {'writes/s':>9}")
+                for label, flush_interval, max_batch in modes:
+                    location_buffer.flush_interval = flush_interval
+                    location_buffer.max_batch = max_batch
+                    writes_before = self.writes
+                    pings, elapsed = async_to_sync(self.simulate)(
+                        user_ids, options['messages'], options['rate']
+                    )
+                    writes = self.writes - writes_before
+                    self.stdout.write(
+                        f"{label:>12} {pings:>7} {writes:>10} {elapsed:>8.2f} {writes / elapsed:>9.1f}"
+                    )
+        finally:
+            User.objects.filter(id__in=user_ids).delete()
+
+    def count_writes(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith(('UPDATE', 'INSERT', 'DELETE')):
+            self.writes += 1
+        return execute(sql, params, many, context)
+
+    def create_drivers(self, count):
+        users = User.objects.bulk_create(
+            User(username=f'loadtest-driver-{i}', is_driver=True) for i in range(count)
+        )
+        DriverProfile.objects.bulk_create(
+            DriverProfile(
+                user=user, license_number='LOADTEST', vehicle_make='-', vehicle_model='-',
+                vehicle_year=2020, vehicle_color='-', license_plate='-', is_available=True
+            )
+            for user in users
+        )
+        return [user.id for user in users]
+
+    async def simulate(self, user_ids, messages, rate):
+        # channels.testing needs daphne, so drive the ASGI app directly
+        application = URLRouter(websocket_urlpatterns)
+        sockets = [
+            ApplicationCommunicator(application, {
+                'type': 'websocket', 'path': f'/ws/location/{user_id}/', 'headers': [],
+                'query_string': b'', 'subprotocols': [],
+            })
+            for user_id in user_ids
+        ]
+        for socket in sockets:
+            await socket.send_input({'type': 'websocket.connect'})
+        await asyncio.gather(*(socket.receive_output(timeout=60) for socket in sockets))
+
+        rng = random.Random(0)
+        start = time.perf_counter()
+        for _ in range(messages):
+            for socket in sockets:
+                await socket.send_input({'type': 'websocket.receive', 'text': json.dumps({
+                    'latitude': 37.77 + rng.uniform(-0.1, 0.1),
+                    'longitude': -122.42 + rng.uniform(-0.1, 0.1),
+                })})
+            await asyncio.sleep(1 / rate)
+
+        for socket in sockets:
+            await socket.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.gather(*(socket.wait(timeout=60) for socket in sockets))
+        await location_buffer.drain()
+        return len(sockets) * messages, time.perf_counter() - start
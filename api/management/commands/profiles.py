@@ -0,0 +1,74 @@
+import pstats
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.profiling import ProfileStore
+
+
+class Command(BaseCommand):
+    help = ("List the request profiles recorded by ProfilingMiddleware, or aggregate them: the hottest "
+            "functions across stack samples and merged cProfile stats")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--route', help="Only profiles of this URL pattern, e.g. bookings/<int:pk>/complete-trip/")
+        parser.add_argument('--min-ms', type=float, default=0, help="Only requests that took at least this long")
+        parser.add_argument('--aggregate', action='store_true')
+        parser.add_argument('--limit', type=int, default=25, help="Profiles listed, or functions per table")
+        parser.add_argument('--output', help="With --aggregate, write the merged .collapsed or .pstats here")
+
+    def handle(self, *args, **options):
+        config = getattr(settings, 'PROFILING', {})
+        store = ProfileStore(config.get('DIRECTORY', settings.BASE_DIR / 'profiles'))
+        profiles = [
+            meta for meta in store.load()
+            if (options['route'] is None or meta['route'] == options['route'])
+            and meta['duration_ms'] >= options['min_ms']
+        ]
+        if not profiles:
+            raise CommandError(f"No profiles in {store.directory}")
+
+        if not options['aggregate']:
+            self.stdout.write(f"{'time':<26} {'ms':>9} {'status':>6} {'trigger':>7} {'mode':>8}  request")
+            for meta in profiles[-options['limit']:]:
+                self.stdout.write(
+                    f"{meta['time'][:26]:<26} {meta['duration_ms']:>9.1f} {meta['status']:>6} {meta['trigger']:>7} "
+                    f"{meta['mode']:>8}  {meta['method']} {meta['path']}  ({meta['file']})"
+                )
+            return
+
+        collapsed = [store.directory / meta['file'] for meta in profiles if meta['mode'] == 'stack']
+        cprofiled = [store.directory / meta['file'] for meta in profiles if meta['mode'] == 'cprofile']
+        if collapsed:
+            self.aggregate_stacks(collapsed, options['limit'], options['output'])
+        if cprofiled:
+            stats = pstats.Stats(*map(str, cprofiled), stream=self.stdout)
+            self.stdout.write(f"\n{len(cprofiled)} cProfile profiles")
+            stats.sort_stats('cumulative').print_stats(options['limit'])
+            if options['output'] and not collapsed:
+                stats.dump_stats(options['output'])
+
+    def aggregate_stacks(self, paths, limit, output):
+        stacks = Counter()
+        for path in paths:
+            for line in path.read_text().splitlines():
+                stack, _, count = line.rpartition(' ')
+                stacks[stack] += int(count)
+
+        total = sum(stacks.values())
+        own, inclusive = Counter(), Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+
+        self.stdout.write(f"{len(paths)} sampled profiles, {total} samples")
+        for title, counts in (('own', own), ('inclusive', inclusive)):
+            self.stdout.write(f"\n{title:>9} {'%':>6}  function")
+            for frame, count in counts.most_common(limit):
+                self.stdout.write(f"{count:>9} {count / total:>6.1%}  {frame}")
+
+        if output:
+            with open(output, 'w') as f:
+                f.writelines(f'{stack} {count}\n' for stack, count in stacks.most_common())
+            self.stdout.write(f"\nMerged stacks written to {output}")
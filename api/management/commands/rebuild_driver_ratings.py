@@ -0,0 +1,17 @@
+import time
+from django.core.management.base import BaseCommand
+from api.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute every driver's rating aggregates from the Review table (backfill or repair)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--driver', type=int, action='append', dest='drivers',
+                            help="Driver user id to rebuild; repeatable. Defaults to all drivers")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        written = rebuild_ratings(options['drivers'], batch_size=options['batch_size'])
+        self.stdout.write(f"Rebuilt ratings of {written} drivers in {time.perf_counter() - start:.2f}s")
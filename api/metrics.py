@@ -0,0 +1,176 @@
+# metrics.py
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+_current = ContextVar('request_metrics', default=None)
+
+class RequestMetrics:
+    """What one request spent, filled in while it runs"""
+
+    def __init__(self, max_statements=50):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.statements = []
+        self.max_statements = max_statements
+        self._serializing = False
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """connection.execute_wrapper() hook timing every query"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.db_seconds += elapsed
+            if len(self.statements) < self.max_statements:
+                self.statements.append((sql, round(elapsed * 1000, 3)))
+
+@contextmanager
+def collect_request_metrics(max_statements=50):
+    metrics = RequestMetrics(max_statements)
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def measure_serialization():
+    """Add the enclosed time to the current request's serializer time; nested calls count once"""
+    metrics = _current.get()
+    if metrics is None or metrics._serializing:
+        yield
+        return
+    metrics._serializing = True
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serialize_seconds += time.perf_counter() - start
+        metrics._serializing = False
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+def _labels(**labels):
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+class MetricsRegistry:
+    """
+    In-process request metrics, exported in the Prometheus text format
+
+    Per route (the URL pattern, so ids do not split series) it keeps
+    histograms of latency, database queries, database time, serializer
+    time and response size, and a request counter per status. Requests
+    slower than slow_seconds are kept, with their SQL, in a ring of the
+    last slow_samples.
+
+    Every process has its own registry; Prometheus scrapes each worker.
+    """
+
+    HISTOGRAMS = (
+        ('http_request_duration_seconds', 'Request latency', LATENCY_BUCKETS),
+        ('http_request_db_queries', 'Database queries per request', QUERY_BUCKETS),
+        ('http_request_db_seconds', 'Database time per request', LATENCY_BUCKETS),
+        ('http_request_serialize_seconds', 'Serializer time per request', LATENCY_BUCKETS),
+        ('http_response_size_bytes', 'Response body size', SIZE_BUCKETS),
+    )
+
+    def __init__(self, slow_seconds=1.0, slow_samples=50):
+        self.slow_seconds = slow_seconds
+        self.requests = defaultdict(int)  # (method, route, status) -> count
+        self.histograms = {
+            name: defaultdict(lambda buckets=buckets: Histogram(buckets)) for name, _, buckets in self.HISTOGRAMS
+        }
+        self.slow = deque(maxlen=slow_samples)
+        self._lock = threading.Lock()
+
+    def observe(self, method, route, status, duration, metrics, response_bytes=None):
+        """Record a finished request; metrics is its RequestMetrics"""
+        key = (method, route)
+        values = {
+            'http_request_duration_seconds': duration,
+            'http_request_db_queries': metrics.queries,
+            'http_request_db_seconds': metrics.db_seconds,
+            'http_request_serialize_seconds': metrics.serialize_seconds,
+            'http_response_size_bytes': response_bytes,
+        }
+        with self._lock:
+            self.requests[(method, route, status)] += 1
+            for name, value in values.items():
+                if value is not None:
+                    self.histograms[name][key].observe(value)
+            if duration >= self.slow_seconds:
+                self.slow.append({
+                    'method': method,
+                    'route': route,
+                    'status': status,
+                    'duration_ms': round(duration * 1000, 3),
+                    'queries': metrics.queries,
+                    'db_ms': round(metrics.db_seconds * 1000, 3),
+                    'serialize_ms': round(metrics.serialize_seconds * 1000, 3),
+                    'sql': metrics.statements,
+                })
+
+    def slow_requests(self):
+        with self._lock:
+            return list(self.slow)
+
+    def render(self):
+        """Prometheus text exposition of everything recorded so far"""
+        lines = [
+            '# HELP http_requests_total Requests served',
+            '# TYPE http_requests_total counter',
+        ]
+        with self._lock:
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{_labels(method=method, route=route, status=status)} {count}')
+
+            for name, help_text, buckets in self.HISTOGRAMS:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (method, route), histogram in sorted(self.histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip((*buckets, '+Inf'), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_labels(method=method, route=route, le=bound)} {cumulative}')
+                    series = _labels(method=method, route=route)
+                    lines.append(f'{name}_sum{series} {histogram.sum!r}')
+                    lines.append(f'{name}_count{series} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            for histograms in self.histograms.values():
+                histograms.clear()
+            self.slow.clear()
+
+
+_metrics_config = getattr(settings, 'METRICS', {})
+metrics_registry = MetricsRegistry(
+    slow_seconds=_metrics_config.get('SLOW_REQUEST_SECONDS', 1.0),
+    slow_samples=_metrics_config.get('SLOW_REQUEST_SAMPLES', 50),
+)
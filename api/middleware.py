@@ -1,23 +1,54 @@
 # middleware.py
+import hmac
 import json
+import random
 import time
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
 from django.utils.deprecation import MiddlewareMixin
 from django.conf import settings
 import logging
+from .metrics import collect_request_metrics, metrics_registry
+from .profiling import ProfileStore, RequestProfiler, StackSampler
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
 
 logger = logging.getLogger(__name__)
 
-class RequestLogMiddleware(MiddlewareMixin):
-    """Log all requests and responses"""
+class RequestLogMiddleware:
+    """
+    Log all requests and responses, and record their metrics
+
+    Each request is timed with perf_counter and its queries through
+    connection.execute_wrapper(); latency, query count, database and
+    serializer time and response size go to the metrics registry
+    (api/metrics.py), exported at /metrics.
+    """
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.max_statements = getattr(settings, 'METRICS', {}).get('MAX_SQL_STATEMENTS', 50)
     
-    def process_request(self, request):
-        request.start_time = time.time()
+    def __call__(self, request):
+        start = time.perf_counter()
+        with collect_request_metrics(self.max_statements) as metrics, \
+                connection.execute_wrapper(metrics.execute_wrapper):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
         
-    def process_response(self, request, response):
-        if hasattr(request, 'start_time'):
-            duration = time.time() - request.start_time
-            
+        match = request.resolver_match
+        route = match.route if match is not None else 'unmatched'
+        size = None if response.streaming else len(response.content)
+        metrics_registry.observe(request.method, route, response.status_code, duration, metrics, size)
+        
+        # Don't log media/static file requests
+        if not any(path in request.path for path in ['/media/', '/static/']):
             log_data = {
                 'remote_address': request.META.get('REMOTE_ADDR'),
                 'server_hostname': request.META.get('SERVER_NAME'),
@@ -25,17 +56,144 @@ class RequestLogMiddleware(MiddlewareMixin):
                 'request_path': request.get_full_path(),
                 'response_status': response.status_code,
                 'duration': duration,
+                'db_queries': metrics.queries,
+                'db_time': metrics.db_seconds,
                 'timestamp': timezone.now().isoformat(),
             }
             
             # Log user if authenticated
             if hasattr(request, 'user') and request.user.is_authenticated:
                 log_data['user'] = request.user.username
-                
-            # Don't log media/static file requests
-            if not any(path in request.path for path in ['/media/', '/static/']):
-                logger.info(f"Request: {json.dumps(log_data)}")
-                
+            
+            logger.info(f"Request: {json.dumps(log_data)}")
+        
+        return response
+
+class ProfilingMiddleware:
+    """
+    Profile selected requests (see PROFILING in settings)
+
+    A request is profiled when it sends the X-Profile header with the
+    configured token, when it falls in the random SAMPLE_RATE, or when
+    its route has a threshold in ROUTES; those are always profiled but
+    only kept if they take at least the threshold. Profiles are stack
+    samples in collapsed format (MODE 'stack') or cProfile pstats (MODE
+    'cprofile'), written to DIRECTORY; `manage.py profiles` lists and
+    aggregates them.
+
+    Profiling starts once the URL is resolved, so it covers the view and
+    rendering but not the middleware outside this one. With ENABLED off
+    the middleware removes itself from the stack.
+    """
+    
+    def __init__(self, get_response):
+        config = getattr(settings, 'PROFILING', {})
+        if not config.get('ENABLED'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.mode = config.get('MODE', 'stack')
+        self.token = config.get('TOKEN')
+        self.sample_rate = config.get('SAMPLE_RATE', 0.0)
+        self.routes = config.get('ROUTES', {})
+        self.sampler = StackSampler(config.get('INTERVAL', 0.005))
+        self.store = ProfileStore(config.get('DIRECTORY', settings.BASE_DIR / 'profiles'),
+                                  config.get('MAX_PROFILES', 500))
+    
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        profiler = getattr(request, '_profiler', None)
+        if profiler is None:
+            return response
+        
+        profiler.stop()
+        duration = time.perf_counter() - start
+        trigger, threshold = request._profile_trigger
+        if duration >= threshold:
+            self.store.save(profiler, {
+                'method': request.method,
+                'route': request.resolver_match.route,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 3),
+                'trigger': trigger,
+            })
+        return response
+    
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        header = request.headers.get('X-Profile')
+        if header and self.token and hmac.compare_digest(header, self.token):
+            trigger = ('header', 0)
+        elif self.sample_rate and random.random() < self.sample_rate:
+            trigger = ('sample', 0)
+        elif request.resolver_match.route in self.routes:
+            trigger = ('route', self.routes[request.resolver_match.route])
+        else:
+            return None
+        request._profile_trigger = trigger
+        request._profiler = RequestProfiler(self.mode, self.sampler)
+        request._profiler.start()
+        return None
+
+def accepted_encodings(header):
+    """Content codings an Accept-Encoding header allows, i.e. not given q=0"""
+    accepted = set()
+    for item in header.split(','):
+        coding, *params = (part.strip() for part in item.split(';'))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.lower())
+    return accepted
+
+class CompressionMiddleware:
+    """
+    Compress responses of at least MIN_SIZE bytes (see COMPRESSION in settings)
+
+    Brotli is used when the client accepts it and the brotli package is
+    installed, gzip otherwise. Like Django's GZipMiddleware it adds
+    Vary: Accept-Encoding, weakens the ETag, keeps the body as it is if
+    compressing does not shrink it, and pads gzip with random bytes
+    against BREACH. Streaming responses are left alone.
+    """
+    
+    def __init__(self, get_response):
+        config = getattr(settings, 'COMPRESSION', {})
+        self.get_response = get_response
+        self.min_size = config.get('MIN_SIZE', 1024)
+        self.brotli_quality = config.get('BROTLI_QUALITY', 5)
+    
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.streaming or response.has_header('Content-Encoding') \
+                or len(response.content) < self.min_size:
+            return response
+        
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        if brotli is not None and 'br' in accepted:
+            encoding = 'br'
+            compressed = brotli.compress(response.content, quality=self.brotli_quality)
+        elif 'gzip' in accepted or '*' in accepted:
+            encoding = 'gzip'
+            compressed = compress_string(response.content, max_random_bytes=100)
+        else:
+            return response
+        if len(compressed) >= len(response.content):
+            return response
+        
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        response.headers['Content-Encoding'] = encoding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
         return response
 
 class ActivityTrackingMiddleware(MiddlewareMixin):
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-17 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='driverprofile',
+            index=models.Index(fields=['is_available', 'current_latitude', 'current_longitude'], name='driver_available_location_idx'),
+        ),
+    ]
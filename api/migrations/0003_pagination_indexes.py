@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-17 20:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_driver_available_location_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['user', '-booking_time', '-id'], name='booking_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['driver', '-booking_time', '-id'], name='booking_driver_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='notification_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['-timestamp', '-id'], name='payment_time_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.7 on 2026-10-17 20:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='booking',
+            name='driver',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='driver_bookings', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-17 20:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_geocoded_address'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripTrace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.BinaryField(default=b'')),
+                ('point_count', models.PositiveIntegerField(default=0)),
+                ('distance_km', models.FloatField(default=0)),
+                ('started_at_ms', models.BigIntegerField(default=0)),
+                ('last_lat_e7', models.IntegerField(default=0)),
+                ('last_lng_e7', models.IntegerField(default=0)),
+                ('last_time_ms', models.BigIntegerField(default=0)),
+                ('trip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='trace', to='api.trip')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 20:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_trip_trace'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='triptrace',
+            name='simplified',
+            field=models.BooleanField(default=False),
+        ),
+    ]
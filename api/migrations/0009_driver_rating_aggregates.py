@@ -0,0 +1,35 @@
+# Generated by Django 5.1.7 on 2026-10-17 20:32
+
+import django.db.models.expressions
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_trip_trace_simplified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='driverprofile',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='driverprofile',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='driverprofile',
+            name='rating_recent',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='driverprofile',
+            name='rating_average',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast('rating_sum', models.FloatField()), '/', django.db.models.functions.comparison.NullIf('rating_count', 0)), output_field=models.FloatField(null=True)),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 21:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_driver_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='dispatched',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-17 21:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_booking_dispatched'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='payment',
+            name='payment_time_idx',
+        ),
+    ]
@@ -1,7 +1,10 @@
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.functions import Cast, NullIf
 from django.contrib.auth.models import Group, Permission
+from .utils import bounding_box
 
 # Create your models here.
 class User(AbstractUser):
@@ -29,6 +32,36 @@ class User(AbstractUser):
         related_query_name="api_user", #add this line
     )
     
+class DriverProfileQuerySet(models.QuerySet):
+    def available(self):
+        """Drivers that are online and have reported a position"""
+        # is_available=True compiles to a bare boolean column, which SQLite
+        # cannot match against driver_available_location_idx; IN (true) can.
+        return self.filter(
+            is_available__in=[True],
+            current_latitude__isnull=False,
+            current_longitude__isnull=False
+        )
+
+    def within_bounding_box(self, latitude, longitude, radius_km):
+        """
+        Cheap spatial prefilter: drivers inside the lat/lng box around a
+        search circle. Callers still apply the exact haversine check.
+        """
+        min_lat, max_lat, min_lng, max_lng = bounding_box(latitude, longitude, radius_km)
+        queryset = self.filter(current_latitude__range=(min_lat, max_lat))
+
+        # Split the longitude range when the box crosses the antimeridian
+        if min_lng < -180:
+            return queryset.filter(
+                models.Q(current_longitude__gte=min_lng + 360) | models.Q(current_longitude__lte=max_lng)
+            )
+        if max_lng > 180:
+            return queryset.filter(
+                models.Q(current_longitude__gte=min_lng) | models.Q(current_longitude__lte=max_lng - 360)
+            )
+        return queryset.filter(current_longitude__range=(min_lng, max_lng))
+
 class DriverProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='driver_profile')
     license_number = models.CharField(max_length=20)
@@ -50,10 +83,31 @@ class DriverProfile(models.Model):
     current_latitude = models.FloatField(null=True, blank=True)
     current_longitude = models.FloatField(null=True, blank=True)
     last_location_update = models.DateTimeField(null=True, blank=True)
+    # Review aggregates, kept current by api/ratings.py
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_average = models.GeneratedField(
+        expression=Cast('rating_sum', models.FloatField()) / NullIf('rating_count', 0),
+        output_field=models.FloatField(null=True),
+        db_persist=True,
+    )
+    # Exponential moving average weighted towards the last RATINGS['RECENT_WINDOW'] reviews
+    rating_recent = models.FloatField(null=True, blank=True)
+
+    objects = DriverProfileQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['is_available', 'current_latitude', 'current_longitude'],
+                name='driver_available_location_idx'
+            ),
+        ]
     
 class Booking(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bookings')
-    driver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='driver_bookings')
+    # Empty until the dispatcher (api/dispatch.py) assigns a driver
+    driver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='driver_bookings', null=True, blank=True)
     pickup_latitude = models.FloatField()
     pickup_longitude = models.FloatField()
     pickup_address = models.CharField(max_length=255)
@@ -73,6 +127,16 @@ class Booking(models.Model):
         ],
         default='pending'
     )
+    # Set when the dispatcher took the driver off the market for this
+    # booking, so ending it puts them back (see dispatch.release_driver)
+    dispatched = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of each side's booking history
+            models.Index(fields=['user', '-booking_time', '-id'], name='booking_user_time_idx'),
+            models.Index(fields=['driver', '-booking_time', '-id'], name='booking_driver_time_idx'),
+        ]
     
 class Trip(models.Model):
     booking = models.OneToOneField(Booking, on_delete=models.CASCADE, related_name='trip')
@@ -103,6 +167,9 @@ class Payment(models.Model):
         ],
         default='pending'
     )
+    # No (timestamp, id) index: the payments list is filtered through
+    # trip__booking__user/driver, so the booking indexes pick the rows and
+    # only that user's payments are sorted
     timestamp = models.DateTimeField(auto_now_add=True)
     
 class Review(models.Model):
@@ -133,4 +200,49 @@ class Notification(models.Model):
     message = models.TextField()
     is_read = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
-    related_booking = models.ForeignKey(Booking, on_delete=models.SET_NULL, null=True, blank=True)
\ No newline at end of file
+    related_booking = models.ForeignKey(Booking, on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-timestamp', '-id'], name='notification_user_time_idx'),
+        ]
+
+class IdempotencyKey(models.Model):
+    """Stored response of a booking action, replayed when a client retries with the same key"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=64)
+    action = models.CharField(max_length=20)
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='+')
+    response_status = models.PositiveSmallIntegerField()
+    response_body = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+class GeocodedAddress(models.Model):
+    """Persistent geocoding cache, keyed by normalized address; null coordinates mean no match"""
+    address = models.CharField(max_length=255, unique=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+class TripTrace(models.Model):
+    """
+    GPS trace of a trip, delta-encoded as packed int32 (see traces.py)
+
+    The last point is kept unencoded so new batches can be appended
+    without decoding the trace. Once the trip is completed the points are
+    replaced by the simplified path.
+    """
+    trip = models.OneToOneField(Trip, on_delete=models.CASCADE, related_name='trace')
+    points = models.BinaryField(default=b'')
+    point_count = models.PositiveIntegerField(default=0)
+    distance_km = models.FloatField(default=0)
+    started_at_ms = models.BigIntegerField(default=0)
+    last_lat_e7 = models.IntegerField(default=0)
+    last_lng_e7 = models.IntegerField(default=0)
+    last_time_ms = models.BigIntegerField(default=0)
+    simplified = models.BooleanField(default=False)
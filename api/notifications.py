@@ -0,0 +1,150 @@
+# notifications.py
+import uuid
+import weakref
+from collections import Counter
+from asgiref.local import Local
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .tasks import task_queue, send_push, broadcast_notification
+
+UNREAD_KEY = 'notifications:unread:{}'
+UNREAD_VERSION_KEY = 'notifications:unread-version:{}'
+
+class NotificationBuffer:
+    """
+    Notifications queued by one transaction, written with one bulk_create
+    when it commits
+
+    Notifications are de-duplicated on (user, title, booking) within the
+    batch and the last one wins, so an action's specific "Booking Accepted"
+    message replaces a generic one queued earlier in the same request.
+    Nothing is de-duplicated against notifications already stored: a
+    repeat from a later transaction is a real notification.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self.flushed = False
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, user_id, title, message, related_booking_id=None, push=True):
+        key = (user_id, title, related_booking_id)
+        # Re-insert so a replaced entry moves to the end of the batch
+        self._pending.pop(key, None)
+        self._pending[key] = (message, push)
+
+    def flush(self):
+        """
+        Write everything buffered so far
+
+        Returns:
+            Number of notifications created
+        """
+        from .models import Notification
+        from .serializers import NotificationSerializer
+
+        batch, self._pending = self._pending, {}
+        self.flushed = True
+        if not batch:
+            return 0
+
+        entries = list(batch.items())
+        created = Notification.objects.bulk_create(
+            Notification(user_id=user_id, title=title, message=message, related_booking_id=booking_id)
+            for (user_id, title, booking_id), (message, push) in entries
+        )
+
+        for user_id, count in Counter(notification.user_id for notification in created).items():
+            adjust_unread_count(user_id, count)
+
+        for notification, (_, (message, push)) in zip(created, entries):
+            task_queue.submit(broadcast_notification, notification.user_id, dict(NotificationSerializer(notification).data))
+            if push:
+                task_queue.submit(
+                    send_push, notification.user_id, notification.title, message,
+                    {'booking_id': notification.related_booking_id}
+                )
+        return len(created)
+
+
+_notification_config = getattr(settings, 'NOTIFICATIONS', {})
+# Per thread, like database connections: {(alias, savepoint ids): buffer}
+# of the transaction or savepoint each buffer is waiting on. Only its
+# on_commit callback holds a buffer, so the entry disappears once the
+# transaction commits, or the transaction or savepoint rolls back.
+_transaction_buffers = Local()
+
+def transaction_buffer(using=None):
+    """
+    The NotificationBuffer waiting on the current transaction or savepoint,
+    created and registered to flush on commit on first use
+
+    Savepoint ids are never reused by a connection, so a rolled back
+    savepoint's buffer is not picked up again; each savepoint has its own
+    buffer so a rollback drops only what was queued inside it.
+    """
+    connection = transaction.get_connection(using)
+    buffers = getattr(_transaction_buffers, 'buffers', None)
+    if buffers is None:
+        buffers = _transaction_buffers.buffers = weakref.WeakValueDictionary()
+    key = (connection.alias, tuple(connection.savepoint_ids))
+    buffer = buffers.get(key)
+    if buffer is None or buffer.flushed:
+        buffer = buffers[key] = NotificationBuffer()
+        # Runs once the data is committed, so a failed write is logged rather
+        # than failing the request
+        transaction.on_commit(buffer.flush, using=using, robust=True)
+    return buffer
+
+def notify(user_id, title, message, related_booking_id=None, push=True):
+    """
+    Queue an in-app notification (and a push) for a user
+
+    Everything one transaction queues is written in a single bulk_create
+    as it commits, before the request returns, so the client's next read
+    of /notifications/ sees it. Outside a transaction it is written at once.
+    """
+    if transaction.get_autocommit():
+        buffer = NotificationBuffer()
+        buffer.add(user_id, title, message, related_booking_id, push)
+        buffer.flush()
+        return
+    transaction_buffer().add(user_id, title, message, related_booking_id, push)
+
+def get_unread_count(user_id):
+    """
+    Cached number of unread notifications, recounted on a cache miss
+
+    A change that finds no counter to adjust bumps the user's version key.
+    If that happens while the recount runs, the count may miss the change,
+    so it is not kept in the cache.
+    """
+    from .models import Notification
+
+    key = UNREAD_KEY.format(user_id)
+    count = cache.get(key)
+    if count is None:
+        version_key = UNREAD_VERSION_KEY.format(user_id)
+        version = cache.get(version_key)
+        count = Notification.objects.filter(user_id=user_id, is_read=False).count()
+        cache.add(key, count, _notification_config.get('UNREAD_COUNT_TTL', 3600))
+        if cache.get(version_key) != version:
+            cache.delete(key)
+    return count
+
+def adjust_unread_count(user_id, delta):
+    """Shift a cached unread counter; a missing one is recounted on the next read"""
+    if not delta:
+        return
+    key = UNREAD_KEY.format(user_id)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # No counter: a recount may be running and miss this change. Bump
+        # the version so it is discarded, and drop whatever it cached already.
+        cache.set(UNREAD_VERSION_KEY.format(user_id), uuid.uuid4().hex,
+                  _notification_config.get('UNREAD_COUNT_TTL', 3600))
+        cache.delete(key)
@@ -0,0 +1,23 @@
+# pagination.py
+from rest_framework.pagination import CursorPagination
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination: each page is a range scan from the last seen key, so
+    page 500 costs the same as page 1 and no COUNT(*) is run. The opaque
+    cursor is returned in the next/previous links.
+
+    Subclasses set ordering to an indexed column, newest first; id breaks
+    ties between rows sharing a timestamp.
+    """
+    ordering = ('-id',)
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+class BookingCursorPagination(IdCursorPagination):
+    ordering = ('-booking_time', '-id')
+
+class TimestampCursorPagination(IdCursorPagination):
+    """For Notification and Payment, both ordered by their timestamp"""
+    ordering = ('-timestamp', '-id')
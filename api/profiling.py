@@ -0,0 +1,130 @@
+# profiling.py
+import cProfile
+import json
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+MAX_DEPTH = 128
+
+def collapse(frame):
+    """A thread's stack as one 'module:function;...' line, outermost frame first"""
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class StackSampler:
+    """
+    Samples the stacks of registered threads every interval seconds
+
+    One daemon thread serves every profiled request and sleeps on an
+    event while none is, so an idle sampler costs nothing. Samples are
+    counted per collapsed stack, the input format of flamegraph tools.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._sessions = {}  # thread id -> Counter of collapsed stacks
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sampling the calling thread"""
+        with self._lock:
+            self._sessions[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def stop(self):
+        """Stop sampling the calling thread and return its samples"""
+        with self._lock:
+            return self._sessions.pop(threading.get_ident(), Counter())
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            with self._lock:
+                if not self._sessions:
+                    self._wake.clear()
+                    continue
+                frames = sys._current_frames()
+                for thread_id, samples in self._sessions.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[collapse(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+class RequestProfiler:
+    """Profile of one request, by stack sampling or cProfile"""
+
+    def __init__(self, mode, sampler):
+        self.mode = mode
+        self.sampler = sampler
+        self.profile = None
+        self.samples = None
+
+    def start(self):
+        if self.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.sampler.start()
+
+    def stop(self):
+        if self.mode == 'cprofile':
+            self.profile.disable()
+        else:
+            self.samples = self.sampler.stop()
+
+class ProfileStore:
+    """
+    Profiles on disk: <name>.pstats or <name>.collapsed, with <name>.json
+    holding the request it came from. Only the newest max_profiles are kept.
+    """
+
+    def __init__(self, directory, max_profiles=500):
+        self.directory = Path(directory)
+        self.max_profiles = max_profiles
+
+    def save(self, profiler, meta):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        now = datetime.now(dt_timezone.utc)
+        name = f"{now:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:6]}"
+        if profiler.mode == 'cprofile':
+            filename = f'{name}.pstats'
+            profiler.profile.dump_stats(self.directory / filename)
+        else:
+            filename = f'{name}.collapsed'
+            lines = (f'{stack} {count}\n' for stack, count in profiler.samples.most_common())
+            (self.directory / filename).write_text(''.join(lines))
+            meta['samples'] = sum(profiler.samples.values())
+        meta.update(file=filename, mode=profiler.mode, time=now.isoformat())
+        (self.directory / f'{name}.json').write_text(json.dumps(meta))
+        self.prune()
+        return self.directory / filename
+
+    def prune(self):
+        if not self.max_profiles:
+            return
+        for path in self.entries()[:-self.max_profiles]:
+            for suffix in ('.json', '.pstats', '.collapsed'):
+                path.with_suffix(suffix).unlink(missing_ok=True)
+
+    def entries(self):
+        """Metadata files, oldest first"""
+        return sorted(self.directory.glob('*.json')) if self.directory.is_dir() else []
+
+    def load(self):
+        """Metadata of every stored profile, oldest first"""
+        return [json.loads(path.read_text()) for path in self.entries()]
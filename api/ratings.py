@@ -0,0 +1,72 @@
+# ratings.py
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+
+_rating_config = getattr(settings, 'RATINGS', {})
+
+def recent_weight(window=None):
+    """Weight of each new review in rating_recent: 2 / (window + 1), as for an N-period EMA"""
+    return 2 / ((window or _rating_config.get('RECENT_WINDOW', 20)) + 1)
+
+def record_rating(driver_id, rating):
+    """
+    Fold a new review into its driver's aggregates
+
+    One UPDATE of F-expressions, so concurrent reviews of the same driver
+    all count without reading the row first.
+
+    Args:
+        driver_id: The driver's User id, as on Review.driver
+    """
+    from .models import DriverProfile
+
+    weight = recent_weight()
+    DriverProfile.objects.filter(user_id=driver_id).update(
+        rating_count=F('rating_count') + 1,
+        rating_sum=F('rating_sum') + rating,
+        # NULL before the first review, which then becomes the average
+        rating_recent=Coalesce(F('rating_recent') + weight * (rating - F('rating_recent')), Value(float(rating))),
+    )
+
+def rebuild_ratings(driver_ids=None, batch_size=1000):
+    """
+    Recompute driver aggregates from the Review table
+
+    Reviews are streamed in (driver, id) order, so rating_recent comes
+    out as record_rating() would have left it. Used for backfills and
+    whenever a review is edited or deleted.
+
+    Args:
+        driver_ids: Driver User ids to rebuild; all drivers when None
+
+    Returns:
+        Number of driver profiles written
+    """
+    from .models import DriverProfile, Review
+
+    weight = recent_weight()
+    reviews = Review.objects.order_by('driver_id', 'id').values_list('driver_id', 'rating')
+    profiles = DriverProfile.objects.only('id', 'user_id')
+    if driver_ids is not None:
+        reviews = reviews.filter(driver_id__in=driver_ids)
+        profiles = profiles.filter(user_id__in=driver_ids)
+
+    totals = {}  # driver id -> [count, sum, recent]
+    for driver_id, rating in reviews.iterator(chunk_size=batch_size * 10):
+        entry = totals.get(driver_id)
+        if entry is None:
+            totals[driver_id] = [1, rating, float(rating)]
+        else:
+            entry[0] += 1
+            entry[1] += rating
+            entry[2] += weight * (rating - entry[2])
+
+    profiles = list(profiles)
+    for profile in profiles:
+        profile.rating_count, profile.rating_sum, profile.rating_recent = totals.get(profile.user_id, (0, 0, None))
+    with transaction.atomic():
+        DriverProfile.objects.bulk_update(profiles, ['rating_count', 'rating_sum', 'rating_recent'],
+                                          batch_size=batch_size)
+    return len(profiles)
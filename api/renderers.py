@@ -0,0 +1,77 @@
+# renderers.py
+import codecs
+import math
+from decimal import Decimal
+from django.conf import settings
+from rest_framework import renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.utils.encoders import JSONEncoder
+
+# orjson is listed in requirements.txt; without it both classes behave
+# exactly like DRF's stock JSONRenderer and JSONParser
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Options of the compact output DRF renders by default; datetimes are
+# passed to the DRF encoder so they come out the same ('Z', not '+00:00')
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+_encoder = JSONEncoder()
+
+def has_non_finite(data):
+    """True if data holds a NaN or infinite float or Decimal anywhere"""
+    if isinstance(data, float):
+        return not math.isfinite(data)
+    if isinstance(data, Decimal):
+        return not data.is_finite()
+    if isinstance(data, dict):
+        return any(has_non_finite(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return any(has_non_finite(value) for value in data)
+    return False
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    JSONRenderer producing the same bytes through orjson
+
+    Types orjson does not know (Decimal, lazy strings, numpy scalars,
+    datetimes...) go through DRF's encoder. Indented output (the
+    browsable API, `; indent=N` media types), ASCII or non-compact
+    settings, and values orjson refuses such as integers over 64 bits
+    fall back to the stdlib renderer. So does data with NaN or infinity,
+    which orjson writes as null, so that it raises (or, with STRICT_JSON
+    off, renders NaN) exactly as DRF does.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.ensure_ascii or not self.compact \
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=_encoder.default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Non-finite numbers can only hide behind a null, so most responses skip the walk
+        if b'null' in ret and has_non_finite(data):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped as DRF does, so the output is a strict javascript subset
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+class FastJSONParser(JSONParser):
+    """JSONParser decoding UTF-8 request bodies with orjson"""
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
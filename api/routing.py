@@ -4,4 +4,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/location/(?P<user_id>\d+)/$', consumers.LocationConsumer.as_asgi()),
+    re_path(r'ws/notifications/(?P<user_id>\d+)/$', consumers.NotificationConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -1,8 +1,41 @@
 # serializers.py
-from rest_framework import serializers
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 from .models import User, DriverProfile, Booking, Trip, Payment, Review, Subscription, Notification
+from .metrics import measure_serialization
 
-class UserSerializer(serializers.ModelSerializer):
+class ListSerializer(serializers.ListSerializer):
+    """ListSerializer whose output time counts towards the request's serializer time metric"""
+
+    @property
+    def data(self):
+        with measure_serialization():
+            return super().data
+
+class ModelSerializer(serializers.ModelSerializer):
+    """
+    ModelSerializer whose output time counts towards the request's
+    serializer time metric
+
+    The timer wraps .data, which a view reads once per response, so a list
+    is timed once rather than once per object; many=True gets the timed
+    ListSerializer unless Meta names another.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        meta = getattr(cls, 'Meta', None)
+        if meta is not None and not hasattr(meta, 'list_serializer_class'):
+            meta.list_serializer_class = ListSerializer
+
+    @property
+    def data(self):
+        with measure_serialization():
+            return super().data
+
+class UserSerializer(ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'phone_number', 
@@ -18,43 +51,155 @@ class UserSerializer(serializers.ModelSerializer):
             user.save()
         return user
 
-class DriverProfileSerializer(serializers.ModelSerializer):
+class DriverProfileSerializer(ModelSerializer):
     class Meta:
         model = DriverProfile
         fields = '__all__'
-        read_only_fields = ['background_check_status']
+        read_only_fields = ['background_check_status', 'rating_count', 'rating_sum', 'rating_recent']
 
-class BookingSerializer(serializers.ModelSerializer):
+class BookingSerializer(ModelSerializer):
     class Meta:
         model = Booking
         fields = '__all__'
-        read_only_fields = ['booking_time', 'status']
+        read_only_fields = ['booking_time', 'status', 'dispatched']
 
-class TripSerializer(serializers.ModelSerializer):
+class TripSerializer(ModelSerializer):
     class Meta:
         model = Trip
         fields = '__all__'
         read_only_fields = ['distance', 'total_fare']
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(ModelSerializer):
     class Meta:
         model = Payment
         fields = '__all__'
         read_only_fields = ['timestamp', 'status', 'transaction_id']
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(ModelSerializer):
     class Meta:
         model = Review
         fields = '__all__'
         read_only_fields = ['timestamp']
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(ModelSerializer):
     class Meta:
         model = Subscription
         fields = '__all__'
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(ModelSerializer):
     class Meta:
         model = Notification
         fields = '__all__'
-        read_only_fields = ['timestamp']
\ No newline at end of file
+        read_only_fields = ['timestamp']
+class RowSerializer:
+    """
+    Read-only fast path producing exactly what a ModelSerializer outputs
+
+    The serializer's fields are introspected once, on first use, into a
+    list of (name, column, attname, converter). rows() converts
+    .values(*columns) dicts and instance() reads model attributes, so list
+    endpoints skip building a serializer, and often the model instances,
+    per object. Fields whose output is a plain cast (int, float, str,
+    foreign key ids) are converted by the cast, ISO 8601 datetimes with
+    the current time zone looked up once per call, and every other field
+    by its own bound to_representation(). Fields with dotted sources,
+    method fields and file fields (whose URLs depend on the request) are
+    not supported.
+    """
+
+    CASTS = {
+        serializers.IntegerField: int,
+        serializers.FloatField: float,
+        serializers.CharField: str,
+        serializers.ReadOnlyField: None,
+    }
+    DATETIME = object()
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self._fields = None
+
+    @property
+    def fields(self):
+        if self._fields is None:
+            self._fields = self._compile()
+        return self._fields
+
+    def _compile(self):
+        model = self.serializer_class.Meta.model
+        fields = []
+        for name, field in self.serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if '.' in field.source or field.source == '*' or isinstance(field, serializers.FileField):
+                raise ValueError(f"{self.serializer_class.__name__}.{name} cannot be read from a row")
+            attname = model._meta.get_field(field.source).attname
+            if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+                converter = None
+            elif type(field) in self.CASTS:
+                converter = self.CASTS[type(field)]
+            elif (type(field) is serializers.DateTimeField and settings.USE_TZ and not hasattr(field, 'timezone')
+                  and getattr(field, 'format', api_settings.DATETIME_FORMAT).lower() == ISO_8601):
+                converter = self.DATETIME
+            else:
+                converter = field.to_representation
+            fields.append((name, field.source, attname, converter))
+        return fields
+
+    def _bind(self, key):
+        """(name, key, converter) with datetimes converted to the current time zone"""
+        tz = timezone.get_current_timezone()
+
+        def iso_datetime(value):
+            # As DateTimeField.to_representation() for aware datetimes
+            value = value.astimezone(tz).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+        return [
+            (field[0], field[key], iso_datetime if field[3] is self.DATETIME else field[3])
+            for field in self.fields
+        ]
+
+    @property
+    def columns(self):
+        """Arguments for .values() giving the rows rows() takes"""
+        return [column for _, column, _, _ in self.fields]
+
+    def rows(self, rows):
+        with measure_serialization():
+            fields = self._bind(1)
+            output = []
+            for row in rows:
+                data = {}
+                for name, column, converter in fields:
+                    value = row[column]
+                    data[name] = value if value is None or converter is None else converter(value)
+                output.append(data)
+            return output
+
+    def instance(self, instance):
+        with measure_serialization():
+            data = {}
+            for name, attname, converter in self._bind(2):
+                value = getattr(instance, attname)
+                data[name] = value if value is None or converter is None else converter(value)
+            return data
+
+class FareRouteSerializer(serializers.Serializer):
+    pickup_latitude = serializers.FloatField(min_value=-90, max_value=90)
+    pickup_longitude = serializers.FloatField(min_value=-180, max_value=180)
+    destination_latitude = serializers.FloatField(min_value=-90, max_value=90)
+    destination_longitude = serializers.FloatField(min_value=-180, max_value=180)
+
+class FareEstimateSerializer(serializers.Serializer):
+    """Routes to price together; time defaults to now"""
+    routes = serializers.ListField(
+        child=FareRouteSerializer(), min_length=1,
+        max_length=getattr(settings, 'FARES', {}).get('MAX_ESTIMATES', 50)
+    )
+    time = serializers.DateTimeField(required=False)
+
+# Read paths of the large list endpoints
+driver_profile_rows = RowSerializer(DriverProfileSerializer)
+booking_rows = RowSerializer(BookingSerializer)
+notification_rows = RowSerializer(NotificationSerializer)
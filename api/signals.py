@@ -1,82 +1,147 @@
 # signals.py
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
-from django.core.mail import send_mail
 from django.conf import settings
-from .models import User, DriverProfile, Booking, Trip, Payment, Review, Notification
+from .models import User, DriverProfile, Booking, Trip, Payment, Review, Subscription, Notification
+from .serializers import NotificationSerializer
+from .tasks import send_user_email, broadcast_notification, task_queue
+from .notifications import notify, adjust_unread_count
+from .lookups import lookup_cache, invalidate_user
+from .ratings import record_rating, rebuild_ratings
 
-    # Create driver profile when a user is marked as a driver
-@receiver(post_save, sender=User)
-def create_driver_profile(sender, instance, created, **kwargs):
-    if created and instance.is_driver:
-        DriverProfile.objects.create(user=instance)
+# There is deliberately no post_save receiver creating a DriverProfile for
+# new drivers. The original one was never connected, and once ApiConfig.ready
+# connected this module it gave every driver a stub profile (no vehicle)
+# that blocked their own POST /driver-profiles/. Drivers create it there.
+
+@receiver(post_init, sender=Booking)
+@receiver(post_init, sender=Payment)
+def remember_status(sender, instance, **kwargs):
+    # Snapshot of the loaded status so post_save can tell whether it changed.
+    # Read from __dict__ so a deferred status field is not fetched here.
+    instance._loaded_status = instance.__dict__.get('status')
+
+def take_status_change(instance):
+    """
+    True if the status changed since it was loaded or last saved
+
+    Moves the snapshot forward, so the next save compares against this
+    one. Each model's post_save receiver calls it once, on every save, so
+    the result does not depend on the order receivers run in.
+    """
+    status = instance.__dict__.get('status')
+    changed = status is not None and status != instance._loaded_status
+    instance._loaded_status = status
+    return changed
 
 @receiver(post_save, sender=Booking)
 def booking_notification(sender, instance, created, **kwargs):
     # Send notifications on booking status changes
+    changed = take_status_change(instance)
     if created:
+        # Bookings without a driver are announced by the dispatcher on assignment
+        if instance.driver_id is None:
+            return
+        
         # New booking notification to driver
-        Notification.objects.create(
-            user=instance.driver,
-            title="New Booking Request",
-            message=f"You have a new booking request from {instance.user.get_full_name()}",
-            related_booking=instance
-        )
+        message = f"You have a new booking request from {instance.user.get_full_name()}"
+        notify(instance.driver_id, "New Booking Request", message, instance.id)
         
         # Also send email notification
         if settings.EMAIL_HOST:
-            send_mail(
-                'New Booking Request',
-                f'You have a new booking request from {instance.user.get_full_name()}',
-                settings.DEFAULT_FROM_EMAIL,
-                [instance.driver.email],
-                fail_silently=True,
-            )
+            task_queue.enqueue(send_user_email, instance.driver_id, 'New Booking Request', message)
     
-    # Status change notification
-    elif instance.tracker.has_changed('status'):
-        old_status = instance.tracker.previous('status')
+    # Status change notification; the accept/start/complete actions send
+    # their own, more specific one
+    elif changed and instance.status not in ('accepted', 'in_progress', 'completed'):
         new_status = instance.status
         
         # Notify user about status change
-        if new_status != old_status:
-            Notification.objects.create(
-                user=instance.user,
-                title=f"Booking {new_status.title()}",
-                message=f"Your booking has been {new_status}",
-                related_booking=instance
-            )
+        notify(instance.user_id, f"Booking {new_status.title()}", f"Your booking has been {new_status}", instance.id)
 
 @receiver(post_save, sender=Payment)
 def payment_completed(sender, instance, **kwargs):
     # Actions to take when payment is completed
-    if instance.status == 'completed' and instance.tracker.has_changed('status'):
+    if take_status_change(instance) and instance.status == 'completed':
+        # Callers should load trip__booking with the payment; the ids are
+        # enough here, so neither user row is fetched
+        booking = instance.trip.booking
+        
         # Notify driver about payment
-        Notification.objects.create(
-            user=instance.trip.booking.driver,
-            title="Payment Received",
-            message=f"You've received payment of ${instance.amount} for trip #{instance.trip.id}",
-            related_booking=instance.trip.booking
+        notify(
+            booking.driver_id,
+            "Payment Received",
+            f"You've received payment of ${instance.amount} for trip #{instance.trip_id}",
+            booking.id
         )
         
         # Send receipt to user
         if settings.EMAIL_HOST:
-            send_mail(
+            task_queue.enqueue(
+                send_user_email,
+                booking.user_id,
                 'Payment Receipt',
-                f'Thank you for your payment of ${instance.amount} for your trip on {instance.trip.end_time.strftime("%Y-%m-%d %H:%M")}',
-                settings.DEFAULT_FROM_EMAIL,
-                [instance.trip.booking.user.email],
-                fail_silently=True,
+                f'Thank you for your payment of ${instance.amount} for your trip on {instance.trip.end_time.strftime("%Y-%m-%d %H:%M")}'
             )
 
 @receiver(post_save, sender=Review)
 def review_notification(sender, instance, created, **kwargs):
     # Notify driver when they receive a review
     if created:
-        Notification.objects.create(
-            user=instance.driver,
-            title="New Review",
-            message=f"You've received a {instance.rating}-star review",
-            related_booking=instance.trip.booking
-        )
\ No newline at end of file
+        notify(
+            instance.driver_id,
+            "New Review",
+            f"You've received a {instance.rating}-star review",
+            instance.trip.booking_id
+        )
+
+@receiver(post_init, sender=Review)
+def remember_rating(sender, instance, **kwargs):
+    instance._loaded_rating = (instance.__dict__.get('driver_id'), instance.__dict__.get('rating'))
+
+@receiver(post_save, sender=Review)
+def update_driver_rating(sender, instance, created, **kwargs):
+    # New reviews are folded in incrementally; edits are rare, so the
+    # drivers involved are recounted
+    if created:
+        record_rating(instance.driver_id, instance.rating)
+    elif (instance.driver_id, instance.rating) != instance._loaded_rating:
+        rebuild_ratings({instance.driver_id, instance._loaded_rating[0]} - {None})
+    instance._loaded_rating = (instance.driver_id, instance.rating)
+
+@receiver(post_delete, sender=Review)
+def remove_driver_rating(sender, instance, **kwargs):
+    rebuild_ratings([instance.driver_id])
+
+@receiver(post_save, sender=Notification)
+def push_notification(sender, instance, created, **kwargs):
+    # Notifications saved one at a time; the notification buffer handles its
+    # own bulk inserts. Deliver to connected sockets once committed.
+    if created:
+        task_queue.enqueue(broadcast_notification, instance.user_id, dict(NotificationSerializer(instance).data))
+        if not instance.is_read:
+            transaction.on_commit(lambda: adjust_unread_count(instance.user_id, 1))
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, created=False, **kwargs):
+    # A new user may reuse the id of one whose lookups are still cached
+    if created or kwargs['signal'] is post_delete:
+        invalidate_user(instance.id)
+    else:
+        lookup_cache.invalidate('user', instance.id)
+        lookup_cache.invalidate('password_digest', instance.id)
+
+@receiver(post_save, sender=DriverProfile)
+@receiver(post_delete, sender=DriverProfile)
+def invalidate_cached_driver_profile(sender, instance, created=False, **kwargs):
+    # Only the profile's id is cached, and that changes on create and delete alone
+    if created or kwargs['signal'] is post_delete:
+        lookup_cache.invalidate('driver_profile', instance.user_id)
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_cached_subscriptions(sender, instance, **kwargs):
+    lookup_cache.invalidate('subscriptions', instance.user_id)
@@ -0,0 +1,175 @@
+# tasks.py
+import logging
+import queue
+import threading
+import time
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+class JobQueue:
+    """
+    In-process background job queue served by a pool of worker threads
+
+    Jobs are plain callables taking ids and strings rather than model
+    instances, so they can be handed to an external broker unchanged.
+    enqueue() defers the job until the surrounding transaction commits,
+    so workers never act on rows that were rolled back. A failing job is
+    retried up to max_retries times, waiting retry_delay * 2**attempt
+    seconds between attempts.
+
+    With eager=True jobs run inline in the committing thread; tests use
+    this as the stand-in broker.
+    """
+
+    def __init__(self, workers=4, max_retries=3, retry_delay=1.0, eager=False):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.eager = eager
+        self.enqueued = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._outstanding = 0  # submitted jobs not yet finished or given up
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def enqueue(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in the background once the current transaction commits"""
+        transaction.on_commit(lambda: self.submit(func, *args, **kwargs))
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) right away, regardless of any open transaction"""
+        with self._lock:
+            self.enqueued += 1
+            self._outstanding += 1
+        job = (func, args, kwargs, 0, time.monotonic())
+        if self.eager:
+            self._run(job)
+        else:
+            self._start_workers()
+            self._queue.put(job)
+
+    def _start_workers(self):
+        if len(self._threads) >= self.workers:
+            return
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f'job-worker-{len(self._threads)}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            finally:
+                # Workers hold their own DB connection; drop it if broken or expired
+                close_old_connections()
+
+    def _run(self, job):
+        func, args, kwargs, attempt, enqueued_at = job
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            if attempt < self.max_retries:
+                with self._lock:
+                    self.retried += 1
+                retry = (func, args, kwargs, attempt + 1, enqueued_at)
+                if self.eager:
+                    return self._run(retry)
+                timer = threading.Timer(self.retry_delay * 2 ** attempt, self._queue.put, (retry,))
+                timer.daemon = True
+                timer.start()
+                return
+            logger.exception("Job %s failed after %d attempts", getattr(func, '__name__', func), attempt + 1)
+            self._finish(enqueued_at, succeeded=False)
+        else:
+            self._finish(enqueued_at, succeeded=True)
+
+    def _finish(self, enqueued_at, succeeded):
+        latency = time.monotonic() - enqueued_at
+        with self._lock:
+            if succeeded:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+            self._latency_total += latency
+            self._latency_max = max(self._latency_max, latency)
+            self._outstanding -= 1
+            if not self._outstanding:
+                self._idle.notify_all()
+
+    def join(self, timeout=None):
+        """
+        Block until every submitted job has finished, retries included
+
+        Returns:
+            True if the queue went idle, False on timeout
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._outstanding, timeout)
+
+    def stats(self):
+        """
+        Queue depth and job latency (submission to completion, retries included)
+        """
+        with self._lock:
+            finished = self.succeeded + self.failed
+            return {
+                'depth': self._queue.qsize(),
+                'outstanding': self._outstanding,
+                'workers': len(self._threads),
+                'enqueued': self.enqueued,
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+                'retried': self.retried,
+                'latency_avg_ms': round(self._latency_total / finished * 1000, 3) if finished else 0.0,
+                'latency_max_ms': round(self._latency_max * 1000, 3),
+            }
+
+
+_task_config = getattr(settings, 'TASK_QUEUE', {})
+task_queue = JobQueue(
+    workers=_task_config.get('WORKERS', 4),
+    max_retries=_task_config.get('MAX_RETRIES', 3),
+    retry_delay=_task_config.get('RETRY_DELAY', 1.0),
+    eager=_task_config.get('EAGER', False),
+)
+
+# Jobs
+
+def broadcast_notification(user_id, notification):
+    """Push a serialized notification to the user's open sockets"""
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        async_to_sync(channel_layer.group_send)(f'notifications_{user_id}', {
+            'type': 'notification_created',
+            'notification': notification
+        })
+
+def send_push(user_id, title, message, data=None):
+    from .utils import send_push_notification
+
+    if not send_push_notification(user_id, title, message, data):
+        raise RuntimeError(f"Push notification to user {user_id} failed")
+
+def send_user_email(user_id, subject, message):
+    """Email a user; the address is looked up here, off the request path"""
+    from .models import User
+
+    email = User.objects.values_list('email', flat=True).get(id=user_id)
+    if email:
+        # Not fail_silently: SMTP errors raise so the job is retried
+        send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [email])
@@ -0,0 +1,252 @@
+# traces.py
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from shapely.geometry import LineString
+from .utils import haversine_distance, haversine_distances
+
+# Coordinates are stored as int32 in units of 1e-7 degrees (about 1 cm)
+SCALE = 10 ** 7
+
+_trace_config = getattr(settings, 'TRIP_TRACES', {})
+
+def encode_points(lats, lngs, times_ms, previous=None):
+    """
+    Delta-encode a run of GPS fixes as packed little-endian int32 triples
+
+    Each fix is stored as (dlat, dlng, dt_ms) against the one before it,
+    so a trace can be extended by appending bytes. previous is the last
+    stored (lat_e7, lng_e7, time_ms); the first fix of a trace is stored
+    against (0, 0, its own time).
+
+    Returns:
+        (bytes, last (lat_e7, lng_e7, time_ms))
+    """
+    lats = np.rint(np.asarray(lats, dtype=np.float64) * SCALE).astype(np.int64)
+    lngs = np.rint(np.asarray(lngs, dtype=np.float64) * SCALE).astype(np.int64)
+    times = np.asarray(times_ms, dtype=np.int64)
+    if previous is None:
+        previous = (0, 0, int(times[0]))
+    absolute = np.column_stack([lats, lngs, times])
+    deltas = np.diff(absolute, axis=0, prepend=np.array([previous], dtype=np.int64))
+    return deltas.astype('<i4').tobytes(), tuple(int(value) for value in absolute[-1])
+
+def decode_points(data, started_at_ms):
+    """
+    Inverse of encode_points for a whole trace
+
+    Returns:
+        (lats, lngs, times_ms) numpy arrays
+    """
+    deltas = np.frombuffer(bytes(data), dtype='<i4').astype(np.int64).reshape(-1, 3)
+    absolute = np.cumsum(deltas, axis=0)
+    return absolute[:, 0] / SCALE, absolute[:, 1] / SCALE, absolute[:, 2] + started_at_ms
+
+def encode_polyline(lats, lngs, precision=5):
+    """Google encoded polyline of a path, as accepted by map SDKs"""
+    factor = 10 ** precision
+    points = np.column_stack([
+        np.rint(np.asarray(lats, dtype=np.float64) * factor),
+        np.rint(np.asarray(lngs, dtype=np.float64) * factor),
+    ]).astype(np.int64)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    # Zig-zag so small negative deltas stay short
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1).tolist()
+
+    chunks = []
+    for value in values:
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+def path_length_km(lats, lngs):
+    """Sum of great-circle distances between consecutive points"""
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    if len(lats) < 2:
+        return 0.0
+    return float(haversine_distances(lngs[:-1], lats[:-1], lngs[1:], lats[1:]).sum())
+
+def filter_fixes(fixes, previous=None, min_step_m=10.0, max_speed_kmh=200.0, max_rejects=3):
+    """
+    Drop GPS jitter and outliers from a stream of (lat, lng, time_ms) fixes
+
+    A fix is kept once it is at least min_step_m from the last kept one,
+    so standing still adds nothing while slow movement still accumulates.
+    A fix that would need more than max_speed_kmh to reach from the last
+    plausible fix is an outlier, unless max_rejects fixes in a row are, in
+    which case that fix was the outlier and the stream follows the new
+    position.
+
+    Args:
+        previous: Last kept (lat, lng, time_ms) from an earlier batch
+
+    Returns:
+        The kept fixes, in order
+    """
+    kept, rejects, plausible = [], 0, previous
+    for fix in fixes:
+        lat, lng, time_ms = fix
+        if previous is not None:
+            if time_ms <= plausible[2]:
+                continue
+            jump_km = haversine_distance(plausible[1], plausible[0], lng, lat)
+            if jump_km / ((time_ms - plausible[2]) / 3.6e6) > max_speed_kmh and rejects < max_rejects:
+                rejects += 1
+                continue
+            rejects, plausible = 0, fix
+            if haversine_distance(previous[1], previous[0], lng, lat) * 1000 < min_step_m:
+                continue
+        kept.append(fix)
+        previous = plausible = fix
+    return kept
+
+def simplify_path(lats, lngs, tolerance_m=10.0):
+    """
+    Douglas-Peucker simplification of a path (via shapely)
+
+    Points are projected onto a local plane in metres first, so no point
+    of the original path is further than tolerance_m from the simplified
+    one.
+
+    Returns:
+        Sorted numpy array of the indices of the points kept
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    if len(lats) < 3:
+        return np.arange(len(lats))
+    metres_per_degree = 6371000 * np.pi / 180
+    x = (lngs - lngs[0]) * metres_per_degree * np.cos(np.radians(lats.mean()))
+    y = (lats - lats[0]) * metres_per_degree
+    simplified = LineString(np.column_stack([x, y])).simplify(tolerance_m, preserve_topology=False)
+
+    # Simplification keeps original vertices; walk both lists to recover their indices
+    kept, position = [], 0
+    for vertex in simplified.coords:
+        while (x[position], y[position]) != vertex:
+            position += 1
+        kept.append(position)
+        position += 1
+    return np.array(kept)
+
+def append_fixes(trace, fixes, min_step_m=None, max_speed_kmh=None):
+    """
+    Extend a TripTrace in place with (lat, lng, time_ms) fixes, oldest first
+
+    Fixes pass through filter_fixes() against the trace's last point, so
+    a requeued or repeated batch does not fold the path back on itself.
+    The travelled distance is extended with each batch.
+    """
+    previous = None
+    if trace.point_count:
+        previous = (trace.last_lat_e7 / SCALE, trace.last_lng_e7 / SCALE, trace.last_time_ms)
+    fixes = filter_fixes(
+        fixes, previous,
+        min_step_m=_trace_config.get('MIN_STEP_METERS', 10.0) if min_step_m is None else min_step_m,
+        max_speed_kmh=_trace_config.get('MAX_SPEED_KMH', 200.0) if max_speed_kmh is None else max_speed_kmh,
+    )
+    if not fixes:
+        return
+
+    lats, lngs, times = zip(*fixes)
+    if previous is None:
+        data, last = encode_points(lats, lngs, times)
+        trace.started_at_ms = times[0]
+        trace.distance_km = path_length_km(lats, lngs)
+    else:
+        data, last = encode_points(lats, lngs, times, (trace.last_lat_e7, trace.last_lng_e7, trace.last_time_ms))
+        trace.distance_km += path_length_km((previous[0], *lats), (previous[1], *lngs))
+    trace.points = bytes(trace.points or b'') + data
+    trace.last_lat_e7, trace.last_lng_e7, trace.last_time_ms = last
+    trace.point_count += len(fixes)
+
+def compact_trace(trace, tolerance_m=None):
+    """
+    Replace a finished trace's points with its simplified geometry
+
+    Simplifying also straightens the zig-zag GPS noise adds to a path, so
+    the simplified length becomes the trace's distance: on synthetic 1 Hz
+    drives it is within about 2% of the true distance, against 5-10% for
+    the filtered stream (see `manage.py bench_trace_simplify`).
+
+    Returns:
+        Number of points removed
+    """
+    if tolerance_m is None:
+        tolerance_m = _trace_config.get('SIMPLIFY_TOLERANCE_METERS', 10.0)
+    lats, lngs, times = decode_points(trace.points, trace.started_at_ms)
+    kept = simplify_path(lats, lngs, tolerance_m)
+    removed = trace.point_count - len(kept)
+    if len(kept):
+        trace.points, _ = encode_points(lats[kept], lngs[kept], times[kept])
+        trace.distance_km = path_length_km(lats[kept], lngs[kept])
+    trace.point_count = len(kept)
+    trace.simplified = True
+    return removed
+
+def finish_trace(trip_id):
+    """
+    Compact a trip's trace as the trip completes
+
+    Returns:
+        Travelled distance in km, or None when fewer than two points were recorded
+    """
+    from .models import TripTrace
+
+    trace = TripTrace.objects.select_for_update().filter(trip_id=trip_id, simplified=False).first()
+    if trace is None:
+        return None
+    compact_trace(trace)
+    trace.save(update_fields=['points', 'point_count', 'distance_km', 'simplified'])
+    return trace.distance_km if trace.point_count >= 2 else None
+
+def trace_route(trace, tolerance_m=None):
+    """Simplified (lat, lng) path of a trace, e.g. for generate_trip_map"""
+    lats, lngs, _ = decode_points(trace.points, trace.started_at_ms)
+    if not trace.simplified:
+        kept = simplify_path(lats, lngs, _trace_config.get('SIMPLIFY_TOLERANCE_METERS', 10.0)
+                             if tolerance_m is None else tolerance_m)
+        lats, lngs = lats[kept], lngs[kept]
+    return list(zip(lats.tolist(), lngs.tolist()))
+
+def record_trip_traces(fixes_by_driver):
+    """
+    Append buffered fixes to the traces of drivers that are on a trip
+
+    Args:
+        fixes_by_driver: Dict of DriverProfile id -> [(lat, lng, time_ms), ...]
+
+    Returns:
+        Number of traces written
+    """
+    from .models import Booking, TripTrace
+
+    if not fixes_by_driver:
+        return 0
+    trips = dict(
+        Booking.objects.filter(
+            status='in_progress', driver__driver_profile__in=list(fixes_by_driver), trip__isnull=False
+        ).values_list('driver__driver_profile', 'trip')
+    )
+    if not trips:
+        return 0
+
+    with transaction.atomic():
+        locked = TripTrace.objects.select_for_update()
+        traces = {trace.trip_id: trace for trace in locked.filter(trip_id__in=list(trips.values()))}
+        missing = [trip_id for trip_id in trips.values() if trip_id not in traces]
+        if missing:
+            # Rows that do not exist cannot be locked, so another flush may
+            # create the same trace meanwhile: insert empty traces, skipping
+            # any that exist by now, then lock them like the others
+            TripTrace.objects.bulk_create([TripTrace(trip_id=trip_id) for trip_id in missing], ignore_conflicts=True)
+            traces.update((trace.trip_id, trace) for trace in locked.filter(trip_id__in=missing))
+        for driver_id, trip_id in trips.items():
+            append_fixes(traces[trip_id], fixes_by_driver[driver_id])
+        TripTrace.objects.bulk_update(traces.values(), [
+            'points', 'point_count', 'distance_km', 'started_at_ms', 'last_lat_e7', 'last_lng_e7', 'last_time_ms'
+        ])
+    return len(trips)
@@ -25,10 +25,12 @@ urlpatterns = [
     path('bookings/<int:pk>/accept/', views.BookingViewSet.as_view({'post': 'accept'}), name='booking-accept'),
     path('bookings/<int:pk>/start-trip/', views.BookingViewSet.as_view({'post': 'start_trip'}), name='booking-start-trip'),
     path('bookings/<int:pk>/complete-trip/', views.BookingViewSet.as_view({'post': 'complete_trip'}), name='booking-complete-trip'),
+    path('bookings/<int:pk>/cancel/', views.BookingViewSet.as_view({'post': 'cancel'}), name='booking-cancel'),
 
     # Trip Views
     path('trips/', views.TripViewSet.as_view({'get': 'list'}), name='trip-list'),
     path('trips/<int:pk>/', views.TripViewSet.as_view({'get': 'retrieve'}), name='trip-detail'),
+    path('trips/<int:pk>/trace/', views.TripViewSet.as_view({'get': 'trace'}), name='trip-trace'),
 
     # Payment Views
     path('payments/', views.PaymentViewSet.as_view({'get': 'list'}), name='payment-list'),
@@ -48,6 +50,7 @@ urlpatterns = [
     path('notifications/<int:pk>/', views.NotificationViewSet.as_view({'get': 'retrieve'}), name='notification-detail'),
     path('notifications/<int:pk>/mark-as-read/', views.NotificationViewSet.as_view({'post': 'mark_as_read'}), name='notification-mark-as-read'),
     path('notifications/mark-all-as-read/', views.NotificationViewSet.as_view({'post': 'mark_all_as_read'}), name='notification-mark-all-as-read'),
+    path('notifications/unread-count/', views.NotificationViewSet.as_view({'get': 'unread_count'}), name='notification-unread-count'),
 
     # Authentication
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
@@ -55,4 +58,16 @@ urlpatterns = [
 
     # Heatmap
     path('heatmap/', views.DriverHeatmapView.as_view(), name='driver_heatmap'),
+    path('heatmap/points/', views.DriverHeatmapPointsView.as_view(), name='driver_heatmap_points'),
+
+    # Fares
+    path('fares/estimate/', views.FareEstimateView.as_view(), name='fare_estimate'),
+
+    # Background jobs
+    path('tasks/stats/', views.TaskQueueStatsView.as_view(), name='task_queue_stats'),
+    path('cache/stats/', views.LookupCacheStatsView.as_view(), name='lookup_cache_stats'),
+
+    # Metrics
+    path('metrics', views.MetricsView.as_view(), name='metrics'),
+    path('metrics/slow/', views.SlowRequestsView.as_view(), name='slow_requests'),
 ]
\ No newline at end of file
@@ -5,7 +5,8 @@ import uuid
 import logging
 from django.conf import settings
 from django.utils import timezone
-from math import radians, cos, sin, asin, sqrt
+from math import radians, degrees, cos, sin, asin, sqrt
+import numpy as np
 import folium
 from folium import plugins
 
@@ -33,43 +34,141 @@ def haversine_distance(lon1, lat1, lon2, lat2):
     r = 6371  # Radius of earth in kilometers
     return c * r
 
+def haversine_distances(lon, lat, lons, lats):
+    """
+    Vectorized haversine_distance from one point to many
+
+    Args:
+        lon, lat: Origin coordinates
+        lons, lats: Array-likes of destination coordinates
+
+    Returns:
+        numpy array of distances in kilometers, one per destination
+    """
+    lon, lat = np.radians(lon), np.radians(lat)
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    # Clip rounding noise so antipodal points cannot push arcsin out of range
+    return 2 * 6371 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def nearest_indices(distances, max_distance=None, limit=None):
+    """
+    Indices of the closest entries in a distance array, nearest first
+
+    Args:
+        distances: numpy array as returned by haversine_distances
+        max_distance: Drop entries farther than this (km)
+        limit: Keep at most this many entries; selected with argpartition so
+            only the survivors are fully sorted
+
+    Returns:
+        numpy array of indices into distances
+    """
+    if max_distance is None:
+        indices = np.arange(len(distances))
+    else:
+        indices = np.flatnonzero(distances <= max_distance)
+
+    if limit is not None:
+        if limit <= 0:
+            return indices[:0]
+        if limit < len(indices):
+            indices = indices[np.argpartition(distances[indices], limit - 1)[:limit]]
+
+    return indices[np.argsort(distances[indices], kind='stable')]
+
+def bounding_box(lat, lng, radius_km):
+    """
+    Smallest lat/lng box containing every point within radius_km of (lat, lng)
+
+    Returns:
+        (min_lat, max_lat, min_lng, max_lng) in decimal degrees. Longitudes are
+        not wrapped, so min_lng may be below -180 or max_lng above 180 when the
+        circle crosses the antimeridian. A circle that contains a pole spans
+        the full longitude range.
+    """
+    angular = radius_km / 6371  # same earth radius as haversine_distance
+    dlat = degrees(angular)
+    min_lat, max_lat = lat - dlat, lat + dlat
+
+    if min_lat <= -90 or max_lat >= 90 or sin(angular) >= cos(radians(lat)):
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+
+    dlng = degrees(asin(sin(angular) / cos(radians(lat))))
+    return min_lat, max_lat, lng - dlng, lng + dlng
+
+def find_drivers_within(user_lat, user_lng, radius_km, limit=None):
+    """
+    Find available drivers within radius_km, nearest first
+
+    With a live location store configured (DRIVER_LOCATION_STORE), the
+    search runs against the store and the matching DriverProfile rows are
+    returned with their live position in place of the (write-behind) stored
+    one. Otherwise the database is searched through the indexed
+    bounding-box prefilter and the exact haversine check only runs on rows
+    inside the box.
+
+    Args:
+        user_lat, user_lng: Search origin
+        radius_km: Search radius in km
+        limit: Optional maximum number of drivers to return
+
+    Returns:
+        List of (DriverProfile, distance_km) tuples sorted by distance
+    """
+    from .location_store import get_location_store
+    from .models import DriverProfile
+
+    store = get_location_store()
+    if store is not None:
+        matches = store.search(user_lat, user_lng, radius_km)
+        if not matches:
+            return []
+
+        # The store may still hold drivers who have since gone offline
+        drivers = DriverProfile.objects.filter(is_available=True).in_bulk(
+            [driver_id for driver_id, _, _ in matches]
+        )
+        results = []
+        for driver_id, distance, (lat, lng, timestamp) in matches:
+            driver = drivers.get(driver_id)
+            if driver is None:
+                continue
+            driver.current_latitude, driver.current_longitude = lat, lng
+            if timestamp is not None:
+                driver.last_location_update = timestamp
+            results.append((driver, distance))
+        return results[:limit]
+
+    drivers = list(
+        DriverProfile.objects.available().within_bounding_box(user_lat, user_lng, radius_km)
+    )
+    if not drivers:
+        return []
+
+    distances = haversine_distances(
+        user_lng, user_lat,
+        [driver.current_longitude for driver in drivers],
+        [driver.current_latitude for driver in drivers]
+    )
+    return [
+        (drivers[i], float(distances[i]))
+        for i in nearest_indices(distances, radius_km, limit)
+    ]
+
 def geocode_address(address):
-    """Convert address to latitude and longitude using Google Maps API"""
-    if not settings.GOOGLE_MAPS_API_KEY:
-        logger.warning("Google Maps API key not configured")
-        return None, None
-        
-    url = "https://maps.googleapis.com/maps/api/geocode/json"
-    params = {
-        "address": address,
-        "key": settings.GOOGLE_MAPS_API_KEY
-    }
-    
-    try:
-        response = requests.get(url, params=params)
-        data = response.json()
-        
-        if data["status"] == "OK":
-            location = data["results"][0]["geometry"]["location"]
-            return location["lat"], location["lng"]
-        else:
-            logger.error(f"Geocoding error: {data['status']}")
-            return None, None
-            
-    except Exception as e:
-        logger.exception(f"Geocoding exception: {str(e)}")
-        return None, None
+    """Convert address to latitude and longitude using Google Maps API (cached, see geocoding.Geocoder)"""
+    from .geocoding import geocoder
 
-def calculate_fare(distance_km, duration_minutes, base_fare=5.0):
-    """Calculate the fare for a trip"""
-    distance_rate = 1.5  # $1.5 per km
-    time_rate = 0.25  # $0.25 per minute
-    
-    distance_cost = distance_km * distance_rate
-    time_cost = duration_minutes * time_rate
-    
-    total_fare = base_fare + distance_cost + time_cost
-    return round(total_fare, 2)
+    return geocoder.geocode(address)
+
+def calculate_fare(distance_km, duration_minutes, when=None, plan=None):
+    """Calculate the fare for a trip (see fares.FareEngine)"""
+    from .fares import fare_engine
+
+    return fare_engine.trip_fare(distance_km, duration_minutes, when, plan)
 
 def send_push_notification(user_id, title, message, data=None):
     """Send push notification to user's device(s)"""
@@ -114,7 +213,7 @@ def send_push_notification(user_id, title, message, data=None):
         return False
     
 # 5. Create a map utility function using Folium (add to utils.py)
-def generate_trip_map(pickup_lat, pickup_lng, dest_lat, dest_lng, driver_lat=None, driver_lng=None):
+def generate_trip_map(pickup_lat, pickup_lng, dest_lat, dest_lng, driver_lat=None, driver_lng=None, route=None):
     """
     Generate an HTML map showing the trip route and current locations
     
@@ -122,6 +221,8 @@ def generate_trip_map(pickup_lat, pickup_lng, dest_lat, dest_lng, driver_lat=Non
         pickup_lat, pickup_lng: Pickup coordinates
         dest_lat, dest_lng: Destination coordinates
         driver_lat, driver_lng: Optional current driver location
+        route: Optional recorded path as (lat, lng) pairs; a straight
+            line is drawn without one
         
     Returns:
         HTML string with the rendered map
@@ -157,7 +258,7 @@ def generate_trip_map(pickup_lat, pickup_lng, dest_lat, dest_lng, driver_lat=Non
         
     # Add a line for the route
     folium.PolyLine(
-        [(pickup_lat, pickup_lng), (dest_lat, dest_lng)],
+        route if route is not None and len(route) > 1 else [(pickup_lat, pickup_lng), (dest_lat, dest_lng)],
         color='blue',
         weight=5,
         opacity=0.7
@@ -181,45 +282,25 @@ def find_nearest_drivers(user_lat, user_lng, max_distance=10, limit=5):
     Returns:
         List of driver profiles with distance
     """
-    from .models import DriverProfile
-    
-    available_drivers = DriverProfile.objects.filter(
-        is_available=True,
-        current_latitude__isnull=False,
-        current_longitude__isnull=False
-    )
-    
-    drivers_with_distance = []
-    
-    for driver in available_drivers:
-        distance = haversine_distance(
-            user_lng, user_lat,
-            driver.current_longitude, driver.current_latitude
-        )
-        
-        if distance <= max_distance:
-            drivers_with_distance.append({
-                'driver': driver,
-                'distance': distance
-            })
-    
-    # Sort by distance
-    drivers_with_distance.sort(key=lambda x: x['distance'])
-    
-    # Limit the results
-    return drivers_with_distance[:limit]
+    # find_drivers_within applies the limit with a partial sort
+    return [
+        {'driver': driver, 'distance': distance}
+        for driver, distance in find_drivers_within(user_lat, user_lng, max_distance, limit)
+    ]
 
 
 # 6. Add a new feature to generate heatmap of driver activity (optional)
 # Add this to utils.py
 
-def generate_driver_heatmap(city_center_lat, city_center_lng, zoom=12):
+def generate_driver_heatmap(city_center_lat, city_center_lng, zoom=12, heat_data=None):
     """
     Generate a heatmap of driver locations
     
     Args:
         city_center_lat, city_center_lng: Center coordinates for the map
         zoom: Initial zoom level
+        heat_data: Optional [lat, lng] or weighted [lat, lng, count] points;
+            queried from available drivers when omitted
         
     Returns:
         HTML string with rendered heatmap
@@ -231,17 +312,12 @@ def generate_driver_heatmap(city_center_lat, city_center_lng, zoom=12):
     # Create base map
     m = folium.Map([city_center_lat, city_center_lng], zoom_start=zoom)
     
-    # Get active driver locations
-    drivers = DriverProfile.objects.filter(
-        is_available=True,
-        current_latitude__isnull=False,
-        current_longitude__isnull=False
-    )
-    
-    # Create heatmap data
-    heat_data = []
-    for driver in drivers:
-        heat_data.append([driver.current_latitude, driver.current_longitude])
+    if heat_data is None:
+        # Get active driver locations
+        heat_data = [
+            [lat, lng] for lat, lng in
+            DriverProfile.objects.available().values_list('current_latitude', 'current_longitude')
+        ]
     
     # Add heatmap layer
     HeatMap(heat_data).add_to(m)
@@ -1,18 +1,74 @@
+import hashlib
+import hmac
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
 from django.shortcuts import render
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.utils import timezone
-from .models import User, DriverProfile, Booking, Trip, Payment, Review, Subscription, Notification
-from .serializers import (UserSerializer, DriverProfileSerializer, BookingSerializer,TripSerializer, PaymentSerializer, ReviewSerializer,SubscriptionSerializer, NotificationSerializer)
-from .utils import haversine_distance 
+from django.db import IntegrityError, transaction
+from .models import User, DriverProfile, Booking, Trip, Payment, Review, Subscription, Notification, IdempotencyKey
+from .booking_state import transition_booking, InvalidTransition
+from .serializers import (UserSerializer, DriverProfileSerializer, BookingSerializer,TripSerializer, PaymentSerializer, ReviewSerializer,SubscriptionSerializer, NotificationSerializer,
+                          FareEstimateSerializer, driver_profile_rows, booking_rows, notification_rows)
+from .utils import haversine_distance, find_drivers_within
+from .location_store import record_driver_location, sync_driver_profile, forget_driver
 from django.views.generic import TemplateView
 from django.contrib.auth.mixins import LoginRequiredMixin
-from .utils import generate_driver_heatmap
+from rest_framework.views import APIView
+from .heatmap import driver_heatmap
+from .pagination import BookingCursorPagination, TimestampCursorPagination
+from .tasks import task_queue
+from .notifications import notify, get_unread_count, adjust_unread_count
+from .fares import fare_engine
+from .dispatch import release_driver
+from .traces import decode_points, encode_polyline, finish_trace
+from .lookups import get_driver_profile_id, lookup_cache
+from .metrics import metrics_registry
 
 
 
 # Create your views here.
+class RowListMixin:
+    """
+    list() through the viewset's row_serializer (a RowSerializer of its
+    serializer_class): rows are fetched with .values() and converted by
+    precompiled field extractors instead of building model instances and
+    serializer fields per object. The JSON is identical.
+
+    The page is tagged with an ETag hashed from its raw rows, so a client
+    sending it back in If-None-Match gets a 304 before anything is
+    serialized when the collection has not changed.
+    """
+    row_serializer = None
+    
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset()).values(*self.row_serializer.columns)
+        page = self.paginate_queryset(queryset)
+        rows = list(queryset) if page is None else page
+        etag = self.rows_etag(request, rows)
+        # Weak comparison, since CompressionMiddleware weakens the tags it sends
+        tags = {tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))}
+        if etag in tags or '*' in tags:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+        
+        if page is None:
+            response = Response(self.row_serializer.rows(rows))
+        else:
+            response = self.get_paginated_response(self.row_serializer.rows(page))
+        response['ETag'] = etag
+        return response
+    
+    def rows_etag(self, request, rows):
+        """Strong ETag of a page: its rows and the media type they are rendered as"""
+        digest = hashlib.md5(repr(rows).encode(), usedforsecurity=False)
+        digest.update(str(request.accepted_media_type).encode())
+        return f'"{digest.hexdigest()}"'
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -20,7 +76,7 @@ class UserViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def me(self, request):
         serializer = self.get_serializer(request.user)
-        return Response(serializer.data, 'profile.html')
+        return Response(serializer.data, template_name='profile.html')
     
     @action(detail=False, methods=['post'])
     def register(self, request):
@@ -34,6 +90,17 @@ class DriverProfileViewSet(viewsets.ModelViewSet):
     queryset = DriverProfile.objects.all()
     serializer_class = DriverProfileSerializer
     
+    def perform_create(self, serializer):
+        sync_driver_profile(serializer.save(), moved=True)
+    
+    def perform_update(self, serializer):
+        moved = bool({'current_latitude', 'current_longitude'} & set(serializer.validated_data))
+        sync_driver_profile(serializer.save(), moved=moved)
+    
+    def perform_destroy(self, instance):
+        forget_driver(instance.id)
+        instance.delete()
+    
     @action(detail=False, methods=['get'])
     def nearby(self, request):
         """Find nearby available drivers"""
@@ -48,24 +115,12 @@ class DriverProfileViewSet(viewsets.ModelViewSet):
         user_latitude = float(latitude)
         user_longitude = float(longitude)
         
-        available_drivers = DriverProfile.objects.filter(
-            is_available=True,
-            current_latitude__isnull=False,
-            current_longitude__isnull=False
-        )
-        
-        # Find drivers within radius using haversine distance
+        # Find drivers within radius using the driver location index
         nearby_drivers = []
-        for driver in available_drivers:
-            distance = haversine_distance(
-                user_longitude, user_latitude,
-                driver.current_longitude, driver.current_latitude
-            )
-            
-            if distance <= float(radius):
-                driver_data = self.get_serializer(driver).data
-                driver_data['distance'] = round(distance, 2)
-                nearby_drivers.append(driver_data)
+        for driver, distance in find_drivers_within(user_latitude, user_longitude, float(radius)):
+            driver_data = driver_profile_rows.instance(driver)
+            driver_data['distance'] = round(distance, 2)
+            nearby_drivers.append(driver_data)
                 
         return Response(nearby_drivers)
     
@@ -74,9 +129,8 @@ class DriverProfileViewSet(viewsets.ModelViewSet):
         """Update driver's current location"""
         user = request.user
         
-        try:
-            driver_profile = DriverProfile.objects.get(user=user)
-        except DriverProfile.DoesNotExist:
+        driver_id = get_driver_profile_id(user.id)
+        if driver_id is None:
             return Response({"error": "Driver profile not found"}, 
                           status=status.HTTP_404_NOT_FOUND)
         
@@ -87,10 +141,8 @@ class DriverProfileViewSet(viewsets.ModelViewSet):
             return Response({"error": "Latitude and longitude are required"}, 
                           status=status.HTTP_400_BAD_REQUEST)
             
-        driver_profile.current_latitude = float(latitude)
-        driver_profile.current_longitude = float(longitude)
-        driver_profile.last_location_update = timezone.now()
-        driver_profile.save()
+        # Goes to the live location store; the row is written behind in batches
+        record_driver_location(driver_id, latitude, longitude)
         
         return Response({"success": True})
     
@@ -112,34 +164,16 @@ class DriverProfileViewSet(viewsets.ModelViewSet):
             user_lng = float(longitude)
             radius_km = float(radius)
             
-            # Get all drivers (we'll filter in Python)
-            drivers = DriverProfile.objects.filter(
-                is_available=True,
-                current_latitude__isnull=False,
-                current_longitude__isnull=False
-            )
-            
-            # Filter and sort by distance
-            drivers_with_distance = []
-            for driver in drivers:
-                distance = haversine_distance(
-                    user_lng, user_lat,
-                    driver.current_longitude, driver.current_latitude
-                )
-                
-                if distance <= radius_km:
-                    drivers_with_distance.append({
-                        'driver': driver,
-                        'distance': distance
-                    })
-            
-            # Sort by distance
-            drivers_with_distance.sort(key=lambda x: x['distance'])
+            # Candidates come from the driver location index, sorted by distance
+            drivers_with_distance = [
+                {'driver': driver, 'distance': distance}
+                for driver, distance in find_drivers_within(user_lat, user_lng, radius_km)
+            ]
             
             # Serialize and return
             result = []
             for item in drivers_with_distance:
-                driver_data = self.get_serializer(item['driver']).data
+                driver_data = driver_profile_rows.instance(item['driver'])
                 driver_data['distance'] = round(item['distance'], 2)
                 result.append(driver_data)
                 
@@ -159,75 +193,211 @@ class DriverHeatmapView(LoginRequiredMixin, TemplateView):
         city_lat = 37.7749  # Example: San Francisco
         city_lng = -122.4194
         
-        context['heatmap'] = generate_driver_heatmap(city_lat, city_lng)
+        # Rendered from pre-aggregated density and cached between changes
+        context['heatmap'] = driver_heatmap.render(city_lat, city_lng)
         return context
 
-class BookingViewSet(viewsets.ModelViewSet):
+class DriverHeatmapPointsView(APIView):
+    """Aggregated driver density as [lat, lng, count] points for client-side rendering"""
+    
+    def get(self, request):
+        bounds = None
+        bbox = [request.query_params.get(key) for key in ('south', 'north', 'west', 'east')]
+        if any(bbox):
+            try:
+                bounds = tuple(float(value) for value in bbox)
+            except (TypeError, ValueError):
+                return Response({"error": "south, north, west and east are all required"},
+                                status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'cell_size_km': driver_heatmap.index.cell_size_km,
+            'points': driver_heatmap.points(bounds),
+        })
+
+class FareEstimateView(APIView):
+    """Quote several pickup/destination pairs in one request"""
+    
+    def post(self, request):
+        serializer = FareEstimateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        routes = serializer.validated_data['routes']
+        when = serializer.validated_data.get('time') or timezone.now()
+        plan = fare_engine.plan_for(request.user.id)
+        
+        quote = fare_engine.estimate(
+            [(route['pickup_latitude'], route['pickup_longitude']) for route in routes],
+            [(route['destination_latitude'], route['destination_longitude']) for route in routes],
+            when, plan
+        )
+        return Response({
+            'plan': plan,
+            'multiplier': str(fare_engine.multiplier(when, plan)),
+            'estimates': [
+                {'distance_km': round(distance, 2), 'duration_minutes': round(duration, 1), 'fare': str(fare)}
+                for distance, duration, fare in zip(
+                    quote['distances_km'].tolist(), quote['durations_minutes'].tolist(), quote['fares']
+                )
+            ],
+        })
+
+class TaskQueueStatsView(APIView):
+    """Background job queue depth, outcome counters and latency"""
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        return Response(task_queue.stats())
+
+class LookupCacheStatsView(APIView):
+    """Hit and miss counts of the user, driver profile and subscription lookup cache"""
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        return Response(lookup_cache.stats())
+
+class MetricsView(APIView):
+    """
+    Prometheus scrape endpoint for this process's request metrics
+
+    When METRICS['TOKEN'] is set it must be sent as a bearer token;
+    otherwise only admin users may scrape.
+    """
+    
+    def scrape_token(self):
+        return getattr(settings, 'METRICS', {}).get('TOKEN')
+    
+    def get_authenticators(self):
+        # The scrape token stands in for a user, and its bearer header is not a JWT
+        if self.scrape_token():
+            return []
+        return super().get_authenticators()
+    
+    def get_permissions(self):
+        if self.scrape_token():
+            return []
+        return [permissions.IsAdminUser()]
+    
+    def get(self, request):
+        token = self.scrape_token()
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse(status=401)
+        return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class SlowRequestsView(APIView):
+    """Latest requests over METRICS['SLOW_REQUEST_SECONDS'], with their SQL"""
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        return Response(metrics_registry.slow_requests())
+
+class BookingViewSet(RowListMixin, viewsets.ModelViewSet):
     queryset = Booking.objects.all()
     serializer_class = BookingSerializer
+    row_serializer = booking_rows
+    pagination_class = BookingCursorPagination
     
     def get_queryset(self):
         user = self.request.user
         if user.is_driver:
-            return Booking.objects.filter(driver=user)
-        return Booking.objects.filter(user=user)
+            queryset = Booking.objects.filter(driver=user)
+        else:
+            queryset = Booking.objects.filter(user=user)
+        if self.action == 'accept':
+            # The notification names the driver
+            queryset = queryset.select_related('driver')
+        return queryset
     
-    @action(detail=True, methods=['post'])
-    def accept(self, request, pk=None):
+    def run_transition(self, request, action, apply):
+        """
+        Apply a state machine transition, then apply(booking) for its side effects
+
+        Both run in one transaction. A request carrying an Idempotency-Key
+        header that was already used gets the stored response back instead
+        of running again.
+        """
         booking = self.get_object()
-        booking.status = 'accepted'
-        booking.save()
+        key = request.headers.get('Idempotency-Key')
+        if key:
+            record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+            if record is not None:
+                return self.replay(record, action, booking)
         
-        # Create notification for user
-        Notification.objects.create(
-            user=booking.user,
-            title="Booking Accepted",
-            message=f"Your booking has been accepted by {booking.driver.get_full_name()}",
-            related_booking=booking
-        )
+        try:
+            with transaction.atomic():
+                try:
+                    transition_booking(booking, action)
+                    response = apply(booking)
+                except InvalidTransition as e:
+                    response = Response({"error": str(e), "status": e.status}, status=status.HTTP_409_CONFLICT)
+                if key and not transaction.get_rollback():
+                    IdempotencyKey.objects.create(
+                        user=request.user, key=key, action=action, booking=booking,
+                        response_status=response.status_code, response_body=response.data
+                    )
+        except IntegrityError:
+            # A concurrent request with the same key committed first, or the
+            # error came from the transition itself and is not ours to hide
+            record = IdempotencyKey.objects.filter(user=request.user, key=key).first() if key else None
+            if record is None:
+                raise
+            return self.replay(record, action, booking)
+        return response
+    
+    def replay(self, record, action, booking):
+        if record.action != action or record.booking_id != booking.id:
+            return Response({"error": "Idempotency-Key was already used for a different request"},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return Response(record.response_body, status=record.response_status, headers={'Idempotent-Replayed': 'true'})
+    
+    @action(detail=True, methods=['post'])
+    def accept(self, request, pk=None):
+        def apply(booking):
+            # Notify user once the status change is committed
+            notify(
+                booking.user_id,
+                "Booking Accepted",
+                f"Your booking has been accepted by {booking.driver.get_full_name()}",
+                booking.id
+            )
+            return Response({"success": True})
         
-        return Response({"success": True})
+        return self.run_transition(request, 'accept', apply)
     
     @action(detail=True, methods=['post'])
     def start_trip(self, request, pk=None):
-        booking = self.get_object()
-        booking.status = 'in_progress'
-        booking.save()
-        
-        # Create or update trip
-        trip, created = Trip.objects.get_or_create(booking=booking)
-        trip.start_time = timezone.now()
-        trip.save()
-        
-        # Notify user
-        Notification.objects.create(
-            user=booking.user,
-            title="Trip Started",
-            message="Your trip has started",
-            related_booking=booking
-        )
+        def apply(booking):
+            # Create or update trip
+            start_time = timezone.now()
+            trip, created = Trip.objects.get_or_create(booking=booking, defaults={'start_time': start_time})
+            if not created:
+                trip.start_time = start_time
+                trip.save(update_fields=['start_time'])
+            
+            # Notify user
+            notify(booking.user_id, "Trip Started", "Your trip has started", booking.id)
+            return Response({"success": True})
         
-        return Response({"success": True})
+        return self.run_transition(request, 'start_trip', apply)
     
     @action(detail=True, methods=['post'])
     def complete_trip(self, request, pk=None):
-        booking = self.get_object()
-        booking.status = 'completed'
-        booking.save()
-        
-        # Update trip
-        try:
-            trip = Trip.objects.get(booking=booking)
+        def apply(booking):
+            # Update trip; only the request that won the transition gets here,
+            # so exactly one Payment is created
+            try:
+                trip = Trip.objects.get(booking=booking)
+            except Trip.DoesNotExist:
+                transaction.set_rollback(True)
+                return Response({"error": "Trip not found"}, status=status.HTTP_404_NOT_FOUND)
             trip.end_time = timezone.now()
-            
-            # Calculate distance and fare (simplified)
-            duration = (trip.end_time - trip.start_time).total_seconds() / 3600  # hours
-            trip.distance = float(request.data.get('distance', 0))
-            base_fare = 5.00
-            distance_fare = trip.distance * 1.5  # $1.5 per km
-            time_fare = duration * 10  # $10 per hour
-            trip.total_fare = base_fare + distance_fare + time_fare
-            trip.save()
+            # Distance along the simplified GPS trace, if one was recorded
+            recorded = finish_trace(trip.id)
+            trip.distance = recorded if recorded is not None else float(request.data.get('distance', 0))
+            duration = (trip.end_time - trip.start_time).total_seconds() / 60  # minutes
+            trip.total_fare = fare_engine.trip_fare(
+                trip.distance, duration, when=trip.start_time, plan=fare_engine.plan_for(booking.user_id)
+            )
+            trip.save(update_fields=['end_time', 'distance', 'total_fare'])
             
             # Create payment record
             Payment.objects.create(
@@ -237,17 +407,32 @@ class BookingViewSet(viewsets.ModelViewSet):
                 status='pending'
             )
             
+            # The driver can be dispatched again
+            release_driver(booking)
+            
             # Notify user
-            Notification.objects.create(
-                user=booking.user,
-                title="Trip Completed",
-                message=f"Your trip has been completed. Total fare: ${trip.total_fare}",
-                related_booking=booking
+            notify(
+                booking.user_id,
+                "Trip Completed",
+                f"Your trip has been completed. Total fare: ${trip.total_fare}",
+                booking.id
             )
             
             return Response({"success": True, "total_fare": trip.total_fare})
-        except Trip.DoesNotExist:
-            return Response({"error": "Trip not found"}, status=status.HTTP_404_NOT_FOUND)
+        
+        return self.run_transition(request, 'complete_trip', apply)
+    
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        def apply(booking):
+            # Tell the other party
+            other = booking.driver_id if request.user.id == booking.user_id else booking.user_id
+            if other is not None:
+                notify(other, "Booking Cancelled", "Your booking has been cancelled", booking.id)
+            release_driver(booking)
+            return Response({"success": True})
+        
+        return self.run_transition(request, 'cancel', apply)
         
 #####################################
     # 3. Add a function to calculate trip distance in BookingViewSet
@@ -317,18 +502,60 @@ class TripViewSet(viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         user = self.request.user
         if user.is_driver:
-            return Trip.objects.filter(booking__driver=user)
-        return Trip.objects.filter(booking__user=user)
+            queryset = Trip.objects.filter(booking__driver=user)
+        else:
+            queryset = Trip.objects.filter(booking__user=user)
+        if self.action == 'trace':
+            queryset = queryset.select_related('trace')
+        return queryset
+    
+    @action(detail=True)
+    def trace(self, request, pk=None):
+        """
+        Recorded GPS trace as an encoded polyline plus per-point time offsets
+
+        ?from=N skips the first N points, so a client replaying a trip in
+        progress only fetches what it has not seen; next is the N to use
+        on the following request. Completed trips return the simplified
+        path (simplified=true).
+        """
+        trip = self.get_object()
+        try:
+            start = max(int(request.query_params.get('from', 0)), 0)
+        except ValueError:
+            return Response({"error": "from must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        trace = getattr(trip, 'trace', None)
+        if trace is None:
+            return Response({'started_at_ms': None, 'distance_km': 0.0, 'polyline': '', 'offsets_ms': [], 'next': 0,
+                             'simplified': False})
+        
+        lats, lngs, times = decode_points(trace.points, trace.started_at_ms)
+        return Response({
+            'started_at_ms': trace.started_at_ms,
+            'distance_km': round(trace.distance_km, 3),
+            'polyline': encode_polyline(lats[start:], lngs[start:]),
+            'offsets_ms': (times[start:] - trace.started_at_ms).tolist(),
+            'next': trace.point_count,
+            'simplified': trace.simplified,
+        })
 
 class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
+    pagination_class = TimestampCursorPagination
     
     def get_queryset(self):
         user = self.request.user
         if user.is_driver:
-            return Payment.objects.filter(trip__booking__driver=user)
-        return Payment.objects.filter(trip__booking__user=user)
+            queryset = Payment.objects.filter(trip__booking__driver=user)
+        else:
+            queryset = Payment.objects.filter(trip__booking__user=user)
+        if self.action == 'process_payment':
+            # Already joined for the filter; the notifications read the
+            # trip and booking
+            queryset = queryset.select_related('trip__booking')
+        return queryset
     
     @action(detail=True, methods=['post'])
     def process_payment(self, request, pk=None):
@@ -337,14 +564,14 @@ class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
         # In a real app, integrate with payment gateway here
         payment.status = 'completed'
         payment.transaction_id = f"TX-{timezone.now().strftime('%Y%m%d%H%M%S')}"
-        payment.save()
+        payment.save(update_fields=['status', 'transaction_id'])
         
         # Notify user
-        Notification.objects.create(
-            user=payment.trip.booking.user,
-            title="Payment Successful",
-            message=f"Your payment of ${payment.amount} was successful",
-            related_booking=payment.trip.booking
+        notify(
+            payment.trip.booking.user_id,
+            "Payment Successful",
+            f"Your payment of ${payment.amount} was successful",
+            payment.trip.booking_id
         )
         
         return Response({"success": True})
@@ -362,6 +589,11 @@ class ReviewViewSet(viewsets.ModelViewSet):
     def create(self, request, *args, **kwargs):
         request.data['user'] = request.user.id
         return super().create(request, *args, **kwargs)
+    
+    def perform_create(self, serializer):
+        # The review and its driver's rating aggregates are written together
+        with transaction.atomic():
+            serializer.save()
 
 class SubscriptionViewSet(viewsets.ModelViewSet):
     queryset = Subscription.objects.all()
@@ -370,21 +602,30 @@ class SubscriptionViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Subscription.objects.filter(user=self.request.user)
 
-class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
+class NotificationViewSet(RowListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
+    row_serializer = notification_rows
+    pagination_class = TimestampCursorPagination
     
     def get_queryset(self):
-        return Notification.objects.filter(user=self.request.user).order_by('-timestamp')
+        return Notification.objects.filter(user=self.request.user)
     
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
         notification = self.get_object()
-        notification.is_read = True
-        notification.save()
+        # Conditional update, so the counter only moves when this request flipped it
+        if Notification.objects.filter(pk=notification.pk, is_read=False).update(is_read=True):
+            adjust_unread_count(request.user.id, -1)
         return Response({"success": True})
     
     @action(detail=False, methods=['post'])
     def mark_all_as_read(self, request):
-        Notification.objects.filter(user=request.user).update(is_read=True)
-        return Response({"success": True})
\ No newline at end of file
+        updated = Notification.objects.filter(user=request.user, is_read=False).update(is_read=True)
+        adjust_unread_count(request.user.id, -updated)
+        return Response({"success": True})
+    
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        """Unread badge count, served from cache"""
+        return Response({"unread": get_unread_count(request.user.id)})
\ No newline at end of file
@@ -10,18 +10,25 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'designated_driver_API.settings')
+
+# Sets Django up, so it must run before anything importing models
+django_application = get_asgi_application()
+
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
+from api.authentication import JWTAuthMiddleware
 from api.routing import websocket_urlpatterns
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'designated_driver_API.settings')
-
-application = get_asgi_application()
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_application,
+    # Session cookies, or the REST API's JWT access tokens
     "websocket": AuthMiddlewareStack(
-        URLRouter(
-            websocket_urlpatterns
+        JWTAuthMiddleware(
+            URLRouter(
+                websocket_urlpatterns
+            )
         )
     ),
 })
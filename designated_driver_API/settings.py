@@ -12,7 +12,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from datetime import timedelta
 from pathlib import Path
-#import os
+import os
+from .database import database_config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -50,6 +51,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so its timings cover the rest of the stack
+    'api.middleware.RequestLogMiddleware',
+    'api.middleware.ProfilingMiddleware',
+    # Before anything that reads or changes the response body
+    'api.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -62,11 +68,25 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
-    )
+    ),
+    # Cursor (keyset) pagination; see api/pagination.py
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.IdCursorPagination',
+    'PAGE_SIZE': 20,
+    # orjson-backed JSON, byte-identical to DRF's (stock DRF without orjson);
+    # see api/renderers.py
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'api.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
 SIMPLE_JWT = {
@@ -108,12 +128,13 @@ CHANNEL_LAYERS = {
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
+# Configured from DATABASE_URL and DB_* environment variables, see
+# designated_driver_API/database.py. Postgres needs psycopg (and
+# psycopg[pool] for DB_POOL=1). `manage.py bench_db_writes` compares the
+# modes under concurrent writes.
 
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_config(os.environ, BASE_DIR),
 }
 
 
@@ -164,3 +185,230 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'api.User'
 
+
+# Live driver locations
+# Location pings go to this store and are written back to DriverProfile in
+# batches every WRITE_BEHIND_SECONDS. The in-memory backend keeps a grid
+# index per process and reloads it from the database every refresh_seconds;
+# multi-process deployments should share positions through Redis instead:
+#
+# DRIVER_LOCATION_STORE = {
+#     'BACKEND': 'api.location_store.RedisLocationStore',
+#     'OPTIONS': {'url': 'redis://127.0.0.1:6379/1'},
+#     'WRITE_BEHIND_SECONDS': 5,
+# }
+#
+# and run `manage.py flush_driver_locations --interval 5` next to the web
+# workers. Set to None to search the database directly.
+
+DRIVER_LOCATION_STORE = {
+    'BACKEND': 'api.location_store.InMemoryLocationStore',
+    'OPTIONS': {
+        'cell_size_km': 1.0,
+        'refresh_seconds': 60,
+    },
+    'WRITE_BEHIND_SECONDS': 5,
+}
+
+# WebSocket location pings are coalesced per driver and persisted in one
+# batch every FLUSH_INTERVAL seconds, or sooner once MAX_BATCH drivers wait.
+# Failed batches are retried after RETRY_DELAY seconds; a driver's fix that
+# fails MAX_ATTEMPTS flushes in a row is saved alone or dropped.
+
+LOCATION_INGEST = {
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_BATCH': 500,
+    'MAX_ATTEMPTS': 3,
+    'RETRY_DELAY': 1.0,
+}
+
+# Location fan-out deadband: a ping is broadcast to the driver's group only
+# if it moved MIN_DISTANCE_METERS or HEARTBEAT_SECONDS passed since the last
+# broadcast, and never more often than every MIN_INTERVAL_SECONDS.
+
+LOCATION_BROADCAST = {
+    'MIN_DISTANCE_METERS': 10,
+    'MIN_INTERVAL_SECONDS': 1.0,
+    'HEARTBEAT_SECONDS': 10.0,
+}
+
+# Driver heatmap: density is kept per CELL_SIZE_KM grid cell and rebuilt
+# from the database every REBUILD_SECONDS. Rendered maps are cached for
+# CACHE_TTL seconds, or until INVALIDATE_FRACTION of drivers (at least
+# MIN_CHANGES) have changed cell.
+
+DRIVER_HEATMAP = {
+    'CELL_SIZE_KM': 0.5,
+    'CACHE_TTL': 60,
+    'REBUILD_SECONDS': 60,
+    'INVALIDATE_FRACTION': 0.05,
+    'MIN_CHANGES': 5,
+}
+
+# Background job queue (api/tasks.py) for notifications, email and push.
+# Jobs are queued once the request's transaction commits and run on
+# WORKERS threads; failures are retried MAX_RETRIES times with exponential
+# backoff starting at RETRY_DELAY seconds. EAGER runs jobs inline.
+TASK_QUEUE = {
+    'WORKERS': 4,
+    'MAX_RETRIES': 3,
+    'RETRY_DELAY': 1.0,
+    'EAGER': False,
+}
+
+# Notification WebSocket (ws/notifications/<user_id>/): reconnecting
+# clients are replayed at most MAX_REPLAY missed notifications.
+NOTIFICATION_STREAM = {
+    'MAX_REPLAY': 100,
+}
+
+# Notifications (api/notifications.py) queued by a transaction are
+# bulk-inserted when it commits. Unread counters are cached for
+# UNREAD_COUNT_TTL seconds.
+NOTIFICATIONS = {
+    'UNREAD_COUNT_TTL': 3600,
+}
+
+# Dispatcher (api/dispatch.py, run by `manage.py dispatch_bookings`):
+# every WINDOW_SECONDS, up to MAX_BATCH unassigned bookings are matched to
+# idle drivers within RADIUS_KM of the pickup. MODE is 'optimal' (minimum
+# total pickup distance) or 'greedy' (closest pairs first).
+DISPATCH = {
+    'WINDOW_SECONDS': 2.0,
+    'RADIUS_KM': 5.0,
+    'MODE': 'optimal',
+    'MAX_BATCH': 200,
+}
+
+# Fares (api/fares.py). Money amounts are strings so they stay exact.
+# SURGE rules multiply fares during the given hours ([start, end)) of the
+# given weekdays (0 = Monday); PLAN_DISCOUNTS take a fraction off for
+# riders with an active subscription. Estimates assume ROUTE_FACTOR km of
+# road per straight-line km, driven at AVERAGE_SPEED_KMH. At most
+# MAX_ESTIMATES trips are priced per request.
+FARES = {
+    'BASE_FARE': '5.00',
+    'PER_KM': '1.50',
+    'PER_MINUTE': '0.25',
+    'MINIMUM_FARE': '5.00',
+    'SURGE': [
+        # Friday and Saturday nights
+        {'days': [4, 5], 'hours': (21, 24), 'multiplier': '1.5'},
+        {'days': [5, 6], 'hours': (0, 3), 'multiplier': '1.5'},
+        # Weekday evening rush
+        {'days': [0, 1, 2, 3, 4], 'hours': (17, 19), 'multiplier': '1.2'},
+    ],
+    'PLAN_DISCOUNTS': {
+        'basic': '0.05',
+        'premium': '0.10',
+        'business': '0.15',
+    },
+    'ROUTE_FACTOR': 1.3,
+    'AVERAGE_SPEED_KMH': 30,
+    'MAX_ESTIMATES': 50,
+}
+
+# Geocoding (api/geocoding.py). Without an API key only cached addresses
+# resolve. Results are cached in-process (CACHE_SIZE entries) and in the
+# GeocodedAddress table for TTL seconds; addresses with no match are
+# remembered for NEGATIVE_TTL seconds. Requests time out after TIMEOUT
+# seconds, are retried RETRIES times on 5xx, and batches run at most
+# CONCURRENCY at once.
+GOOGLE_MAPS_API_KEY = ''
+
+GEOCODING = {
+    'TIMEOUT': 5.0,
+    'CACHE_SIZE': 10000,
+    'TTL': 30 * 24 * 3600,
+    'NEGATIVE_TTL': 24 * 3600,
+    'CONCURRENCY': 8,
+    'RETRIES': 2,
+}
+
+# Trip traces (api/traces.py). Fixes closer than MIN_STEP_METERS to the
+# last recorded point are GPS jitter, and fixes implying more than
+# MAX_SPEED_KMH are outliers; neither is recorded. Completed traces are
+# simplified (Douglas-Peucker) to within SIMPLIFY_TOLERANCE_METERS and
+# charged by the simplified length.
+TRIP_TRACES = {
+    'MIN_STEP_METERS': 10.0,
+    'MAX_SPEED_KMH': 200.0,
+    'SIMPLIFY_TOLERANCE_METERS': 10.0,
+}
+
+# Cache. Processes share one through Redis when REDIS_CACHE_URL is set
+# (e.g. redis://127.0.0.1:6379/2); otherwise, as in tests, each process
+# has its own in-memory cache.
+if os.environ.get('REDIS_CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_CACHE_URL'],
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'designated-driver',
+        },
+    }
+
+# Read-through cache of users (for JWT authentication), driver profile ids
+# and active subscriptions (api/lookups.py), kept for TTL seconds and
+# invalidated when the rows change. A miss is loaded once; concurrent
+# requests wait up to LOCK_TIMEOUT seconds for it. Hit rates are served
+# at cache/stats/.
+LOOKUP_CACHE = {
+    'ENABLED': True,
+    'TTL': 300,
+    'LOCK_TIMEOUT': 5.0,
+}
+
+# Driver ratings (api/ratings.py). Besides the all-time average each
+# driver has rating_recent, a moving average weighted towards their last
+# RECENT_WINDOW reviews. `manage.py rebuild_driver_ratings` recomputes
+# both from the Review table.
+RATINGS = {
+    'RECENT_WINDOW': 20,
+}
+
+# Request metrics (api/metrics.py), exported for Prometheus at /metrics,
+# which requires TOKEN as a bearer token when it is set and an admin user
+# when it is not. Requests slower
+# than SLOW_REQUEST_SECONDS are kept with up to MAX_SQL_STATEMENTS of
+# their SQL; the latest SLOW_REQUEST_SAMPLES are listed at metrics/slow/.
+METRICS = {
+    'TOKEN': os.environ.get('METRICS_TOKEN'),
+    'SLOW_REQUEST_SECONDS': 1.0,
+    'SLOW_REQUEST_SAMPLES': 50,
+    'MAX_SQL_STATEMENTS': 50,
+}
+
+# Request profiling (api.middleware.ProfilingMiddleware), off unless
+# ENABLED. Requests sending `X-Profile: <TOKEN>`, a random SAMPLE_RATE
+# fraction of requests, and requests to ROUTES taking at least their
+# threshold in seconds, e.g. {'driver-profiles/radius-search/': 0.25},
+# are profiled into DIRECTORY, keeping the newest MAX_PROFILES. MODE
+# 'stack' samples stacks every INTERVAL seconds (collapsed format, for
+# flamegraphs); 'cprofile' records every call (pstats) at a higher cost.
+# List and aggregate them with `manage.py profiles`.
+PROFILING = {
+    'ENABLED': os.environ.get('PROFILING_ENABLED') == '1',
+    'MODE': 'stack',
+    'TOKEN': os.environ.get('PROFILING_TOKEN'),
+    'SAMPLE_RATE': 0.0,
+    'ROUTES': {},
+    'INTERVAL': 0.005,
+    'DIRECTORY': BASE_DIR / 'profiles',
+    'MAX_PROFILES': 500,
+}
+
+# Response compression (api.middleware.CompressionMiddleware): bodies of
+# at least MIN_SIZE bytes are sent brotli-compressed at BROTLI_QUALITY
+# when the client accepts it and the brotli package is installed, else
+# gzipped.
+COMPRESSION = {
+    'MIN_SIZE': 1024,
+    'BROTLI_QUALITY': 5,
+}